@@ -1,4 +1,17 @@
-from .config import ConfigurationError
-from .server import run_app
+from typing import Any
 
 __all__ = ('run_app', 'ConfigurationError')
+
+
+def __getattr__(name: str) -> Any:
+    """
+    The modules are imported when they're needed, so e.g. the process pool workers
+    don't import the web server along with the package
+    """
+    if name == 'run_app':
+        from .server import run_app
+        return run_app
+    if name == 'ConfigurationError':
+        from .listener import ConfigurationError
+        return ConfigurationError
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
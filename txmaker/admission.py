@@ -0,0 +1,131 @@
+import asyncio
+import math
+import time
+from collections import Counter, deque
+from typing import Awaitable, Callable, Collection, Deque, Optional
+
+from aiohttp import web
+
+from .config import settings
+from .metrics import ADMISSION_QUEUE, ADMISSION_REJECTIONS
+from .utils import error_response
+
+Handler = Callable[[web.Request], Awaitable[web.StreamResponse]]
+
+
+class Overloaded(Exception):
+    def __init__(self, reason: str, retry_after: float) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Lets at most `max_in_flight` requests be handled at once, up to `max_queue` more wait for their turn
+    in FIFO order. A request is rejected right away when the queue is full or when it couldn't be started
+    within `queue_timeout` seconds judging by the recent handling times, so it doesn't wait for nothing.
+
+    exempt_paths -- paths handled regardless of the load (e.g. /metrics)
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int, queue_timeout: float,
+                 exempt_paths: Collection[str] = (), clock: Callable[[], float] = time.monotonic) -> None:
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.exempt_paths = frozenset(exempt_paths)
+        self.clock = clock
+        self.in_flight = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        # exponentially weighted moving average of handling times
+        self.service_time: Optional[float] = None
+        self.stats: Counter = Counter()
+
+    def expected_wait(self, position: int) -> float:
+        """
+        Estimated seconds until the request at the given queue position (starting with 1) is started
+        """
+        if self.service_time is None:
+            return 0.0
+        return position * self.service_time / self.max_in_flight
+
+    def reject(self, reason: str, retry_after: float) -> Overloaded:
+        self.stats[reason] += 1
+        ADMISSION_REJECTIONS.labels(reason).inc()
+        return Overloaded(reason, retry_after)
+
+    async def acquire(self) -> None:
+        if self.in_flight < self.max_in_flight and not self.waiters:
+            self.in_flight += 1
+            return
+
+        position = len(self.waiters) + 1
+        expected_wait = self.expected_wait(position)
+        if position > self.max_queue:
+            raise self.reject('queue_full', expected_wait)
+        if expected_wait > self.queue_timeout:
+            raise self.reject('deadline', expected_wait)
+
+        waiter = asyncio.get_event_loop().create_future()
+        self.waiters.append(waiter)
+        ADMISSION_QUEUE.inc()
+        try:
+            done, _ = await asyncio.wait((waiter,), timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            self.abandon(waiter)
+            raise
+        finally:
+            ADMISSION_QUEUE.dec()
+        if not done:
+            self.abandon(waiter)
+            raise self.reject('deadline', self.expected_wait(len(self.waiters) + 1))
+
+    def abandon(self, waiter: asyncio.Future) -> None:
+        if waiter.done():
+            # the slot has been handed over already
+            self.release()
+        else:
+            waiter.cancel()
+            self.waiters.remove(waiter)
+
+    def release(self) -> None:
+        """
+        Hands the slot over to the first waiting request
+        """
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def record(self, elapsed: float) -> None:
+        if self.service_time is None:
+            self.service_time = elapsed
+        else:
+            self.service_time += 0.2 * (elapsed - self.service_time)
+
+    @web.middleware
+    async def middleware(self, request: web.Request, handler: Handler) -> web.StreamResponse:
+        if request.path in self.exempt_paths:
+            return await handler(request)
+        try:
+            await self.acquire()
+        except Overloaded as e:
+            response = error_response('overloaded', 'The service is overloaded, try again later', status_code=503)
+            response.headers['Retry-After'] = str(max(math.ceil(e.retry_after), 1))
+            return response
+        started = self.clock()
+        try:
+            return await handler(request)
+        finally:
+            self.record(self.clock() - started)
+            self.release()
+
+    @classmethod
+    def from_settings(cls, exempt_paths: Collection[str] = ()) -> Optional['AdmissionController']:
+        if settings.max_in_flight <= 0:
+            return None
+        return cls(settings.max_in_flight, settings.admission_max_queue, settings.admission_queue_timeout,
+                   exempt_paths=exempt_paths)
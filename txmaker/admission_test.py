@@ -0,0 +1,80 @@
+import asyncio
+from typing import Any, List
+
+import pytest
+from aiohttp import web
+
+from .admission import AdmissionController, Overloaded
+
+
+async def test_admission_queue(loop: Any) -> None:
+    admission = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=1)
+    await admission.acquire()
+    started: List[int] = []
+
+    async def request(n: int) -> None:
+        await admission.acquire()
+        started.append(n)
+
+    queued = asyncio.ensure_future(request(1))
+    await asyncio.sleep(0)
+    assert len(admission.waiters) == 1
+
+    with pytest.raises(Overloaded) as e:
+        await admission.acquire()
+    assert e.value.reason == 'queue_full'
+
+    admission.release()
+    await queued
+    assert started == [1]
+    assert admission.in_flight == 1
+    admission.release()
+    assert admission.in_flight == 0
+
+
+async def test_admission_deadline(loop: Any) -> None:
+    admission = AdmissionController(max_in_flight=1, max_queue=10, queue_timeout=0.01)
+    await admission.acquire()
+    with pytest.raises(Overloaded) as e:
+        await admission.acquire()
+    assert e.value.reason == 'deadline'
+    assert not admission.waiters
+
+    # requests which couldn't start in time are rejected without waiting
+    admission.record(1.0)
+    with pytest.raises(Overloaded) as e:
+        await asyncio.wait_for(admission.acquire(), 0.005)
+    assert e.value.retry_after == 1.0
+    assert admission.stats['deadline'] == 2
+
+
+async def test_admission_middleware(aiohttp_client: Any) -> None:
+    admission = AdmissionController(max_in_flight=1, max_queue=0, queue_timeout=1, exempt_paths={'/metrics'})
+    handling = asyncio.Event()
+    done = asyncio.Event()
+
+    async def slow(request: web.Request) -> web.Response:
+        handling.set()
+        await done.wait()
+        return web.Response(text='ok')
+
+    async def metrics(request: web.Request) -> web.Response:
+        return web.Response(text='metrics')
+
+    app = web.Application(middlewares=[admission.middleware])
+    app.add_routes([web.get('/slow', slow), web.get('/metrics', metrics)])
+    client = await aiohttp_client(app)
+
+    first = asyncio.ensure_future(client.get('/slow'))
+    await handling.wait()
+    response = await client.get('/slow')
+    assert response.status == 503
+    assert response.headers['Retry-After'] == '1'
+    assert (await response.json())['error']['code'] == 'overloaded'
+
+    response = await client.get('/metrics')
+    assert response.status == 200
+
+    done.set()
+    assert (await first).status == 200
+    assert admission.in_flight == 0
@@ -0,0 +1,456 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple, cast
+
+from aiohttp import web
+from pydantic import BaseModel, ConstrainedDecimal, conint, constr
+
+from .admission import AdmissionController
+from .bitcoin import (
+    MIN_OUTPUT_SIZE,
+    MIN_RELAY_FEE,
+    InsufficientFunds,
+    Unspent,
+    UpstreamRejected,
+    create_unsigned_transaction,
+    is_valid_address,
+    listing_keys,
+    load_all_unspent,
+    make_client_session,
+    parse_address,
+    select_transaction_inputs
+)
+from .cache import UPSTREAM_ERRORS, SingleFlight, UnspentLoader, UtxoCache, memoize_loader
+from .coinselect import CoinSelection, make_strategy
+from .config import settings
+from .fees import FeeOracle, FeeRatesUnavailable, FeeTarget
+from .idempotency import ResponseCache, idempotent, request_hash
+# metrics_handler is served by server.ROUTES
+from .metrics import in_progress_middleware, metrics_handler, server_timing, watch_connector  # noqa: F401
+from .payouts import PayoutBatcher
+from .profiling import SlowRequestProfiler
+from .providers import make_provider
+from .rawtx import serialize_transaction
+from .reservations import Reservation, ReservationConflict, ReservationLedger, reservation_id, unspent_outpoint
+from .resilience import UpstreamGuard
+from .utils import error_body, error_response, json_response, validate_request
+
+logger = logging.getLogger(__name__)
+
+# the app's state is kept apart from the web.Application, as it's set up after the app has started
+State = Dict[str, Any]
+
+BitcoinAddress: constr = constr(min_length=1, max_length=100)
+
+
+class BitcoinAmount(ConstrainedDecimal):
+    ge = MIN_OUTPUT_SIZE
+    decimal_places = 8
+
+
+class CreateTransactionRequest(BaseModel):
+    source_address: Optional[BitcoinAddress] = None
+    source_addresses: List[BitcoinAddress] = []
+    change_address: Optional[BitcoinAddress] = None
+    outputs: Dict[BitcoinAddress, BitcoinAmount]
+    # satoshi per 1000 bytes, the current estimate for fee_target is used if it's omitted
+    fee_kb: Optional[conint(ge=MIN_RELAY_FEE)] = None  # type: ignore
+    fee_target: FeeTarget = FeeTarget.normal
+    coin_selection: CoinSelection = CoinSelection.fifo
+
+
+class CreateTransactionBatchRequest(BaseModel):
+    transactions: List[CreateTransactionRequest]
+
+
+def get_source_addresses(req_obj: CreateTransactionRequest) -> List[str]:
+    addresses = list(req_obj.source_addresses)
+    if req_obj.source_address is not None:
+        addresses.insert(0, req_obj.source_address)
+    return list(dict.fromkeys(addresses))
+
+
+def make_unspent_loader(state: State) -> UnspentLoader:
+    # the upstream calls are guarded page by page, the rest handles all the outputs of an address at once
+    page_loader = state['upstream_guard'].wrap(state['utxo_provider'].get_unspent)
+    loader: UnspentLoader = partial(load_all_unspent, page_loader)
+    loader = state['unspent_flights'].wrap(loader)
+    if state['utxo_cache'] is not None:
+        loader = state['utxo_cache'].wrap(loader)
+    return loader
+
+
+class TransactionParams(NamedTuple):
+    """
+    Everything about a transaction but its outputs, payouts with the same params can be paid together
+    """
+    source_addresses: Tuple[str, ...]
+    change_address: Optional[str]
+    fee_kb: int
+    coin_selection: CoinSelection
+
+
+# makes a transaction (or a quote) for valid params and outputs, returns a response body and a status code
+MakeTransaction = Callable[[TransactionParams, List[Tuple[str, Decimal]]], Awaitable[Tuple[Dict[str, Any], int]]]
+
+
+def check_transaction_request(req_obj: CreateTransactionRequest) -> Optional[Dict[str, Any]]:
+    """
+    Returns an error body if the request is invalid
+    """
+    if not req_obj.outputs:
+        return error_body('empty_outputs', 'You have to specify at least one output')
+
+    source_addresses = get_source_addresses(req_obj)
+    if not source_addresses:
+        return error_body('empty_source_addresses', 'You have to specify at least one source address')
+
+    invalid_sources = [addr for addr in source_addresses if not is_valid_address(addr)]
+    if invalid_sources:
+        return error_body('invalid_source_address',
+                          f'Please specify a valid source address (network: {settings.btc_network})',
+                          details={'invalid_addresses': invalid_sources})
+
+    if any(parse_address(addr).script_type == 'p2sh' for addr in source_addresses):
+        return error_body('unsupported_source_address', 'P2SH source addresses are not supported')
+
+    if req_obj.change_address is not None and not is_valid_address(req_obj.change_address):
+        return error_body('invalid_change_address',
+                          f'Please specify a valid change address (network: {settings.btc_network})')
+
+    invalid_outputs = []
+    for output in req_obj.outputs.keys():
+        if not is_valid_address(output):
+            invalid_outputs.append(output)
+
+    if invalid_outputs:
+        return error_body('invalid_output_addresses',
+                          f'Please specify a valid output addresses (network: {settings.btc_network})',
+                          details={'invalid_addresses': invalid_outputs})
+    return None
+
+
+def get_transaction_params(state: State, req_obj: CreateTransactionRequest) -> TransactionParams:
+    """
+    Raises FeeRatesUnavailable if the request has no fee_kb and there's no estimate
+    """
+    fee_kb = req_obj.fee_kb
+    if fee_kb is None:
+        fee_kb = state['fee_oracle'].fee_kb(req_obj.fee_target)
+    return TransactionParams(tuple(get_source_addresses(req_obj)), req_obj.change_address, fee_kb,
+                             req_obj.coin_selection)
+
+
+def inputs_body(inputs: List[Unspent]) -> List[Dict[str, Any]]:
+    return [{
+        'txid': u.txid,
+        'vout': u.txindex,
+        'script_pub_key': u.script,
+        'amount': u.amount
+    } for u in inputs]
+
+
+def upstream_rejected(e: UpstreamRejected) -> Tuple[Dict[str, Any], int]:
+    # e.g. blockchain.info doesn't take some valid address, repeating the request won't help
+    return error_body('upstream_rejected', str(e), details={'upstream_status': e.status}), 400
+
+
+async def make_transaction(state: State, loader: UnspentLoader, params: TransactionParams,
+                           outputs: Sequence[Tuple[str, Decimal]]) -> Tuple[Dict[str, Any], int]:
+    """
+    Returns a response body and a status code for a valid transaction request
+    """
+    ledger = state['reservations']
+    for n_retry in range(settings.reservation_retries + 1):
+        try:
+            raw_tx, inputs = await create_unsigned_transaction(
+                loader=loader,
+                strategy=make_strategy(params.coin_selection),
+                source_addresses=params.source_addresses,
+                change_address=params.change_address,
+                outputs_dict=outputs,
+                fee_kb=params.fee_kb,
+                executor=state['tx_executor'],
+                reserved=ledger if ledger is not None else (),
+            )
+        except InsufficientFunds as e:
+            return error_body('insufficient_funds', str(e)), 400
+        except UpstreamRejected as e:
+            return upstream_rejected(e)
+        except UPSTREAM_ERRORS:
+            return error_body('upstream_unavailable',
+                              'Unspent outputs are temporarily unavailable, try again later'), 503
+
+        if ledger is None:
+            break
+        try:
+            # concurrent requests may have selected the same inputs meanwhile, the first one to reserve them wins
+            reservation = ledger.reserve(reservation_id(raw_tx), map(unspent_outpoint, inputs))
+            break
+        except ReservationConflict as e:
+            if n_retry == settings.reservation_retries:
+                return error_body('reservation_conflict', str(e)), 409
+
+    # the reservation keeps the selected inputs from being spent twice, otherwise the cached listing is outdated
+    if ledger is None and state['utxo_cache'] is not None:
+        for key in listing_keys(params.source_addresses):
+            state['utxo_cache'].invalidate(key)
+
+    body = {
+        'raw': raw_tx.hex(),
+        'inputs': inputs_body(inputs),
+    }
+    if ledger is not None:
+        body['reservation_id'] = reservation.id
+    return body, 201
+
+
+async def make_quote(state: State, loader: UnspentLoader, params: TransactionParams,
+                     outputs: Sequence[Tuple[str, Decimal]]) -> Tuple[Dict[str, Any], int]:
+    """
+    Selects the inputs of a transaction without making it, nothing is reserved
+    """
+    ledger = state['reservations']
+    try:
+        inputs, tx_outputs = await select_transaction_inputs(
+            loader=loader,
+            strategy=make_strategy(params.coin_selection),
+            source_addresses=params.source_addresses,
+            change_address=params.change_address,
+            outputs_dict=outputs,
+            fee_kb=params.fee_kb,
+            reserved=ledger if ledger is not None else (),
+        )
+    except InsufficientFunds as e:
+        return error_body('insufficient_funds', str(e)), 400
+    except UpstreamRejected as e:
+        return upstream_rejected(e)
+    except UPSTREAM_ERRORS:
+        return error_body('upstream_unavailable', 'Unspent outputs are temporarily unavailable, try again later'), 503
+
+    return {
+        'inputs': inputs_body(inputs),
+        # in satoshi, the change below the dust threshold goes to the fee
+        'fee': sum(u.amount for u in inputs) - sum(amount for _, amount in tx_outputs),
+        'change': sum(amount for _, amount in tx_outputs[len(outputs):]),
+        'fee_kb': params.fee_kb,
+    }, 200
+
+
+async def handle_transaction_request(req_obj: CreateTransactionRequest, state: State,
+                                     make: MakeTransaction) -> Tuple[Dict[str, Any], int]:
+    """
+    Validates a transaction request, the valid one is handled by `make`.
+    Returns a response body and a status code
+    """
+    error = check_transaction_request(req_obj)
+    if error is not None:
+        return error, 400
+
+    try:
+        params = get_transaction_params(state, req_obj)
+    except FeeRatesUnavailable as e:
+        return error_body('fee_rates_unavailable', str(e)), 503
+
+    return await make(params, list(cast(Dict[str, Decimal], req_obj.outputs).items()))
+
+
+async def build_transaction(state: State, req_obj: CreateTransactionRequest,
+                            loader: UnspentLoader) -> Tuple[Dict[str, Any], int]:
+    """
+    Returns a response body and a status code for a transaction request
+    """
+    return await handle_transaction_request(req_obj, state, partial(make_transaction, state, loader))
+
+
+@server_timing
+@validate_request(CreateTransactionRequest)
+@idempotent
+async def create_transaction(request: web.Request, req_obj: CreateTransactionRequest) -> web.Response:
+    state = request.app['state']
+    body, status = await build_transaction(state, req_obj, make_unspent_loader(state))
+    return json_response(body, status=status)
+
+
+@validate_request(CreateTransactionBatchRequest)
+@idempotent
+async def create_transactions_batch(request: web.Request, req_obj: CreateTransactionBatchRequest) -> web.Response:
+    if not req_obj.transactions:
+        return error_response('empty_batch', 'You have to specify at least one transaction')
+
+    if len(req_obj.transactions) > settings.batch_max_size:
+        return error_response('batch_too_large', f'A batch may contain at most {settings.batch_max_size} transactions')
+
+    state = request.app['state']
+    # the unspent outputs of every address are fetched once for the whole batch
+    loader = memoize_loader(make_unspent_loader(state))
+    semaphore = asyncio.Semaphore(settings.batch_concurrency)
+
+    async def build(tx_req: CreateTransactionRequest) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                body, status = await build_transaction(state, tx_req, loader)
+            except Exception:
+                # a bug hit by one transaction doesn't fail the others
+                logger.exception('Failed to build a transaction of a batch')
+                body, status = error_body('internal_error', 'Failed to build the transaction'), 500
+        return {'status': status, 'body': body}
+
+    results = await asyncio.gather(*(build(tx_req) for tx_req in req_obj.transactions))
+    return json_response({'results': results})
+
+
+@validate_request(CreateTransactionRequest)
+@idempotent
+async def create_payout(request: web.Request, req_obj: CreateTransactionRequest) -> web.Response:
+    state = request.app['state']
+    body, status = await handle_transaction_request(req_obj, state, state['payout_batcher'].submit)
+    return json_response(body, status=status)
+
+
+async def make_quote_response(request: web.Request, req_obj: CreateTransactionRequest) -> web.Response:
+    state = request.app['state']
+    loader = make_unspent_loader(state)
+    body, status = await handle_transaction_request(req_obj, state, partial(make_quote, state, loader))
+    return json_response(body, status=status)
+
+
+@validate_request(CreateTransactionRequest)
+async def quote_transaction(request: web.Request, req_obj: CreateTransactionRequest) -> web.Response:
+    cache = request.app['state']['quote_cache']
+    if cache is None:
+        return await make_quote_response(request, req_obj)
+    # the same requests get the same quote for a while
+    key = request_hash(request)
+    response, _ = await cache.get_or_make(key, key, partial(make_quote_response, request, req_obj))
+    return response.to_response()
+
+
+async def pay_batch(state: State, params: TransactionParams,
+                    outputs: List[Tuple[str, Decimal]]) -> Tuple[Dict[str, Any], int]:
+    return await make_transaction(state, make_unspent_loader(state), params, outputs)
+
+
+async def get_fee_rates(request: web.Request) -> web.Response:
+    oracle = request.app['state']['fee_oracle']
+    try:
+        fee_rates = oracle.current()
+    except FeeRatesUnavailable as e:
+        return error_response('fee_rates_unavailable', str(e), status_code=503)
+    return json_response({'fee_rates': fee_rates, 'updated_at': oracle.updated_at, 'source': oracle.source.name})
+
+
+def reservation_body(reservation: Reservation, status: str) -> Dict[str, Any]:
+    return {'reservation_id': reservation.id, 'status': status, 'expires_at': reservation.expires_at}
+
+
+async def release_reservation(request: web.Request) -> web.Response:
+    ledger = request.app['state']['reservations']
+    reservation = ledger.release(request.match_info['reservation_id']) if ledger is not None else None
+    if reservation is None:
+        return error_response('reservation_not_found', 'The reservation has expired or never existed', status_code=404)
+    return json_response(reservation_body(reservation, 'released'))
+
+
+async def confirm_reservation(request: web.Request) -> web.Response:
+    ledger = request.app['state']['reservations']
+    reservation = ledger.confirm(request.match_info['reservation_id']) if ledger is not None else None
+    if reservation is None:
+        return error_response('reservation_not_found', 'The reservation has expired or never existed', status_code=404)
+    return json_response(reservation_body(reservation, 'confirmed'))
+
+
+async def start_client_session(state: State) -> None:
+    state['client_session'] = make_client_session()
+    state['utxo_provider'] = make_provider(state['client_session'])
+    state['upstream_guard'] = UpstreamGuard.from_settings(hedging=state['utxo_provider'].hedging,
+                                                          rate_limited=state['utxo_provider'].rate_limited)
+    state['connector_watcher'] = asyncio.ensure_future(watch_connector(state['client_session'].connector))
+    if settings.warm_up:
+        state['readiness'].run('upstream_pool', state['utxo_provider'].warm_up())
+
+
+async def start_fee_oracle(state: State) -> None:
+    state['fee_oracle'] = FeeOracle.from_settings(state['client_session'])
+    state['fee_oracle'].start()
+    state['readiness'].run('fee_rates', state['fee_oracle'].refresh())
+
+
+async def stop_fee_oracle(state: State) -> None:
+    await state['fee_oracle'].close()
+
+
+async def close_client_session(state: State) -> None:
+    state['connector_watcher'].cancel()
+    await asyncio.gather(state['connector_watcher'], return_exceptions=True)
+    await state['utxo_provider'].close()
+    await state['client_session'].close()
+
+
+async def start_tx_executor(state: State) -> None:
+    state['tx_executor'] = None
+    if settings.tx_process_pool_size > 0:
+        state['tx_executor'] = ProcessPoolExecutor(settings.tx_process_pool_size,
+                                                   mp_context=multiprocessing.get_context('spawn'))
+        if settings.warm_up:
+            state['readiness'].run('tx_executor', warm_up_executor(state['tx_executor'], settings.tx_process_pool_size))
+
+
+async def warm_up_executor(executor: ProcessPoolExecutor, size: int) -> None:
+    """
+    Spawns the pool processes and has them import the serialization code,
+    so the first large transaction doesn't wait for it
+    """
+    loop = asyncio.get_event_loop()
+    await asyncio.gather(*(loop.run_in_executor(executor, serialize_transaction, b'', []) for _ in range(size)))
+
+
+async def stop_tx_executor(state: State) -> None:
+    if state['tx_executor'] is not None:
+        await asyncio.get_event_loop().run_in_executor(None, state['tx_executor'].shutdown)
+
+
+async def close_payout_batcher(state: State) -> None:
+    await state['payout_batcher'].close()
+
+
+async def close_utxo_cache(state: State) -> None:
+    await state['unspent_flights'].close()
+    if state['utxo_cache'] is not None:
+        await state['utxo_cache'].close()
+
+
+async def setup(state: State) -> None:
+    """
+    Sets up the state of the app made by server.make_app once the listener is open.
+    The callbacks added to state['cleanup'] are run in reverse order on shutdown
+    """
+    middlewares = [in_progress_middleware]
+    # scraping metrics and probing readiness are cheap and they matter the most under overload
+    admission = AdmissionController.from_settings(exempt_paths={'/metrics', '/ready'})
+    if admission is not None:
+        middlewares.append(admission.middleware)
+    # the time spent waiting for admission isn't profiled
+    profiler = SlowRequestProfiler.from_settings()
+    if profiler is not None:
+        middlewares.append(profiler.middleware)
+    state['middlewares'] = middlewares
+    state['admission'] = admission
+    state['utxo_cache'] = UtxoCache.from_settings()
+    state['unspent_flights'] = SingleFlight()
+    state['reservations'] = ReservationLedger.from_settings()
+    state['idempotency_cache'] = ResponseCache.from_settings(settings.idempotency_cache_max_entries,
+                                                             settings.idempotency_ttl)
+    state['quote_cache'] = ResponseCache.from_settings(settings.quote_cache_max_entries, settings.quote_cache_ttl)
+    state['payout_batcher'] = PayoutBatcher.from_settings(partial(pay_batch, state))
+    for start, stop in ((start_client_session, close_client_session),
+                        (start_fee_oracle, stop_fee_oracle),
+                        (start_tx_executor, stop_tx_executor)):
+        await start(state)
+        state['cleanup'].append(stop)
+    # the queued payouts are paid before the client session is closed
+    state['cleanup'].extend([close_utxo_cache, close_payout_batcher])
@@ -0,0 +1,186 @@
+"""
+Microbenchmarks of the transaction building hot path.
+Runs offline on synthetic unspent outputs:
+
+    python -m txmaker.benchmarks --save        # records a baseline
+    python -m txmaker.benchmarks               # compares against it
+"""
+import argparse
+import asyncio
+import gc
+import json
+import sys
+import time
+from decimal import Decimal
+from functools import partial
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from bit.base58 import b58encode_check
+
+from .bitcoin import (
+    SATOSHI_MULTIPLIER,
+    Output,
+    UtxoSet,
+    calc_out_size,
+    construct_outputs,
+    create_unsigned_transaction,
+    estimate_tx_fee,
+    pack_inputs,
+    select_unspents,
+    serialize_transaction
+)
+from .cache import UnspentLoader
+from .config import settings
+
+UTXO_SET_SIZES = (10, 1000, 100000)
+OUTPUT_COUNTS = (1, 10, 1000)
+UTXO_AMOUNT = 1000000
+FEE_KB = 1000
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+DEFAULT_THRESHOLD = 0.25
+
+Benchmark = Callable[[], object]
+
+
+def make_address(n: int) -> str:
+    version = b'\x6f' if settings.testnet else b'\x00'
+    return b58encode_check(version + n.to_bytes(20, 'big'))
+
+
+def make_utxo_set(size: int) -> UtxoSet:
+    script = '76a914' + '00' * 20 + '88ac'
+    return UtxoSet.from_rows((f'{n:064x}', n % 4, UTXO_AMOUNT, 6 + size - n, script) for n in range(size))
+
+
+def make_outputs(n_outputs: int, utxo_set_size: int) -> List[Output]:
+    """
+    Outputs spending about a half of the unspent outputs
+    """
+    amount = utxo_set_size * UTXO_AMOUNT // 2 // n_outputs
+    return [(make_address(n + 1), amount) for n in range(n_outputs)]
+
+
+def make_benchmarks() -> Iterator[Tuple[str, Benchmark]]:
+    loop = asyncio.new_event_loop()
+    try:
+        yield from make_cases(loop)
+    finally:
+        # lets the abandoned page generators be finalized on the loop
+        gc.collect()
+        loop.run_until_complete(asyncio.sleep(0))
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+
+def make_cases(loop: asyncio.AbstractEventLoop) -> Iterator[Tuple[str, Benchmark]]:
+    source = make_address(0)
+
+    for n_outputs in OUTPUT_COUNTS:
+        addresses = [make_address(n + 1) for n in range(n_outputs)]
+        yield f'calc_out_size[outputs={n_outputs}]', partial(calc_out_size, addresses)
+        outputs = make_outputs(n_outputs, 1000)
+        yield f'construct_outputs[outputs={n_outputs}]', partial(construct_outputs, outputs)
+
+    yield 'estimate_tx_fee', partial(estimate_tx_fee, 100, 14800, 10, 340, FEE_KB)
+
+    for size in UTXO_SET_SIZES:
+        utxos = make_utxo_set(size)
+        for n_outputs in OUTPUT_COUNTS:
+            outputs = make_outputs(n_outputs, size)
+            case = f'utxos={size},outputs={n_outputs}'
+
+            yield f'select_unspents[{case}]', partial(select_unspents, source, utxos, outputs, FEE_KB)
+
+            outputs_dict = {addr: Decimal(amount) / SATOSHI_MULTIPLIER for addr, amount in outputs}
+
+            async def loader(address: str, utxos: UtxoSet = utxos) -> UtxoSet:
+                return utxos
+
+            def create(outputs_dict: Dict[str, Decimal] = outputs_dict, loader: UnspentLoader = loader) -> bytes:
+                raw_tx, _ = loop.run_until_complete(create_unsigned_transaction(loader, [source], outputs_dict, FEE_KB))
+                return raw_tx
+
+            yield f'create_unsigned_transaction[{case}]', create
+
+            inputs, change = select_unspents(source, utxos, outputs, FEE_KB)
+            packed_inputs = pack_inputs(inputs)
+            outputs = outputs + [(source, change)]
+            yield f'serialize_transaction[{case}]', partial(serialize_transaction, packed_inputs, outputs)
+
+
+def measure(benchmark: Benchmark, min_time: float, repeat: int) -> float:
+    """
+    Returns the best time of a single call in seconds, like timeit does
+    """
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            benchmark()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time / repeat:
+            break
+        number *= 2
+
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        started = time.perf_counter()
+        for _ in range(number):
+            benchmark()
+        best = min(best, (time.perf_counter() - started) / number)
+    return best
+
+
+def find_regressions(results: Dict[str, float], baseline: Dict[str, float],
+                     threshold: float) -> Dict[str, float]:
+    """
+    Returns slowdowns (0.5 means 50% slower) of benchmarks exceeding the threshold
+    """
+    slowdowns = {name: results[name] / baseline[name] - 1 for name in results if baseline.get(name)}
+    return {name: slowdown for name, slowdown in slowdowns.items() if slowdown > threshold}
+
+
+def run(pattern: Optional[str] = None, min_time: float = 1.0, repeat: int = 5) -> Dict[str, float]:
+    results = {}
+    for name, benchmark in make_benchmarks():
+        if pattern and pattern not in name:
+            continue
+        results[name] = measure(benchmark, min_time, repeat)
+        print(f'{name:<60} {results[name] * 1e6:14.1f} us', file=sys.stderr)
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-k', dest='pattern', help='run only benchmarks containing the substring')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline results file')
+    parser.add_argument('--save', action='store_true', help='save the results as a new baseline')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='max allowed slowdown against the baseline (0.25 means 25%%)')
+    parser.add_argument('--min-time', type=float, default=1.0, help='seconds spent measuring a benchmark')
+    parser.add_argument('--repeat', type=int, default=5, help='number of measurements (the best one is taken)')
+    args = parser.parse_args(argv)
+
+    if args.save:
+        results = run(args.pattern, args.min_time, args.repeat)
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        return 0
+
+    # checked before running the benchmarks, a missing baseline must not pass the check
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print(f'No baseline at {args.baseline}, run with --save to record one', file=sys.stderr)
+        return 2
+
+    results = run(args.pattern, args.min_time, args.repeat)
+    regressions = find_regressions(results, baseline, args.threshold)
+    for name, slowdown in sorted(regressions.items()):
+        print(f'REGRESSION {name}: {slowdown:.0%} slower than the baseline', file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
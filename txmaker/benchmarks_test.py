@@ -0,0 +1,23 @@
+from typing import Any
+
+from .benchmarks import find_regressions, main, run
+
+
+def test_find_regressions() -> None:
+    baseline = {'a': 1.0, 'b': 2.0, 'c': 1.0}
+    results = {'a': 1.2, 'b': 3.0, 'c': 0.5, 'new': 1.0}
+    assert find_regressions(results, baseline, threshold=0.25) == {'b': 0.5}
+
+
+def test_run_benchmarks() -> None:
+    results = run('utxos=10,outputs=1]', min_time=0.001, repeat=1)
+    assert set(results) == {
+        'select_unspents[utxos=10,outputs=1]',
+        'create_unsigned_transaction[utxos=10,outputs=1]',
+        'serialize_transaction[utxos=10,outputs=1]',
+    }
+    assert all(seconds > 0 for seconds in results.values())
+
+
+def test_missing_baseline_fails(tmp_path: Any) -> None:
+    assert main(['--baseline', str(tmp_path / 'missing.json')]) == 2
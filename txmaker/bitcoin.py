@@ -1,22 +1,81 @@
+import asyncio
 import math
+import struct
+import time
+from array import array
+from bisect import bisect_left
+from concurrent.futures import Executor
 from decimal import Decimal
-from typing import Dict, List, Tuple
+from functools import lru_cache
+from itertools import accumulate, chain, compress
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Container,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+    overload
+)
 
 import aiohttp
 import bit.exceptions
-from bit.constants import LOCK_TIME, VERSION_2
 from bit.format import get_version
-from bit.transaction import TxIn, address_to_scriptpubkey, construct_outputs, int_to_unknown_bytes
+from bit.transaction import TxOut, address_to_scriptpubkey, int_to_unknown_bytes
 from bit.utils import hex_to_bytes
 
+from . import rawtx
 from .config import settings
+from .metrics import COIN_SELECTION, TX_SERIALIZATION, UPSTREAM_FETCH, inputs_label, record_stage
+from .rawtx import ScriptOutput, TxObj
+from .utils import json_loads
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .cache import PageLoader, UnspentLoader
+    from .coinselect import CoinSelectionStrategy
 
 DUST_THRESHOLD = 5430
+# txid (little endian), output number and amount of a packed input
+INPUT_STRUCT = struct.Struct('<32sIq')
 SATOSHI_MULTIPLIER = Decimal('1e8')
 MIN_RELAY_FEE = 1000
 MIN_OUTPUT_SIZE = Decimal('0.00000546')
 
 
+class ParsedAddress(NamedTuple):
+    network: str  # main or test
+    script_type: str  # p2pkh, p2sh, p2wpkh, p2wsh or witness_v<N>
+    script_pubkey: bytes
+
+
+@lru_cache(maxsize=settings.address_cache_size)
+def parse_address(address: str) -> ParsedAddress:
+    """
+    Decodes an address once for validation, size estimation and output construction.
+    Raises ValueError if the address is invalid
+    """
+    network = get_version(address)
+    script = address_to_scriptpubkey(address)
+    if script[0] == 0x76:  # OP_DUP
+        script_type = 'p2pkh'
+    elif script[0] == 0xa9:  # OP_HASH160
+        script_type = 'p2sh'
+    elif script[0] == 0 and len(script) == 22:
+        script_type = 'p2wpkh'
+    elif script[0] == 0:
+        script_type = 'p2wsh'
+    else:
+        # OP_1 to OP_16
+        script_type = f'witness_v{script[0] - 0x50}'
+    return ParsedAddress(network, script_type, script)
+
+
 def estimate_tx_size(n_in: int, in_size: int, n_out: int, out_size: int) -> int:
     """
     Calculates an estimated transaction size (in bytes)
@@ -41,7 +100,7 @@ def calc_out_size(addresses: List[str]) -> int:
     """
     Calculate total size (in bytes) of P2PKH/P2SH outputs
     """
-    return sum(len(address_to_scriptpubkey(o)) + 9 for o in addresses)
+    return sum(len(parse_address(o).script_pubkey) + 9 for o in addresses)
 
 
 def estimate_tx_fee(n_in: int, in_size: int, n_out: int, out_size: int, fee_kb: int) -> int:
@@ -55,108 +114,480 @@ def estimate_tx_fee(n_in: int, in_size: int, n_out: int, out_size: int, fee_kb:
 
 
 # wrap the bit package's objects into our owns
-# in order to encapsulate all bitcoin abstractions in this module
+# in order to encapsulate all bitcoin abstractions in this module (and in rawtx)
 class Unspent(bit.wallet.Unspent):
     pass
 
 
-class TxObj(bit.transaction.TxObj):
-    pass
+class UtxoSet(Sequence[Unspent]):
+    """
+    Compact columnar storage of unspent outputs.
+    Txids are kept as raw 32-byte hashes in one buffer, numbers in typed arrays
+    and scripts are interned. Slicing does not copy the data, and the Unspent
+    objects are created only when the items are accessed
+    """
+    __slots__ = ('txids', 'vouts', 'amounts', 'confirmations', 'script_ids', 'scripts')
+
+    def __init__(self, txids: Union[bytes, memoryview], vouts: Sequence[int], amounts: Sequence[int],
+                 confirmations: Sequence[int], script_ids: Sequence[int], scripts: List[str]) -> None:
+        self.txids = memoryview(txids)
+        self.vouts = memoryview(vouts)  # type: ignore
+        self.amounts = memoryview(amounts)  # type: ignore
+        self.confirmations = memoryview(confirmations)  # type: ignore
+        self.script_ids = memoryview(script_ids)  # type: ignore
+        self.scripts = scripts
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[str, int, int, int, str]]) -> 'UtxoSet':
+        """
+        Makes a set of (txid, vout, amount, confirmations, script) rows, txid and script are hex strings
+        """
+        txids = bytearray()
+        vouts, amounts, confirmations, script_ids = array('I'), array('q'), array('q'), array('I')
+        interned: Dict[str, int] = {}
+
+        for txid, vout, amount, n_confirmations, script in rows:
+            txids += bytes.fromhex(txid)
+            vouts.append(vout)
+            amounts.append(amount)
+            confirmations.append(n_confirmations)
+            script_ids.append(interned.setdefault(script, len(interned)))
+
+        return cls(bytes(txids), vouts, amounts, confirmations, script_ids, list(interned))
+
+    @classmethod
+    def from_unspents(cls, unspents: Iterable[Unspent]) -> 'UtxoSet':
+        return cls.from_rows((u.txid, u.txindex, u.amount, u.confirmations, u.script) for u in unspents)
+
+    @classmethod
+    def from_blockchain_info(cls, unspent_outputs: List[Dict[str, Any]]) -> 'UtxoSet':
+        """
+        Makes a set of blockchain.info's unspent outputs, oldest first
+        """
+        return cls.from_rows(
+            (tx['tx_hash_big_endian'], tx['tx_output_n'], tx['value'], tx['confirmations'], tx['script'])
+            for tx in reversed(unspent_outputs)
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return (self.txids.nbytes + self.vouts.nbytes + self.amounts.nbytes + self.confirmations.nbytes
+                + self.script_ids.nbytes + sum(len(s) for s in self.scripts))
+
+    def __len__(self) -> int:
+        return len(self.amounts)
+
+    @overload
+    def __getitem__(self, key: int) -> Unspent: ...  # noqa: E704
+
+    @overload
+    def __getitem__(self, key: slice) -> 'UtxoSet': ...  # noqa: E704
+
+    def __getitem__(self, key: Union[int, slice]) -> Union[Unspent, 'UtxoSet']:
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                raise ValueError('UtxoSet slices must be contiguous')
+            return UtxoSet(self.txids[start*32:stop*32], self.vouts[key], self.amounts[key],
+                           self.confirmations[key], self.script_ids[key], self.scripts)
+
+        if key < 0:
+            key += len(self)
+        return Unspent(amount=self.amounts[key],
+                       confirmations=self.confirmations[key],
+                       script=self.scripts[self.script_ids[key]],
+                       txid=self.txids[key*32:key*32+32].hex(),
+                       txindex=self.vouts[key])
+
+    def filter_confirmed(self, min_confirmations: int) -> 'UtxoSet':
+        """
+        Returns a set of outputs having at least min_confirmations, without creating Unspent objects
+        """
+        mask = [c >= min_confirmations for c in self.confirmations]
+        if all(mask):
+            return self
+        return self.take(list(compress(range(len(mask)), mask)))
+
+    def exclude(self, outpoints: Container[Tuple[bytes, int]]) -> 'UtxoSet':
+        """
+        Returns a set without the given (raw txid, vout) outputs, without creating Unspent objects
+        """
+        mask = [(self.txids[i*32:i*32+32].tobytes(), self.vouts[i]) not in outpoints for i in range(len(self))]
+        if all(mask):
+            return self
+        return self.take(list(compress(range(len(mask)), mask)))
+
+    def unique(self) -> 'UtxoSet':
+        """
+        Returns a set without repeated (txid, vout) outputs, the first one of them is kept
+        """
+        seen: Set[Tuple[bytes, int]] = set()
+        indexes = []
+        for i in range(len(self)):
+            outpoint = (self.txids[i*32:i*32+32].tobytes(), self.vouts[i])
+            if outpoint not in seen:
+                seen.add(outpoint)
+                indexes.append(i)
+        if len(indexes) == len(self):
+            return self
+        return self.take(indexes)
+
+    def oldest_first(self) -> 'UtxoSet':
+        """
+        Returns the outputs ordered by the number of confirmations (the order of equal ones is kept)
+        """
+        return self.take(sorted(range(len(self)), key=self.confirmations.__getitem__, reverse=True))
+
+    def take(self, indexes: Sequence[int]) -> 'UtxoSet':
+        """
+        Returns a set of outputs with the given indexes, without creating Unspent objects
+        """
+        return UtxoSet(b''.join(self.txids[i*32:i*32+32] for i in indexes),
+                       array('I', (self.vouts[i] for i in indexes)),
+                       array('q', (self.amounts[i] for i in indexes)),
+                       array('q', (self.confirmations[i] for i in indexes)),
+                       array('I', (self.script_ids[i] for i in indexes)),
+                       self.scripts)
+
+    @classmethod
+    def concat(cls, utxo_sets: Sequence['UtxoSet']) -> 'UtxoSet':
+        if len(utxo_sets) == 1:
+            return utxo_sets[0]
+
+        txids = bytearray()
+        vouts, amounts, confirmations, script_ids = array('I'), array('q'), array('q'), array('I')
+        interned: Dict[str, int] = {}
+
+        for utxos in utxo_sets:
+            txids += utxos.txids
+            vouts.extend(utxos.vouts)
+            amounts.extend(utxos.amounts)
+            confirmations.extend(utxos.confirmations)
+            remapped = [interned.setdefault(script, len(interned)) for script in utxos.scripts]
+            script_ids.extend(remapped[i] for i in utxos.script_ids)
+
+        return cls(bytes(txids), vouts, amounts, confirmations, script_ids, list(interned))
 
 
 class InsufficientFunds(Exception):
     pass
 
 
+class UpstreamRejected(Exception):
+    """
+    The upstream has answered with a 4xx status, the request won't succeed if it's repeated
+    """
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
 Output = Tuple[str, int]
 
 
-def select_unspents(source_address: str, unspents: List[Unspent],
+def fifo_cut(amounts: Sequence[int], out_amount: int, n_out: int, out_size: int, fee_kb: int,
+             spent_amount: int = 0, n_spent: int = 0) -> Tuple[int, int, int]:
+    """
+    Finds how many of the amounts (taken in order) cover the outputs plus fee,
+    given that n_spent inputs worth spent_amount are already selected.
+    Gives exactly the same result as adding the amounts one by one,
+    but uses prefix sums and binary search instead of an interpreted loop.
+    Returns (number of taken amounts, their sum plus spent_amount, fee),
+    if the amounts are not enough, all of them are taken
+    """
+    def fee(n_in: int) -> int:
+        return estimate_tx_fee(n_in, calc_in_size(n_in), n_out, out_size, fee_kb)
+
+    # sums[k] - spending amount after taking k amounts
+    sums = array('q', accumulate(chain((spent_amount,), amounts)))
+    n_total = len(sums) - 1
+    k = 1
+    while k <= n_total:
+        # the fee only grows with the number of inputs, so no cut before
+        # the first sum covering the fee for k inputs is possible
+        k = bisect_left(sums, out_amount + fee(n_spent + k), k)
+        if k > n_total:
+            break
+        k_fee = fee(n_spent + k)
+        if out_amount + k_fee <= sums[k]:
+            return k, sums[k], k_fee
+        k += 1
+    return n_total, sums[n_total], fee(n_spent + n_total) if n_spent + n_total else 0
+
+
+class UnspentSelector:
+    """
+    Incrementally selects unspent outputs for a new transaction's inputs.
+    Uses FIFO selecting method (oldest transactions are spending first),
+    so the unspents have to be added in the oldest-first order
+    """
+
+    CHUNK_SIZE = 1024
+
+    def __init__(self, source_address: str, outputs: List[Output], fee_kb: int) -> None:
+        out_addresses = []
+        self.out_amount = 0
+
+        for addr, amount in outputs:
+            out_addresses.append(addr)
+            self.out_amount += amount
+
+        self.fee_kb = fee_kb
+        self.n_out = len(out_addresses) + 1
+        self.out_size = calc_out_size(out_addresses + [source_address])
+        self.selected_inputs: List[Unspent] = []
+        self.spending_amount = 0
+        self.fee = 0
+
+    @property
+    def is_covered(self) -> bool:
+        return bool(self.selected_inputs) and self.out_amount + self.fee <= self.spending_amount
+
+    def add(self, u: Unspent) -> bool:
+        """
+        Adds an input to the selection.
+        Returns True when selected inputs cover the outputs plus fee
+        """
+        self.spending_amount += u.amount
+        self.selected_inputs.append(u)
+        n_in = len(self.selected_inputs)
+        in_size = calc_in_size(n_in)
+        self.fee = estimate_tx_fee(n_in, in_size, self.n_out, self.out_size, self.fee_kb)
+        return self.is_covered
+
+    def add_many(self, unspents: Sequence[Unspent]) -> bool:
+        """
+        Adds inputs in bulk until selected inputs cover the outputs plus fee.
+        Returns True when they do
+        """
+        if not isinstance(unspents, UtxoSet):
+            unspents = UtxoSet.from_unspents(unspents)
+
+        # prefix sums are built chunk by chunk, so a large set is not summed up entirely
+        # when only a few of its first inputs are needed
+        for start in range(0, len(unspents), self.CHUNK_SIZE):
+            chunk = unspents[start:start + self.CHUNK_SIZE]
+            n_taken, self.spending_amount, self.fee = fifo_cut(
+                chunk.amounts, self.out_amount, self.n_out, self.out_size, self.fee_kb,
+                self.spending_amount, len(self.selected_inputs),
+            )
+            self.selected_inputs.extend(chunk[:n_taken])
+            if self.is_covered:
+                break
+        return self.is_covered
+
+    def result(self) -> Tuple[List[Unspent], int]:
+        """
+        Returns a list of selected inputs and a change amount in satoshi
+        """
+        if not self.is_covered:
+            raise InsufficientFunds(
+                f'Balance {self.spending_amount} is less than {self.out_amount+self.fee} (including fee)')
+        return self.selected_inputs, self.spending_amount - (self.out_amount+self.fee)
+
+
+def select_unspents(source_address: str, unspents: Sequence[Unspent],
                     outputs: List[Output], fee_kb: int) -> Tuple[List[Unspent], int]:
     """
     Selects unspent outputs for a new transaction's inputs.
     Uses FIFO selecting method (oldest transactions are spending first)
     Returns a list of selected inputs and a change amount in satoshi
     """
-    out_addresses = []
-    out_amount = 0
+    selector = UnspentSelector(source_address, outputs, fee_kb)
+    selector.add_many(unspents)
+    return selector.result()
 
-    for addr, amount in outputs:
-        out_addresses.append(addr)
-        out_amount += amount
 
-    n_out = len(out_addresses) + 1
-    out_size = calc_out_size(out_addresses + [source_address])
+async def load_all_unspent(page_loader: 'PageLoader', address: str) -> UtxoSet:
+    """
+    Fetches all the pages of unspent outputs of the address and orders them oldest first.
+    blockchain.info serves the newest outputs first and can't be paged from the oldest end,
+    so the oldest ones are on the last page. The offsets shift when outputs arrive or get spent
+    between the page requests, so an output may be served twice and the repeated ones are dropped
+    """
+    pages = []
+    offset = 0
+    while True:
+        page = await page_loader(address, offset)
+        pages.append(page)
+        if len(page) < settings.unspent_page_size:
+            break
+        offset += len(page)
+    return UtxoSet.concat(pages).unique().oldest_first()
 
-    selected_inputs: List[Unspent] = []
-    spending_amount = 0
 
-    for u in unspents:
-        spending_amount += u.amount
-        selected_inputs.append(u)
-        n_in = len(selected_inputs)
-        in_size = calc_in_size(n_in)
-        fee = estimate_tx_fee(n_in, in_size, n_out, out_size, fee_kb)
-        if out_amount + fee <= spending_amount:
-            break
-    else:
-        raise InsufficientFunds(f'Balance {spending_amount} is less than {out_amount+fee} (including fee)')
+def listing_keys(addresses: Sequence[str]) -> List[str]:
+    """
+    Returns the addresses joined by '|' in batches of up to unspent_addresses_per_request,
+    one unspent outputs listing is loaded per batch
+    """
+    chunk_size = settings.unspent_addresses_per_request
+    return ['|'.join(addresses[start:start + chunk_size]) for start in range(0, len(addresses), chunk_size)]
 
-    return selected_inputs, spending_amount - (out_amount+fee)
 
+async def load_sources_unspent(loader: 'UnspentLoader', addresses: Sequence[str]) -> UtxoSet:
+    """
+    Loads unspent outputs of the source addresses, oldest first. Outputs of multiple addresses are requested
+    in batches of up to unspent_addresses_per_request addresses per call and merged into one
+    set ordered oldest first, since the FIFO order is global across the addresses
+    """
+    keys = listing_keys(addresses)
+    if len(keys) == 1:
+        return await loader(keys[0])
+    return UtxoSet.concat([await loader(key) for key in keys]).oldest_first()
 
-async def create_unsigned_transaction(source_address: str, outputs_dict: Dict[str, Decimal],
-                                      fee_kb: int) -> Tuple[TxObj, List[Unspent]]:
-    all_utxos = await get_unspent(source_address)
-    confirmed_utxos = [u for u in all_utxos if u.confirmations >= settings.min_confirmations]
 
-    if not confirmed_utxos:
+async def load_spendable_unspent(loader: 'UnspentLoader', addresses: Sequence[str],
+                                 reserved: Container[Tuple[bytes, int]] = ()) -> UtxoSet:
+    """
+    Loads confirmed outputs of the source addresses, skipping the reserved (raw txid, vout) ones
+    """
+    confirmed = (await load_sources_unspent(loader, addresses)).filter_confirmed(settings.min_confirmations)
+    available = confirmed.exclude(reserved) if reserved else confirmed
+    if not available:
+        if confirmed:
+            raise InsufficientFunds('All confirmed UTXOs are reserved by other transactions')
         raise InsufficientFunds('No confirmed UTXOs were found')
+    return available
+
+
+def pack_inputs(inputs: Sequence[Unspent]) -> bytes:
+    """
+    Packs the inputs into a compact buffer of serialized txids, output numbers and amounts
+    """
+    return b''.join(INPUT_STRUCT.pack(hex_to_bytes(u.txid)[::-1], u.txindex, u.amount) for u in inputs)
+
 
-    outputs = [(addr, int(amount * SATOSHI_MULTIPLIER)) for addr, amount in outputs_dict.items()]
-    inputs, change_amount = select_unspents(source_address, confirmed_utxos, outputs, fee_kb)
+def script_outputs(outputs: List[Output]) -> List[ScriptOutput]:
+    return [(parse_address(addr).script_pubkey, amount) for addr, amount in outputs]
+
+
+def make_transaction(packed_inputs: bytes, outputs: List[Output]) -> TxObj:
+    return rawtx.make_transaction(packed_inputs, script_outputs(outputs))
+
+
+def serialize_transaction(packed_inputs: bytes, outputs: List[Output]) -> bytes:
+    """
+    Makes a raw unsigned transaction
+    """
+    return rawtx.serialize_transaction(packed_inputs, script_outputs(outputs))
+
+
+async def select_transaction_inputs(loader: 'UnspentLoader', source_addresses: Sequence[str],
+                                    outputs_dict: Union[Dict[str, Decimal], Sequence[Tuple[str, Decimal]]],
+                                    fee_kb: int,
+                                    strategy: Optional['CoinSelectionStrategy'] = None,
+                                    change_address: Optional[str] = None,
+                                    reserved: Container[Tuple[bytes, int]] = ()) -> Tuple[List[Unspent], List[Output]]:
+    """
+    Selects unspent outputs of the source addresses to pay the outputs.
+    Returns the inputs and the outputs in satoshi, the change one (if it isn't dust) is the last.
+    The change goes to change_address (the first source address by default).
+    outputs_dict -- amounts by address, or (address, amount) pairs if an address is paid more than once
+    reserved -- (raw txid, vout) outputs which mustn't be spent
+    """
+    change_address = change_address or source_addresses[0]
+    pairs = outputs_dict.items() if isinstance(outputs_dict, dict) else outputs_dict
+    outputs = [(addr, int(amount * SATOSHI_MULTIPLIER)) for addr, amount in pairs]
+    started = time.perf_counter()
+    try:
+        unspents = await load_spendable_unspent(loader, source_addresses, reserved)
+    finally:
+        record_stage('upstream', time.perf_counter() - started)
+    n_inputs = None
+    started = time.perf_counter()
+    try:
+        if strategy is None:
+            inputs, change_amount = select_unspents(change_address, unspents, outputs, fee_kb)
+        else:
+            inputs, change_amount = strategy.select(change_address, list(unspents), outputs, fee_kb)
+        n_inputs = len(inputs)
+    finally:
+        selection = time.perf_counter() - started
+        COIN_SELECTION.labels(inputs_label(n_inputs)).observe(selection)
+        record_stage('selection', selection)
 
     if change_amount > DUST_THRESHOLD:
-        outputs.append((source_address, change_amount))
+        outputs.append((change_address, change_amount))
+    return inputs, outputs
 
-    version = VERSION_2
-    lock_time = LOCK_TIME
-    raw_outputs = construct_outputs(outputs)
-    raw_inputs = []
 
-    for unspent in inputs:
-        script_sig = b''
-        txid = hex_to_bytes(unspent.txid)[::-1]
-        txindex = unspent.txindex.to_bytes(4, byteorder='little')
-        amount = int(unspent.amount).to_bytes(8, byteorder='little')
-        raw_inputs.append(TxIn(script_sig, txid, txindex, amount=amount))
+async def create_unsigned_transaction(loader: 'UnspentLoader', source_addresses: Sequence[str],
+                                      outputs_dict: Union[Dict[str, Decimal], Sequence[Tuple[str, Decimal]]],
+                                      fee_kb: int,
+                                      strategy: Optional['CoinSelectionStrategy'] = None,
+                                      change_address: Optional[str] = None,
+                                      executor: Optional[Executor] = None,
+                                      reserved: Container[Tuple[bytes, int]] = ()) -> Tuple[bytes, List[Unspent]]:
+    """
+    Makes a raw transaction spending unspent outputs of the source addresses,
+    see select_transaction_inputs for the arguments
+    """
+    inputs, outputs = await select_transaction_inputs(loader, source_addresses, outputs_dict, fee_kb,
+                                                      strategy, change_address, reserved)
+
+    packed_inputs = pack_inputs(inputs)
+    started = time.perf_counter()
+    if executor is not None and len(inputs) + len(outputs) >= settings.tx_offload_min_size:
+        # a large transaction would stall the event loop for every other request,
+        # the addresses are decoded here with the cache of decoded ones
+        raw_tx = await asyncio.get_event_loop().run_in_executor(executor, rawtx.serialize_transaction,
+                                                                packed_inputs, script_outputs(outputs))
+    else:
+        raw_tx = serialize_transaction(packed_inputs, outputs)
+    elapsed = time.perf_counter() - started
+    TX_SERIALIZATION.observe(elapsed)
+    record_stage('serialization', elapsed)
+    return raw_tx, inputs
+
 
-    tx_unsigned = TxObj(version, raw_inputs, raw_outputs, lock_time)
-    return tx_unsigned, inputs
+def make_client_session() -> aiohttp.ClientSession:
+    """
+    Creates a pooled HTTP session for blockchain.info calls.
+    The session is meant to live as long as the application does
+    """
+    connector = aiohttp.TCPConnector(
+        limit=settings.upstream_limit,
+        limit_per_host=settings.upstream_limit_per_host,
+        keepalive_timeout=settings.upstream_keepalive_timeout,
+        use_dns_cache=settings.upstream_dns_cache_ttl > 0,
+        ttl_dns_cache=settings.upstream_dns_cache_ttl or None,
+    )
+    return aiohttp.ClientSession(connector=connector)
 
 
-async def get_unspent(address: str) -> List[Unspent]:
+async def get_unspent(session: aiohttp.ClientSession, address: str, offset: int = 0) -> UtxoSet:
+    """
+    Fetches a page of unspent outputs of the address (oldest first within the page)
+    """
     url = settings.blockchain_info_base_url + '/unspent'
+    params = {'active': address, 'limit': settings.unspent_page_size, 'offset': offset}
+
+    started = time.perf_counter()
+    status = 'error'
+    try:
+        async with session.get(url, params=params) as resp:
+            status = str(resp.status)
+            # blockchain.info's way to say there are no unspent outputs
+            if resp.status == 500 and 'No free outputs' in await resp.text():
+                return UtxoSet.from_blockchain_info([])
+            elif 400 <= resp.status < 500:
+                raise UpstreamRejected(resp.status, f'blockchain.info responded with {resp.status}')
+            elif resp.status != 200:
+                raise ConnectionError(f'blockchain.info responded with {resp.status}')
+            resp_data = json_loads(await resp.read())
+    finally:
+        UPSTREAM_FETCH.labels('blockchain_info', status).observe(time.perf_counter() - started)
+    return UtxoSet.from_blockchain_info(resp_data['unspent_outputs'])
+
 
-    async with aiohttp.ClientSession() as session:
-        resp: aiohttp.ClientResponse = await session.get(url, params={'active': address})
-        if resp.status == 500:
-            return []
-        elif resp.status != 200:
-            raise ConnectionError
-        resp_data = await resp.json()
-    return [
-            Unspent(amount=tx['value'],
-                    confirmations=tx['confirmations'],
-                    script=tx['script'],
-                    txid=tx['tx_hash_big_endian'],
-                    txindex=tx['tx_output_n'])
-            for tx in resp_data['unspent_outputs']
-        ][::-1]  # oldest first
+def construct_outputs(outputs: List[Output]) -> List[TxOut]:
+    return rawtx.construct_script_outputs(script_outputs(outputs))
 
 
 def is_valid_address(bitcoin_address: str) -> bool:
     try:
-        return get_version(bitcoin_address) == settings.btc_network
+        return parse_address(bitcoin_address).network == settings.btc_network
     except ValueError:
         return False
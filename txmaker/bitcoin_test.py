@@ -0,0 +1,156 @@
+import random
+from typing import List, Tuple
+
+import pytest
+
+from .bitcoin import (
+    InsufficientFunds,
+    Output,
+    ParsedAddress,
+    Unspent,
+    UnspentSelector,
+    UtxoSet,
+    calc_in_size,
+    calc_out_size,
+    estimate_tx_fee,
+    parse_address,
+    select_unspents
+)
+
+SOURCE = 'mfetsqmVYU1m3w1MNXaDg4cvGYwXJB47Kx'
+DESTINATIONS = ['mhnnkpnCfBkxN5KpfMArye2F376nATVJDW', '2MtDYVRt3Wdp2sDadhLnPoXDrzsTsBXq5c7']
+
+
+def make_unspents(amounts: List[int]) -> List[Unspent]:
+    return [Unspent(amount=amount, confirmations=6, script='00', txid=f'{n:064x}', txindex=0)
+            for n, amount in enumerate(amounts)]
+
+
+def select_unspents_one_by_one(unspents: List[Unspent], outputs: List[Output],
+                               fee_kb: int) -> Tuple[List[Unspent], int]:
+    """
+    The reference FIFO selection loop
+    """
+    out_amount = sum(amount for _, amount in outputs)
+    n_out = len(outputs) + 1
+    out_size = calc_out_size([addr for addr, _ in outputs] + [SOURCE])
+    selected_inputs: List[Unspent] = []
+    spending_amount = 0
+
+    for u in unspents:
+        spending_amount += u.amount
+        selected_inputs.append(u)
+        n_in = len(selected_inputs)
+        fee = estimate_tx_fee(n_in, calc_in_size(n_in), n_out, out_size, fee_kb)
+        if out_amount + fee <= spending_amount:
+            break
+    else:
+        raise InsufficientFunds(f'Balance {spending_amount} is less than {out_amount+fee} (including fee)')
+
+    return selected_inputs, spending_amount - (out_amount+fee)
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_bulk_selection_matches_reference_loop(seed: int) -> None:
+    rnd = random.Random(seed)
+    # dust amounts make the covered/not covered sequence non monotonic
+    unspents = make_unspents([rnd.choice([100, 1000, 50000, 2000000]) for _ in range(rnd.randint(1, 400))])
+    outputs = [(addr, rnd.randint(546, 5000000)) for addr in DESTINATIONS[:rnd.randint(1, 2)]]
+    fee_kb = rnd.choice([1000, 25000, 200000])
+
+    try:
+        expected = select_unspents_one_by_one(unspents, outputs, fee_kb)
+    except InsufficientFunds as e:
+        with pytest.raises(InsufficientFunds, match=str(e)):
+            select_unspents(SOURCE, unspents, outputs, fee_kb)
+    else:
+        assert select_unspents(SOURCE, unspents, outputs, fee_kb) == expected
+
+        # the same when the unspents come page by page
+        selector = UnspentSelector(SOURCE, outputs, fee_kb)
+        for n in range(0, len(unspents), 7):
+            if selector.add_many(unspents[n:n+7]):
+                break
+        assert selector.result() == expected
+
+
+def test_bulk_selection_of_large_set() -> None:
+    unspents = make_unspents([10000] * 100000)
+    inputs, change = select_unspents(SOURCE, unspents, [(DESTINATIONS[0], 50000000)], 1000)
+    assert (inputs, change) == select_unspents_one_by_one(unspents, [(DESTINATIONS[0], 50000000)], 1000)
+
+
+def test_utxo_set_from_blockchain_info() -> None:
+    utxos = UtxoSet.from_blockchain_info([
+        {'tx_hash_big_endian': 'ab' * 32, 'tx_output_n': 1, 'script': '76a9', 'value': 100, 'confirmations': 1},
+        {'tx_hash_big_endian': 'cd' * 32, 'tx_output_n': 2, 'script': '76a9', 'value': 200, 'confirmations': 7},
+    ])
+    assert len(utxos) == 2
+    assert len(utxos.scripts) == 1
+    # oldest first
+    assert utxos[0] == Unspent(amount=200, confirmations=7, script='76a9', txid='cd' * 32, txindex=2)
+    assert utxos[-1].txid == 'ab' * 32
+    assert list(utxos.amounts) == [200, 100]
+
+
+def test_utxo_set_slicing_and_filtering() -> None:
+    unspents = [Unspent(amount=n, confirmations=n % 10, script=f'{n % 3:02x}', txid=f'{n:064x}', txindex=n)
+                for n in range(1, 101)]
+    utxos = UtxoSet.from_unspents(unspents)
+    assert list(utxos) == unspents
+
+    sliced = utxos[10:20]
+    assert sliced.amounts.obj is utxos.amounts.obj
+    assert list(sliced) == unspents[10:20]
+
+    confirmed = utxos.filter_confirmed(6)
+    assert list(confirmed) == [u for u in unspents if u.confirmations >= 6]
+    assert utxos.filter_confirmed(0) is utxos
+
+
+def test_selection_from_utxo_set_creates_only_selected_unspents() -> None:
+    unspents = make_unspents([10000] * 100000)
+    utxos = UtxoSet.from_unspents(unspents)
+    inputs, change = select_unspents(SOURCE, utxos, [(DESTINATIONS[0], 50000000)], 1000)
+    assert (inputs, change) == select_unspents(SOURCE, unspents, [(DESTINATIONS[0], 50000000)], 1000)
+    assert all(isinstance(u, Unspent) for u in inputs)
+
+
+def test_utxo_set_concat_oldest_first() -> None:
+    first = UtxoSet.from_unspents([
+        Unspent(amount=1, confirmations=5, script='aa', txid='01' * 32, txindex=0),
+        Unspent(amount=2, confirmations=9, script='bb', txid='02' * 32, txindex=0),
+    ])
+    second = UtxoSet.from_unspents([
+        Unspent(amount=3, confirmations=7, script='bb', txid='03' * 32, txindex=1),
+        Unspent(amount=4, confirmations=9, script='cc', txid='04' * 32, txindex=1),
+    ])
+    merged = UtxoSet.concat([first, second])
+    assert list(merged) == list(first) + list(second)
+    assert merged.scripts == ['aa', 'bb', 'cc']
+    assert [u.amount for u in merged.oldest_first()] == [2, 4, 3, 1]
+
+
+def test_utxo_set_unique() -> None:
+    utxos = UtxoSet.from_unspents([
+        Unspent(amount=1, confirmations=5, script='aa', txid='01' * 32, txindex=0),
+        Unspent(amount=2, confirmations=5, script='aa', txid='01' * 32, txindex=1),
+        Unspent(amount=1, confirmations=5, script='aa', txid='01' * 32, txindex=0),
+    ])
+    assert [u.txindex for u in utxos.unique()] == [0, 1]
+    distinct = utxos[:2]
+    assert distinct.unique() is distinct
+
+
+def test_parse_address() -> None:
+    parse_address.cache_clear()
+    assert parse_address(SOURCE) == ParsedAddress(
+        'test', 'p2pkh', bytes.fromhex('76a9140180799618375ebd21bd67014deca9a167b8f91e88ac'))
+    assert parse_address(DESTINATIONS[1])[:2] == ('test', 'p2sh')
+    assert parse_address('tb1qrp33g0q5c5txsp9arysrx4k6zdkfs4nce4xj0gdcccefvpysxf3q0sl5k7')[:2] == ('test', 'p2wsh')
+    assert parse_address('1BvBMSEYstWetqTFn5Au4m4GFg7xJaNVN2')[:2] == ('main', 'p2pkh')
+    parse_address(SOURCE)
+    assert parse_address.cache_info().hits == 1
+
+    with pytest.raises(ValueError):
+        parse_address('invalid')
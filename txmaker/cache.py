@@ -0,0 +1,211 @@
+import asyncio
+import sys
+import time
+from collections import Counter, OrderedDict
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, Hashable, NamedTuple, Optional, Set
+
+import aiohttp
+
+from .bitcoin import UtxoSet
+from .config import settings
+
+# (address, offset) -> a page of unspent outputs, as the UTXO provider serves it
+PageLoader = Callable[[str, int], Awaitable[UtxoSet]]
+# address -> all the unspent outputs of the address (or of "|"-joined addresses), oldest first
+UnspentLoader = Callable[[str], Awaitable[UtxoSet]]
+
+UPSTREAM_ERRORS = (ConnectionError, aiohttp.ClientError, asyncio.TimeoutError)
+
+
+class CacheEntry(NamedTuple):
+    unspents: UtxoSet
+    created_at: float
+    size: int
+
+
+class UtxoCache:
+    """
+    Bounded in-process LRU cache of unspent outputs keyed by address.
+    All the outputs of an address are one entry: pages fetched at different times
+    would have shifted offsets, so the same output could be served twice.
+
+    ttl - seconds an entry is served as fresh
+    stale_while_revalidate - seconds after ttl an entry is still served
+        while it's being refreshed in the background
+    stale_if_error - seconds after ttl an entry is served if upstream fails
+    max_entries, max_bytes - eviction bounds (least recently used goes first)
+    """
+
+    def __init__(self, *, ttl: float, stale_while_revalidate: float = 0, stale_if_error: float = 0,
+                 max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.ttl = ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self.stale_if_error = stale_if_error
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.stats: Counter = Counter()
+        self.size = 0
+        self._entries: 'OrderedDict[str, CacheEntry]' = OrderedDict()
+        self._revalidating: Set[str] = set()
+        self._tasks: Set[asyncio.Future] = set()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, address: str) -> bool:
+        return any(address in key.split('|') for key in self._entries)
+
+    async def get(self, address: str, loader: UnspentLoader) -> UtxoSet:
+        key = address
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = self.clock() - entry.created_at
+            if age <= self.ttl:
+                self.stats['hits'] += 1
+                self._entries.move_to_end(key)
+                return entry.unspents
+            if age <= self.ttl + self.stale_while_revalidate:
+                self.stats['stale_hits'] += 1
+                self._entries.move_to_end(key)
+                self._revalidate(key, loader)
+                return entry.unspents
+
+        self.stats['misses'] += 1
+        try:
+            unspents = await loader(address)
+        except UPSTREAM_ERRORS:
+            if entry is not None and self.clock() - entry.created_at <= self.ttl + self.stale_if_error:
+                self.stats['stale_errors'] += 1
+                return entry.unspents
+            raise
+        self.put(key, unspents)
+        return unspents
+
+    def wrap(self, loader: UnspentLoader) -> UnspentLoader:
+        async def cached_loader(address: str) -> UtxoSet:
+            return await self.get(address, loader)
+        return cached_loader
+
+    def put(self, key: str, unspents: UtxoSet) -> None:
+        self._discard(key)
+        entry = CacheEntry(unspents, self.clock(), sys.getsizeof(unspents) + unspents.nbytes)
+        if entry.size > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self.size += entry.size
+        while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= evicted.size
+            self.stats['evictions'] += 1
+
+    def invalidate(self, address: str) -> None:
+        """
+        Drops the cached outputs of the address (including the ones of multiple addresses)
+        """
+        keys = [key for key in self._entries if address in key.split('|')]
+        for key in keys:
+            self._discard(key)
+        if keys:
+            self.stats['invalidations'] += 1
+
+    def _discard(self, key: str) -> bool:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self.size -= entry.size
+        return True
+
+    def _revalidate(self, key: str, loader: UnspentLoader) -> None:
+        if key in self._revalidating:
+            return
+        self._revalidating.add(key)
+
+        async def refresh() -> None:
+            try:
+                self.put(key, await loader(key))
+                self.stats['revalidations'] += 1
+            except UPSTREAM_ERRORS:
+                self.stats['revalidation_errors'] += 1
+            finally:
+                self._revalidating.discard(key)
+
+        task = asyncio.ensure_future(refresh())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def close(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    @classmethod
+    def from_settings(cls) -> Optional['UtxoCache']:
+        if settings.utxo_cache_max_entries <= 0:
+            return None
+        return cls(
+            ttl=settings.utxo_cache_ttl,
+            stale_while_revalidate=settings.utxo_cache_stale_while_revalidate,
+            stale_if_error=settings.utxo_cache_stale_if_error,
+            max_entries=settings.utxo_cache_max_entries,
+            max_bytes=settings.utxo_cache_max_bytes,
+        )
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into a single call.
+    All the callers wait for the same shared future and get the same result (or exception).
+    Cancelling one of the callers does not cancel the shared call.
+    """
+
+    def __init__(self) -> None:
+        self.stats: Counter = Counter()
+        self._flights: Dict[Hashable, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._flights.get(key)
+        if future is None:
+            self.stats['calls'] += 1
+            future = asyncio.ensure_future(fn())
+            self._flights[key] = future
+            future.add_done_callback(partial(self._done, key))
+        else:
+            self.stats['coalesced'] += 1
+        return await asyncio.shield(future)
+
+    def wrap(self, loader: UnspentLoader) -> UnspentLoader:
+        async def coalesced_loader(address: str) -> UtxoSet:
+            return await self.do(address, partial(loader, address))
+        return coalesced_loader
+
+    def _done(self, key: Hashable, future: asyncio.Future) -> None:
+        if self._flights.get(key) is future:
+            del self._flights[key]
+        # all the waiters might have been cancelled, so nobody would retrieve the exception
+        if not future.cancelled():
+            future.exception()
+
+    async def close(self) -> None:
+        for future in list(self._flights.values()):
+            future.cancel()
+        await asyncio.gather(*self._flights.values(), return_exceptions=True)
+
+
+def memoize_loader(loader: UnspentLoader) -> UnspentLoader:
+    """
+    Wraps the loader, so the outputs of every address are loaded once for the lifetime of the returned loader
+    (e.g. while handling one request)
+    """
+    futures: Dict[str, asyncio.Future] = {}
+
+    async def memoized_loader(address: str) -> UtxoSet:
+        if address not in futures:
+            futures[address] = asyncio.ensure_future(loader(address))
+        return await asyncio.shield(futures[address])
+    return memoized_loader
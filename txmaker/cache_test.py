@@ -0,0 +1,171 @@
+import asyncio
+from typing import Any, List
+
+import pytest
+
+from .bitcoin import Unspent, UtxoSet
+from .cache import SingleFlight, UtxoCache
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeLoader:
+    def __init__(self) -> None:
+        self.calls: List[str] = []
+        self.error: Any = None
+
+    async def __call__(self, address: str) -> UtxoSet:
+        self.calls.append(address)
+        if self.error is not None:
+            raise self.error
+        return UtxoSet.from_unspents([
+            Unspent(amount=len(self.calls), confirmations=6, script='00', txid='00' * 32, txindex=0),
+        ])
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+@pytest.fixture
+def loader() -> FakeLoader:
+    return FakeLoader()
+
+
+async def test_fresh_entry_is_served_from_cache(clock: FakeClock, loader: FakeLoader) -> None:
+    cache = UtxoCache(ttl=10, clock=clock)
+    first = await cache.get('addr', loader)
+    clock.now = 10
+    assert await cache.get('addr', loader) is first
+    assert loader.calls == ['addr']
+    assert cache.stats['misses'] == 1
+    assert cache.stats['hits'] == 1
+
+
+async def test_expired_entry_is_refetched(clock: FakeClock, loader: FakeLoader) -> None:
+    cache = UtxoCache(ttl=10, clock=clock)
+    await cache.get('addr', loader)
+    clock.now = 11
+    unspents = await cache.get('addr', loader)
+    assert unspents[0].amount == 2
+    assert cache.stats['misses'] == 2
+
+
+async def test_stale_while_revalidate(clock: FakeClock, loader: FakeLoader) -> None:
+    cache = UtxoCache(ttl=10, stale_while_revalidate=5, clock=clock)
+    await cache.get('addr', loader)
+    clock.now = 12
+    stale = await cache.get('addr', loader)
+    assert stale[0].amount == 1
+    assert cache.stats['stale_hits'] == 1
+
+    await asyncio.sleep(0)
+    fresh = await cache.get('addr', loader)
+    assert fresh[0].amount == 2
+    assert cache.stats['revalidations'] == 1
+    await cache.close()
+
+
+async def test_stale_if_error(clock: FakeClock, loader: FakeLoader) -> None:
+    cache = UtxoCache(ttl=10, stale_if_error=60, clock=clock)
+    await cache.get('addr', loader)
+    loader.error = ConnectionError()
+
+    clock.now = 30
+    unspents = await cache.get('addr', loader)
+    assert unspents[0].amount == 1
+    assert cache.stats['stale_errors'] == 1
+
+    clock.now = 100
+    with pytest.raises(ConnectionError):
+        await cache.get('addr', loader)
+
+
+async def test_lru_eviction_and_invalidation(clock: FakeClock, loader: FakeLoader) -> None:
+    cache = UtxoCache(ttl=10, max_entries=2, clock=clock)
+    await cache.get('a', loader)
+    await cache.get('b', loader)
+    await cache.get('a', loader)
+    await cache.get('c', loader)
+    assert 'a' in cache and 'c' in cache and 'b' not in cache
+    assert cache.stats['evictions'] == 1
+
+    await cache.get('c|d', loader)
+    assert len(cache) == 2
+    cache.invalidate('c')
+    assert 'c' not in cache
+    assert len(cache) == 0
+    assert cache.stats['invalidations'] == 1
+
+
+async def test_memory_bound(clock: FakeClock, loader: FakeLoader) -> None:
+    cache = UtxoCache(ttl=10, max_bytes=1, clock=clock)
+    await cache.get('a', loader)
+    assert len(cache) == 0
+    assert cache.size == 0
+
+
+class SlowLoader(FakeLoader):
+    def __init__(self) -> None:
+        super().__init__()
+        self.released = asyncio.Event()
+
+    async def __call__(self, address: str) -> UtxoSet:
+        await self.released.wait()
+        return await super().__call__(address)
+
+
+async def test_single_flight_coalesces_concurrent_calls() -> None:
+    flights = SingleFlight()
+    loader = SlowLoader()
+    coalesced = flights.wrap(loader)
+
+    waiters = [asyncio.ensure_future(coalesced('addr')) for _ in range(50)]
+    other = asyncio.ensure_future(coalesced('other'))
+    await asyncio.sleep(0)
+    loader.released.set()
+    results = await asyncio.gather(*waiters)
+
+    assert all(r is results[0] for r in results)
+    assert (await other)[0].amount == 2
+    assert sorted(loader.calls) == ['addr', 'other']
+    assert flights.stats['coalesced'] == 49
+    assert len(flights) == 0
+
+
+async def test_single_flight_cancelled_waiter_does_not_cancel_call() -> None:
+    flights = SingleFlight()
+    loader = SlowLoader()
+    coalesced = flights.wrap(loader)
+
+    first = asyncio.ensure_future(coalesced('addr'))
+    second = asyncio.ensure_future(coalesced('addr'))
+    await asyncio.sleep(0)
+    first.cancel()
+    await asyncio.sleep(0)
+    loader.released.set()
+
+    assert (await second)[0].amount == 1
+    assert first.cancelled()
+
+
+async def test_single_flight_propagates_errors_to_all_waiters() -> None:
+    flights = SingleFlight()
+    loader = SlowLoader()
+    loader.error = ConnectionError()
+    coalesced = flights.wrap(loader)
+
+    waiters = [asyncio.ensure_future(coalesced('addr')) for _ in range(3)]
+    await asyncio.sleep(0)
+    loader.released.set()
+    results = await asyncio.gather(*waiters, return_exceptions=True)
+
+    assert all(isinstance(r, ConnectionError) for r in results)
+    assert loader.calls == ['addr']
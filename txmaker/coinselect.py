@@ -0,0 +1,256 @@
+import enum
+import math
+import random
+import time
+from typing import Callable, Dict, List, Optional, Tuple, Type
+
+from .bitcoin import (
+    DUST_THRESHOLD,
+    InsufficientFunds,
+    Output,
+    Unspent,
+    UnspentSelector,
+    calc_in_size,
+    calc_out_size,
+    estimate_tx_fee,
+    select_unspents
+)
+from .config import settings
+
+Selection = Tuple[List[Unspent], int]
+
+P2PKH_IN_SIZE = calc_in_size(1)
+P2PKH_OUT_SIZE = 34
+
+
+class CoinSelection(str, enum.Enum):
+    fifo = 'fifo'
+    largest_first = 'largest_first'
+    branch_and_bound = 'branch_and_bound'
+    knapsack = 'knapsack'
+
+
+class Budget:
+    """
+    Limits an expensive search by a number of iterations and a wall time (in seconds).
+    The clock is checked on every iteration, so a search overruns max_time by one iteration at most
+    """
+
+    def __init__(self, max_iterations: int, max_time: float, clock: Callable[[], float] = time.monotonic) -> None:
+        self.max_iterations = max_iterations
+        self.deadline = clock() + max_time
+        self.clock = clock
+        self.iterations = 0
+
+    def spend(self) -> bool:
+        """
+        Counts one more iteration. Returns False when the budget is exhausted
+        """
+        self.iterations += 1
+        if self.iterations > self.max_iterations:
+            return False
+        return self.clock() < self.deadline
+
+    @classmethod
+    def from_settings(cls) -> 'Budget':
+        return cls(settings.coin_selection_max_iterations, settings.coin_selection_max_time)
+
+
+class CoinSelectionStrategy:
+    """
+    Base class of coin selection strategies.
+    Returns a list of selected inputs and a change amount in satoshi,
+    the change output is dropped later if the change is dust
+    """
+
+    def select(self, source_address: str, unspents: List[Unspent],
+               outputs: List[Output], fee_kb: int) -> Selection:
+        raise NotImplementedError
+
+
+class FifoStrategy(CoinSelectionStrategy):
+    """
+    Spends the oldest unspents first
+    """
+
+    def select(self, source_address: str, unspents: List[Unspent],
+               outputs: List[Output], fee_kb: int) -> Selection:
+        return select_unspents(source_address, unspents, outputs, fee_kb)
+
+
+class LargestFirstStrategy(CoinSelectionStrategy):
+    """
+    Spends the largest unspents first, which minimizes the number of inputs
+    """
+
+    def select(self, source_address: str, unspents: List[Unspent],
+               outputs: List[Output], fee_kb: int) -> Selection:
+        by_amount = sorted(unspents, key=lambda u: u.amount, reverse=True)
+        return select_unspents(source_address, by_amount, outputs, fee_kb)
+
+
+class SearchStrategy(CoinSelectionStrategy):
+    """
+    Base class of strategies searching for a subset of unspents within a budget.
+    If nothing is found, falls back to FIFO, so the result is always deterministic
+    """
+
+    def __init__(self, budget: Optional[Budget] = None) -> None:
+        self.budget = budget or Budget.from_settings()
+
+    def search(self, source_address: str, unspents: List[Unspent],
+               outputs: List[Output], fee_kb: int) -> Optional[Selection]:
+        raise NotImplementedError
+
+    def select(self, source_address: str, unspents: List[Unspent],
+               outputs: List[Output], fee_kb: int) -> Selection:
+        selection = self.search(source_address, unspents, outputs, fee_kb)
+        if selection is not None:
+            return selection
+        return select_unspents(source_address, unspents, outputs, fee_kb)
+
+
+class BranchAndBoundStrategy(SearchStrategy):
+    """
+    Searches for a set of unspents matching the outputs plus fee exactly enough
+    to avoid a change output (see "An Evaluation of Coin Selection Strategies", M. Erhardt)
+    """
+
+    def search(self, source_address: str, unspents: List[Unspent],
+               outputs: List[Output], fee_kb: int) -> Optional[Selection]:
+        out_amount = sum(amount for _, amount in outputs)
+        n_out = len(outputs)
+        out_size = calc_out_size([addr for addr, _ in outputs])
+
+        # the search goes in effective values: amounts minus fees for spending them, in millisatoshi,
+        # so the sums are exact integers and the value left to include is 0 once every unspent is included
+        input_fee = P2PKH_IN_SIZE * fee_kb
+        target = (out_amount + estimate_tx_fee(0, 0, n_out, out_size, fee_kb)) * 1000
+        # dropping a change output is worth it while its cost is higher than the excess
+        cost_of_change = math.ceil((P2PKH_OUT_SIZE + P2PKH_IN_SIZE) * fee_kb * 0.001)
+        window = min(cost_of_change, DUST_THRESHOLD)
+        msat_window = window * 1000
+
+        candidates = sorted((u for u in unspents if u.amount * 1000 > input_fee), key=lambda u: u.amount,
+                            reverse=True)
+        values = [u.amount * 1000 - input_fee for u in candidates]
+
+        def exact_excess(selected: List[Unspent]) -> Optional[int]:
+            n_in = len(selected)
+            fee = estimate_tx_fee(n_in, calc_in_size(n_in), n_out, out_size, fee_kb)
+            excess = sum(u.amount for u in selected) - out_amount - fee
+            return excess if 0 <= excess <= window else None
+
+        selection: List[bool] = []
+        value = 0
+        available = sum(values)
+
+        while self.budget.spend():
+            backtrack = False
+            if value + available < target or value > target + msat_window:
+                backtrack = True
+            elif value >= target:
+                selected = [u for u, included in zip(candidates, selection) if included]
+                excess = exact_excess(selected)
+                if excess is not None:
+                    return selected, excess
+                backtrack = True
+            elif len(selection) == len(values):
+                # a leaf falling short, the first check catches it as long as the sums are exact
+                backtrack = True
+
+            if backtrack:
+                # walk back to the last included unspent and try to omit it
+                while selection and not selection[-1]:
+                    selection.pop()
+                    available += values[len(selection)]
+                if not selection:
+                    break
+                selection[-1] = False
+                value -= values[len(selection) - 1]
+            else:
+                available -= values[len(selection)]
+                value += values[len(selection)]
+                selection.append(True)
+
+        return None
+
+
+class KnapsackStrategy(SearchStrategy):
+    """
+    Stochastic approximation of the smallest set of unspents covering outputs, fee and change
+    (the method Bitcoin Core falls back to). Uses a fixed seed, so the result is reproducible
+    """
+
+    def __init__(self, budget: Optional[Budget] = None, seed: int = 0) -> None:
+        super().__init__(budget)
+        self.random = random.Random(seed)
+
+    def search(self, source_address: str, unspents: List[Unspent],
+               outputs: List[Output], fee_kb: int) -> Optional[Selection]:
+        out_amount = sum(amount for _, amount in outputs)
+        n_out = len(outputs) + 1
+        out_size = calc_out_size([addr for addr, _ in outputs] + [source_address])
+
+        input_fee = P2PKH_IN_SIZE * fee_kb * 0.001
+        target = out_amount + estimate_tx_fee(0, 0, n_out, out_size, fee_kb) + DUST_THRESHOLD
+
+        candidates = sorted((u for u in unspents if u.amount > input_fee), key=lambda u: u.amount, reverse=True)
+        values = [u.amount - input_fee for u in candidates]
+        if sum(values) < target:
+            return None
+
+        # only a selection reaching the target may be the best one, otherwise the search has found nothing.
+        # It's kept as (kept, n, i): the first n indexes kept in an iteration plus the index i reaching the target,
+        # the kept ones are only appended to, so recording a selection doesn't copy it
+        best: Optional[Tuple[List[int], int, int]] = None
+        best_value = math.inf
+
+        while best_value != target and self.budget.spend():
+            included = [False] * len(values)
+            kept: List[int] = []
+            value = 0.0
+            reached = False
+            for n_pass in range(2):
+                if reached:
+                    break
+                for i, v in enumerate(values):
+                    # the first pass includes randomly, the second one includes what's left
+                    take = self.random.random() < 0.5 if n_pass == 0 else not included[i]
+                    if not take:
+                        continue
+                    if value + v >= target:
+                        reached = True
+                        if value + v < best_value:
+                            best, best_value = (kept, len(kept), i), value + v
+                        continue
+                    value += v
+                    included[i] = True
+                    kept.append(i)
+
+        if best is None:
+            return None
+        best_kept, n_kept, last = best
+        selected = [candidates[i] for i in sorted(best_kept[:n_kept] + [last])]
+        selector = UnspentSelector(source_address, outputs, fee_kb)
+        for u in selected:
+            selector.add(u)
+        try:
+            return selector.result()
+        except InsufficientFunds:
+            return None
+
+
+STRATEGIES: Dict[CoinSelection, Type[CoinSelectionStrategy]] = {
+    CoinSelection.fifo: FifoStrategy,
+    CoinSelection.largest_first: LargestFirstStrategy,
+    CoinSelection.branch_and_bound: BranchAndBoundStrategy,
+    CoinSelection.knapsack: KnapsackStrategy,
+}
+
+
+def make_strategy(name: CoinSelection) -> CoinSelectionStrategy:
+    """
+    Creates a strategy with a fresh per-request budget
+    """
+    return STRATEGIES[CoinSelection(name)]()
@@ -0,0 +1,91 @@
+from typing import List
+
+import pytest
+
+from .bitcoin import InsufficientFunds, Unspent, calc_in_size, calc_out_size, estimate_tx_fee, select_unspents
+from .coinselect import (
+    BranchAndBoundStrategy,
+    Budget,
+    CoinSelection,
+    FifoStrategy,
+    KnapsackStrategy,
+    LargestFirstStrategy,
+    make_strategy
+)
+
+SOURCE = 'mfetsqmVYU1m3w1MNXaDg4cvGYwXJB47Kx'
+DESTINATION = 'mhnnkpnCfBkxN5KpfMArye2F376nATVJDW'
+FEE_KB = 1000
+
+
+def make_unspents(amounts: List[int]) -> List[Unspent]:
+    return [Unspent(amount=amount, confirmations=6, script='00', txid=f'{n:064x}', txindex=0)
+            for n, amount in enumerate(amounts)]
+
+
+def test_make_strategy() -> None:
+    assert isinstance(make_strategy(CoinSelection.fifo), FifoStrategy)
+    assert isinstance(make_strategy('largest_first'), LargestFirstStrategy)  # type: ignore
+
+
+def test_largest_first() -> None:
+    unspents = make_unspents([10000, 500000, 20000])
+    inputs, _ = LargestFirstStrategy().select(SOURCE, unspents, [(DESTINATION, 100000)], FEE_KB)
+    assert [u.amount for u in inputs] == [500000]
+
+
+def test_branch_and_bound_avoids_change() -> None:
+    # a tx with 2 inputs and 1 output costs 340 satoshi
+    unspents = make_unspents([70000, 40000, 60000, 1000000])
+    inputs, change = BranchAndBoundStrategy().select(SOURCE, unspents, [(DESTINATION, 99660)], FEE_KB)
+    assert sorted(u.amount for u in inputs) == [40000, 60000]
+    assert change == 0
+
+
+def test_branch_and_bound_leaves() -> None:
+    # an input costs 170.2 satoshi at this rate, a fraction which floats would only approximate
+    fee_kb = 1150
+    unspents = make_unspents([30000001, 20000003, 10000007])
+    fee = estimate_tx_fee(3, calc_in_size(3), 1, calc_out_size([DESTINATION]), fee_kb)
+    out_amount = sum(u.amount for u in unspents) - fee
+    strategy = BranchAndBoundStrategy()
+
+    # only every unspent together matches the output
+    inputs, change = strategy.select(SOURCE, unspents, [(DESTINATION, out_amount)], fee_kb)
+    assert len(inputs) == 3
+    assert change == 0
+    # every unspent together falls 1 satoshi short
+    assert strategy.search(SOURCE, unspents, [(DESTINATION, out_amount + 1)], fee_kb) is None
+
+
+def test_branch_and_bound_falls_back_to_fifo() -> None:
+    unspents = make_unspents([70000, 40000, 60000, 1000000])
+    outputs = [(DESTINATION, 99660)]
+    strategy = BranchAndBoundStrategy(Budget(max_iterations=1, max_time=1))
+    assert strategy.select(SOURCE, unspents, outputs, FEE_KB) == select_unspents(SOURCE, unspents, outputs, FEE_KB)
+
+
+def test_knapsack_is_reproducible() -> None:
+    unspents = make_unspents([15000 * n for n in range(1, 40)])
+    outputs = [(DESTINATION, 123456)]
+    first = KnapsackStrategy().select(SOURCE, unspents, outputs, FEE_KB)
+    second = KnapsackStrategy().select(SOURCE, unspents, outputs, FEE_KB)
+    assert first == second
+    inputs, change = first
+    assert sum(u.amount for u in inputs) - change - 123456 > 0
+    assert len(inputs) < len(unspents)
+
+
+def test_knapsack_falls_back_to_fifo() -> None:
+    unspents = make_unspents([15000 * n for n in range(1, 51)])
+    outputs = [(DESTINATION, 123456)]
+    for budget in (Budget(max_iterations=0, max_time=1), Budget(max_iterations=100, max_time=0)):
+        strategy = KnapsackStrategy(budget)
+        assert strategy.select(SOURCE, unspents, outputs, FEE_KB) == select_unspents(SOURCE, unspents, outputs, FEE_KB)
+
+
+def test_search_strategies_raise_insufficient_funds() -> None:
+    unspents = make_unspents([1000, 2000])
+    for strategy in (BranchAndBoundStrategy(), KnapsackStrategy()):
+        with pytest.raises(InsufficientFunds):
+            strategy.select(SOURCE, unspents, [(DESTINATION, 100000)], FEE_KB)
@@ -1,12 +1,124 @@
 import sys
+from typing import Dict
 
 from pydantic import BaseSettings, ValidationError
 
+from .listener import ConfigurationError  # noqa: F401
+
 
 class Settings(BaseSettings):
-    port: int = 8080
+    # PORT, WORKERS, UVLOOP and SHUTDOWN_TIMEOUT are read by listener.ListenerSettings, before pydantic is imported
     testnet: bool = False
 
+    # requests handled at once by a worker (0 disables admission control),
+    # up to admission_max_queue more wait for admission_queue_timeout seconds at most
+    max_in_flight: int = 100
+    admission_max_queue: int = 200
+    admission_queue_timeout: float = 1.0
+
+    # where unspent outputs come from: blockchain_info, bitcoind or electrum
+    utxo_provider: str = 'blockchain_info'
+    bitcoind_rpc_url: str = 'http://127.0.0.1:8332'
+    bitcoind_rpc_user: str = ''
+    bitcoind_rpc_password: str = ''
+    # scantxoutset or listunspent (for addresses watched by the node's wallet)
+    bitcoind_rpc_method: str = 'scantxoutset'
+    electrum_host: str = '127.0.0.1'
+    electrum_port: int = 50002
+    electrum_ssl: bool = True
+
+    # blockchain.info connection pool
+    upstream_limit: int = 100
+    upstream_limit_per_host: int = 50
+    upstream_keepalive_timeout: float = 30.0
+    upstream_dns_cache_ttl: int = 300
+    # seconds per upstream call attempt
+    upstream_timeout: float = 10.0
+    upstream_retries: int = 2
+    # the n-th retry waits for a random time up to upstream_retry_backoff * 2^n seconds
+    upstream_retry_backoff: float = 0.1
+    # a duplicate call is sent when a call is slower than this quantile of recent ones (0 disables hedging)
+    upstream_hedge_quantile: float = 0.95
+    upstream_hedge_min_delay: float = 0.05
+    # consecutive failures which make upstream calls fail fast for circuit_breaker_reset_timeout seconds
+    # (0 disables the circuit breaker)
+    circuit_breaker_failures: int = 5
+    circuit_breaker_reset_timeout: float = 30.0
+    # blockchain.info calls per second and their burst, shared by all workers (0 disables pacing)
+    upstream_rate_limit: float = 10.0
+    upstream_rate_burst: int = 20
+    # unspent outputs per blockchain.info request (1000 at most)
+    unspent_page_size: int = 1000
+    # addresses per blockchain.info request when a transaction has multiple source addresses
+    unspent_addresses_per_request: int = 100
+
+    # fee rate estimates used when a request has no fee_kb: mempool_space or static (static_fee_rates),
+    # fee_source_url overrides mempool.space's recommended fees URL
+    fee_source: str = 'mempool_space'
+    fee_source_url: str = ''
+    fee_refresh_interval: float = 60.0
+    # seconds the last estimates are used for while the source fails
+    fee_max_age: float = 600.0
+    static_fee_rates: Dict[str, int] = {'fast': 20000, 'normal': 10000, 'economy': 2000}
+
+    # seconds the inputs of a built transaction aren't spent by other transactions (0 disables reservations),
+    # the inputs of a confirmed transaction stay reserved for reservation_confirmed_ttl seconds
+    reservation_ttl: float = 60.0
+    reservation_confirmed_ttl: float = 3600.0
+    # times a transaction is rebuilt when a concurrent one has reserved its inputs first
+    reservation_retries: int = 3
+
+    # POST /payouts pays the queued payouts of the same wallet with one transaction
+    # once they have payout_batch_max_outputs outputs or the first one has waited for payout_batch_window seconds
+    payout_batch_max_outputs: int = 100
+    payout_batch_window: float = 1.0
+
+    # responses replayed to requests with the same Idempotency-Key (0 disables idempotency keys)
+    idempotency_cache_max_entries: int = 10000
+    idempotency_ttl: float = 24 * 60 * 60
+    # POST /payment_transactions/quote responses reused for the same requests (0 disables the cache)
+    quote_cache_max_entries: int = 1024
+    quote_cache_ttl: float = 5.0
+
+    # POST /payment_transactions/batch
+    batch_max_size: int = 1000
+    batch_concurrency: int = 8
+
+    # per-request budget of expensive coin selection searches
+    coin_selection_max_iterations: int = 100000
+    coin_selection_max_time: float = 0.05
+
+    # UTXO cache (utxo_cache_max_entries=0 disables it)
+    utxo_cache_ttl: float = 10.0
+    utxo_cache_stale_while_revalidate: float = 30.0
+    utxo_cache_stale_if_error: float = 300.0
+    utxo_cache_max_entries: int = 1024
+    utxo_cache_max_bytes: int = 64 * 1024 * 1024
+
+    # transactions with at least this many inputs and outputs are built in a process pool,
+    # tx_process_pool_size=0 builds all of them on the event loop
+    tx_offload_min_size: int = 500
+    tx_process_pool_size: int = 2
+    # spawn the pool processes and connect to the UTXO provider in the background on startup
+    warm_up: bool = True
+
+    # decoded addresses kept in memory
+    address_cache_size: int = 16384
+
+    # indented JSON responses, compact ones are faster to make
+    json_pretty: bool = False
+
+    # profiles of slow requests are kept in profile_dir, an empty one doesn't profile
+    profile_dir: str = ''
+    # the share of requests profiled
+    profile_sample_rate: float = 0.01
+    # seconds a profiled request must take for its profile to be kept
+    profile_min_duration: float = 1.0
+    # the newest profiles kept in profile_dir
+    profile_retention: int = 100
+    # tracemalloc snapshots along with the profiles, tracing slows the worker down much more than profiling
+    profile_trace_memory: bool = False
+
     @property
     def min_confirmations(self) -> int:
         if self.testnet and not hasattr(sys, "_called_from_test"):
@@ -30,10 +142,6 @@ class Settings(BaseSettings):
         case_insensitive = True
 
 
-class ConfigurationError(Exception):
-    pass
-
-
 try:
     settings = Settings()
 except ValidationError as e:
@@ -1,5 +1,5 @@
 from asyncio import AbstractEventLoop
-from typing import Any, Awaitable, Callable, Iterable, List, Type
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Type, Union
 
 import aiohttp
 import pytest
@@ -10,6 +10,7 @@ from aiohttp.web import AbstractRouteDef
 from aiohttp.web_app import Application
 
 from .bitcoin import is_valid_address
+from .config import settings
 from .server import make_app
 from .testing import mocks
 
@@ -22,53 +23,82 @@ def loop(event_loop: AbstractEventLoop) -> AbstractEventLoop:
 
 
 @pytest.fixture
-async def app(loop: AbstractEventLoop) -> Any:
+async def app(loop: AbstractEventLoop, fake_blockchain_info: Any, monkeypatch: MonkeyPatch) -> Any:
+    # tests don't need spawned processes and warm connections
+    monkeypatch.setattr(settings, 'warm_up', False)
     yield await make_app()
 
 
 @pytest.fixture
 async def client(app: Application, aiohttp_client: AIOHTTP_CLIENT_FIXTURE) -> TestClient:
-    yield await aiohttp_client(app)
+    client = await aiohttp_client(app)
+    # e.g. the first fee rates are got
+    await app['readiness'].wait()
+    yield client
 
 
 @pytest.fixture
-async def mock_unspent_response(fake_server_client_factory: Any, monkeypatch: MonkeyPatch) -> Any:
-    async def mock(mock_response: web.Response) -> None:
-        def mock_handler(request: web.Request) -> web.Response:
-            assert 'active' in request.query
-            assert is_valid_address(request.query['active'])
-
-            return mock_response
-        fake_server_client = await fake_server_client_factory(
-            hosts=['testnet.blockchain.info'],
-            routes=[web.get('/unspent', mock_handler)],
-        )
-        monkeypatch.setattr('aiohttp.ClientSession', fake_server_client)
+async def fake_blockchain_info(fake_server_connector_factory: Any, monkeypatch: MonkeyPatch) -> Any:
+    """
+    Starts a fake blockchain.info (and mempool.space) before the app is created,
+    so the app-lifetime client session is connected to it
+    """
+    mocked: Dict[str, Any] = {
+        'fee_rates': {'fastestFee': 30, 'halfHourFee': 15, 'hourFee': 10, 'economyFee': 2, 'minimumFee': 1},
+    }
+
+    async def unspent_handler(request: web.Request) -> web.Response:
+        assert 'active' in request.query
+        assert all(is_valid_address(addr) for addr in request.query['active'].split('|'))
+
+        mocked_response = mocked['unspent']
+        if callable(mocked_response):
+            return mocked_response(request)
+        return mocked_response
+
+    async def fee_rates_handler(request: web.Request) -> web.Response:
+        return web.json_response(mocked['fee_rates'])
+
+    fake_connector = await fake_server_connector_factory(
+        hosts=['testnet.blockchain.info', 'mempool.space'],
+        routes=[
+            web.get('/unspent', unspent_handler),
+            web.get('/testnet/api/v1/fees/recommended', fee_rates_handler),
+        ],
+    )
+    monkeypatch.setattr('aiohttp.TCPConnector', fake_connector)
+    yield mocked
+
+
+@pytest.fixture
+async def mock_unspent_response(fake_blockchain_info: Dict[str, Any]) -> Any:
+    async def mock(mock_response: Union[web.Response, Callable[[web.Request], web.Response]]) -> None:
+        fake_blockchain_info['unspent'] = mock_response
     yield mock
 
 
 @pytest.fixture
-async def fake_server_client_factory() -> Any:
-    running_server = None
+async def fake_server_connector_factory() -> Any:
+    running_servers = []
 
-    async def factory(hosts: List[str], routes: Iterable[AbstractRouteDef]) -> Type[aiohttp.ClientSession]:
-        nonlocal running_server
+    async def factory(hosts: List[str], routes: Iterable[AbstractRouteDef]) -> Type[aiohttp.TCPConnector]:
         running_server = mocks.FakeServer(hosts)
         running_server.add_routes(routes)
         info = await running_server.start()
+        running_servers.append(running_server)
         resolver = mocks.FakeResolver(info)
-        connector = aiohttp.TCPConnector(resolver=resolver, verify_ssl=False)
 
-        class FakeClientSession(aiohttp.ClientSession):
+        class FakeTCPConnector(aiohttp.TCPConnector):
             def __init__(self, *args: Any, **kwargs: Any) -> None:
-                kwargs['connector'] = connector
+                kwargs['resolver'] = resolver
+                kwargs['ssl'] = False
                 super().__init__(*args, **kwargs)
 
-        return FakeClientSession
+        return FakeTCPConnector
 
     yield factory
 
-    if running_server is not None:
+    for running_server in running_servers:
         await running_server.stop()
 
 
@@ -0,0 +1,155 @@
+import asyncio
+import enum
+import logging
+import time
+from typing import Callable, Dict, Optional
+
+import aiohttp
+
+from .bitcoin import MIN_RELAY_FEE
+from .config import ConfigurationError, settings
+from .metrics import UPSTREAM_FETCH
+from .utils import json_loads
+
+logger = logging.getLogger(__name__)
+
+FeeRates = Dict[str, int]
+
+
+class FeeTarget(str, enum.Enum):
+    fast = 'fast'
+    normal = 'normal'
+    economy = 'economy'
+
+
+class FeeRatesUnavailable(Exception):
+    pass
+
+
+class FeeRateSource:
+    """
+    A source of fee rate estimates, in satoshi per 1000 bytes by FeeTarget value
+    """
+
+    name = ''
+
+    async def get_fee_rates(self) -> FeeRates:
+        raise NotImplementedError
+
+
+class StaticFeeSource(FeeRateSource):
+    """
+    Always the same rates, for tests and for networks without a fee market (e.g. regtest)
+    """
+
+    name = 'static'
+
+    def __init__(self, fee_rates: FeeRates) -> None:
+        missing = {t.value for t in FeeTarget} - set(fee_rates)
+        if missing:
+            raise ConfigurationError(f'Static fee rates miss the targets: {", ".join(sorted(missing))}')
+        self.fee_rates = fee_rates
+
+    async def get_fee_rates(self) -> FeeRates:
+        return dict(self.fee_rates)
+
+
+class MempoolSpaceSource(FeeRateSource):
+    """
+    mempool.space's recommended fees. They're in satoshi per virtual byte,
+    the next block, half an hour and "economy" ones are used
+    """
+
+    name = 'mempool_space'
+
+    def __init__(self, session: aiohttp.ClientSession, url: str) -> None:
+        self.session = session
+        self.url = url
+
+    async def get_fee_rates(self) -> FeeRates:
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            async with self.session.get(self.url) as resp:
+                status = str(resp.status)
+                if resp.status != 200:
+                    raise ConnectionError(f'mempool.space responded with {resp.status}')
+                fees = json_loads(await resp.read())
+        finally:
+            UPSTREAM_FETCH.labels(self.name, status).observe(time.perf_counter() - started)
+        return {
+            FeeTarget.fast.value: fees['fastestFee'] * 1000,
+            FeeTarget.normal.value: fees['halfHourFee'] * 1000,
+            FeeTarget.economy.value: fees['economyFee'] * 1000,
+        }
+
+
+def default_mempool_space_url() -> str:
+    if settings.testnet:
+        return 'https://mempool.space/testnet/api/v1/fees/recommended'
+    return 'https://mempool.space/api/v1/fees/recommended'
+
+
+def make_fee_source(session: aiohttp.ClientSession) -> FeeRateSource:
+    if settings.fee_source == 'mempool_space':
+        return MempoolSpaceSource(session, settings.fee_source_url or default_mempool_space_url())
+    if settings.fee_source == 'static':
+        return StaticFeeSource(settings.static_fee_rates)
+    raise ConfigurationError(f'Unknown fee rate source: {settings.fee_source}')
+
+
+class FeeOracle:
+    """
+    Keeps fee rate estimates in memory, refreshing them every `refresh_interval` seconds in the background.
+    The last known estimates are kept while the source fails, but not for longer than `max_age` seconds
+    """
+
+    def __init__(self, source: FeeRateSource, refresh_interval: float, max_age: float,
+                 clock: Callable[[], float] = time.time) -> None:
+        self.source = source
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self.clock = clock
+        self.fee_rates: FeeRates = {}
+        self.updated_at: Optional[float] = None
+        self._task: Optional[asyncio.Future] = None
+
+    async def refresh(self) -> None:
+        fee_rates = await asyncio.wait_for(self.source.get_fee_rates(), settings.upstream_timeout)
+        # nothing below the relay fee would be relayed anyway
+        self.fee_rates = {target: max(rate, MIN_RELAY_FEE) for target, rate in fee_rates.items()}
+        self.updated_at = self.clock()
+
+    async def refresh_safely(self) -> None:
+        try:
+            await self.refresh()
+        except Exception:
+            logger.warning('Failed to refresh fee rates from %s', self.source.name, exc_info=True)
+
+    async def refresh_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await self.refresh_safely()
+
+    def start(self) -> None:
+        """
+        Keeps the estimates fresh in the background, the first ones are got with refresh()
+        """
+        self._task = asyncio.ensure_future(self.refresh_periodically())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def current(self) -> FeeRates:
+        if self.updated_at is None or self.clock() - self.updated_at > self.max_age:
+            raise FeeRatesUnavailable('Fee rate estimates are temporarily unavailable, specify fee_kb')
+        return self.fee_rates
+
+    def fee_kb(self, target: FeeTarget) -> int:
+        return self.current()[target.value]
+
+    @classmethod
+    def from_settings(cls, session: aiohttp.ClientSession) -> 'FeeOracle':
+        return cls(make_fee_source(session), settings.fee_refresh_interval, settings.fee_max_age)
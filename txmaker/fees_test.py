@@ -0,0 +1,58 @@
+from typing import Any
+
+import pytest
+
+from .config import ConfigurationError
+from .fees import FeeOracle, FeeRates, FeeRateSource, FeeRatesUnavailable, FeeTarget, StaticFeeSource
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FlakySource(FeeRateSource):
+    name = 'flaky'
+
+    def __init__(self) -> None:
+        self.fail = False
+
+    async def get_fee_rates(self) -> FeeRates:
+        if self.fail:
+            raise ConnectionError()
+        return {'fast': 30000, 'normal': 10000, 'economy': 500}
+
+
+async def test_fee_oracle(loop: Any) -> None:
+    clock = FakeClock()
+    source = FlakySource()
+    oracle = FeeOracle(source, refresh_interval=60, max_age=600, clock=clock)
+    with pytest.raises(FeeRatesUnavailable):
+        oracle.current()
+
+    oracle.start()
+    await oracle.refresh()
+    try:
+        assert oracle.fee_kb(FeeTarget.fast) == 30000
+        # raised to the min relay fee
+        assert oracle.fee_kb(FeeTarget.economy) == 1000
+
+        # the last known rates are used while the source fails
+        source.fail = True
+        clock.now = 300
+        await oracle.refresh_safely()
+        assert oracle.fee_kb(FeeTarget.normal) == 10000
+
+        clock.now = 601
+        with pytest.raises(FeeRatesUnavailable):
+            oracle.fee_kb(FeeTarget.normal)
+    finally:
+        await oracle.close()
+
+
+def test_static_fee_source_needs_all_targets() -> None:
+    with pytest.raises(ConfigurationError):
+        StaticFeeSource({'fast': 20000})
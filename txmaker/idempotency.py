@@ -0,0 +1,126 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from functools import partial, wraps
+from typing import Awaitable, Callable, NamedTuple, Optional, Tuple
+
+from aiohttp import web
+from pydantic import BaseModel
+
+from .utils import AIOHTTP_HANDLER, error_response
+
+IDEMPOTENCY_KEY_HEADER = 'Idempotency-Key'
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
+
+class RequestMismatch(Exception):
+    pass
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    status: int
+    content_type: str
+
+    @classmethod
+    def from_response(cls, response: web.Response) -> 'CachedResponse':
+        return cls(bytes(response.body), response.status, response.content_type)  # type: ignore
+
+    def to_response(self, replayed: bool = False) -> web.Response:
+        response = web.Response(body=self.body, status=self.status, content_type=self.content_type)
+        if replayed:
+            response.headers['Idempotent-Replayed'] = 'true'
+        return response
+
+
+class ResponseCache:
+    """
+    A bounded LRU cache of responses by key. Requests with the key of a request being handled
+    wait for its response instead of making their own. Server errors (5xx) aren't cached, they may be temporary.
+    The hash of the request made with the key is kept, so reusing the key for another request is noticed
+    """
+
+    def __init__(self, max_entries: int, ttl: float, clock: Callable[[], float] = time.monotonic) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        # key -> (request hash, expiration time, response future)
+        self._entries: 'OrderedDict[str, Tuple[str, float, asyncio.Future]]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get_or_make(self, key: str, request_hash: str,
+                          make: Callable[[], Awaitable[web.Response]]) -> Tuple[CachedResponse, bool]:
+        """
+        Returns the response and whether it has been made for another request.
+        Raises RequestMismatch if the key has been used for another request
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] <= self.clock():
+            del self._entries[key]
+            entry = None
+
+        if entry is not None:
+            cached_hash, _, future = entry
+            if cached_hash != request_hash:
+                raise RequestMismatch()
+            self._entries.move_to_end(key)
+            return await asyncio.shield(future), True
+
+        # a disconnected client doesn't cancel the response its retry may be waiting for
+        future = asyncio.ensure_future(self._make(make))
+        self._entries[key] = (request_hash, self.clock() + self.ttl, future)
+        future.add_done_callback(partial(self._done, key))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return await asyncio.shield(future), False
+
+    async def _make(self, make: Callable[[], Awaitable[web.Response]]) -> CachedResponse:
+        return CachedResponse.from_response(await make())
+
+    def _done(self, key: str, future: asyncio.Future) -> None:
+        if future.cancelled() or future.exception() is not None or future.result().status >= 500:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is future:
+                del self._entries[key]
+
+    @classmethod
+    def from_settings(cls, max_entries: int, ttl: float) -> Optional['ResponseCache']:
+        if max_entries <= 0 or ttl <= 0:
+            return None
+        return cls(max_entries, ttl)
+
+
+def request_hash(request: web.Request) -> str:
+    """
+    Hashes the method, the path and the body of a request read by validate_request
+    """
+    digest = hashlib.sha256(f'{request.method} {request.path}\n'.encode())
+    digest.update(request['body'])
+    return digest.hexdigest()
+
+
+def idempotent(handler: AIOHTTP_HANDLER) -> AIOHTTP_HANDLER:
+    """
+    Replays the response to a request with the same Idempotency-Key header,
+    so a retried request doesn't make another transaction. Goes under validate_request
+    """
+    @wraps(handler)
+    async def wrapped_handler(request: web.Request, req_obj: BaseModel) -> web.Response:
+        cache = request.app['state']['idempotency_cache']
+        key = request.headers.get(IDEMPOTENCY_KEY_HEADER)
+        if key is None or cache is None:
+            return await handler(request, req_obj)
+
+        if not key or len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+            return error_response('invalid_idempotency_key',
+                                  f'{IDEMPOTENCY_KEY_HEADER} must have 1 to {MAX_IDEMPOTENCY_KEY_LENGTH} characters')
+        try:
+            response, replayed = await cache.get_or_make(key, request_hash(request), lambda: handler(request, req_obj))
+        except RequestMismatch:
+            return error_response('idempotency_key_reused',
+                                  f'The {IDEMPOTENCY_KEY_HEADER} has been used for another request', status_code=422)
+        return response.to_response(replayed)
+    return wrapped_handler
@@ -0,0 +1,62 @@
+import asyncio
+from typing import Any, List
+
+import pytest
+from aiohttp import web
+
+from .idempotency import RequestMismatch, ResponseCache
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class Handler:
+    def __init__(self, status: int = 201) -> None:
+        self.status = status
+        self.calls: List[int] = []
+
+    async def __call__(self) -> web.Response:
+        self.calls.append(self.status)
+        await asyncio.sleep(0)
+        return web.Response(body=b'{"n":%d}' % len(self.calls), status=self.status, content_type='application/json')
+
+
+async def test_response_cache(loop: Any) -> None:
+    clock = FakeClock()
+    cache = ResponseCache(max_entries=2, ttl=10, clock=clock)
+    handler = Handler()
+
+    # concurrent requests share the response being made
+    (first, replayed), (second, second_replayed) = await asyncio.gather(
+        cache.get_or_make('key', 'hash', handler), cache.get_or_make('key', 'hash', handler))
+    assert first == second
+    assert (replayed, second_replayed) == (False, True)
+    assert first.body == b'{"n":1}'
+    assert len(handler.calls) == 1
+
+    with pytest.raises(RequestMismatch):
+        await cache.get_or_make('key', 'another hash', handler)
+
+    clock.now = 10
+    response, replayed = await cache.get_or_make('key', 'another hash', handler)
+    assert response.body == b'{"n":2}'
+    assert not replayed
+
+    await cache.get_or_make('a', 'hash', handler)
+    await cache.get_or_make('b', 'hash', handler)
+    assert len(cache) == 2
+
+
+async def test_server_errors_are_not_cached(loop: Any) -> None:
+    cache = ResponseCache(max_entries=10, ttl=10)
+    handler = Handler(status=503)
+    await cache.get_or_make('key', 'hash', handler)
+    response, replayed = await cache.get_or_make('key', 'hash', handler)
+    assert response.status == 503
+    assert not replayed
+    assert len(handler.calls) == 2
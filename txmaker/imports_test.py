@@ -0,0 +1,61 @@
+import subprocess
+import sys
+from typing import Dict, Set, Tuple
+
+# milliseconds, importing the whole app (txmaker.app) takes about twice as long
+SERVER_IMPORT_BUDGET_MS = 700
+
+
+def imported_modules(module: str) -> Set[str]:
+    """
+    Imports the module in a fresh interpreter, returns the top-level packages and the txmaker modules it has loaded
+    """
+    code = f'import sys, {module}; print("\\n".join(sys.modules))'
+    result = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    modules = result.stdout.split()
+    return {name.split('.')[0] for name in modules} | {name for name in modules if name.startswith('txmaker.')}
+
+
+def import_times(module: str) -> Tuple[Dict[str, int], int]:
+    """
+    Imports the module in a fresh interpreter under -X importtime, returns the imported modules
+    with their cumulative import times and the total time, in microseconds
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = {}
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+        # the nested imports are indented, they're included in their parents' times
+        if not name.startswith('  '):
+            total += int(cumulative)
+    return times, total
+
+
+def test_package_import_is_lazy() -> None:
+    assert not {'aiohttp', 'pydantic', 'prometheus_client', 'bit'} & imported_modules('txmaker')
+
+
+def test_process_pool_workers_import_only_serialization() -> None:
+    # the workers unpickle rawtx.serialize_transaction, so they import rawtx alone
+    modules = imported_modules('txmaker.rawtx')
+    assert not {'aiohttp', 'pydantic', 'prometheus_client'} & modules
+    assert {name for name in modules if name.startswith('txmaker.')} == {'txmaker.rawtx'}
+
+
+def test_server_imports_no_optional_modules() -> None:
+    assert not {'txmaker.loadtest', 'txmaker.benchmarks', 'uvloop'} & imported_modules('txmaker.server')
+
+
+def test_server_startup_import_time() -> None:
+    # the rest of the app is imported once the listener is open
+    times, _ = import_times('txmaker.server')
+    assert not {'pydantic', 'bit', 'prometheus_client', 'txmaker.config', 'txmaker.app', 'txmaker.fees',
+                'txmaker.providers'} & set(times)
+    # the best of a few runs, so a busy machine doesn't fail the test
+    best = min(import_times('txmaker.server')[1] for _ in range(3))
+    assert best / 1000 < SERVER_IMPORT_BUDGET_MS
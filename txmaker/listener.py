@@ -0,0 +1,57 @@
+import os
+from typing import Callable, Dict, Mapping
+
+TRUE_VALUES = {'1', 'on', 't', 'true', 'y', 'yes'}
+FALSE_VALUES = {'0', 'off', 'f', 'false', 'n', 'no'}
+
+
+class ConfigurationError(Exception):
+    pass
+
+
+def parse_bool(value: str) -> bool:
+    if value.lower() in TRUE_VALUES:
+        return True
+    if value.lower() in FALSE_VALUES:
+        return False
+    raise ValueError(value)
+
+
+class ListenerSettings:
+    """
+    The settings needed to open the listener. They are read without pydantic,
+    so the port opens before the rest of the app (config.Settings included) is imported
+    """
+
+    PARSERS: Dict[str, Callable[[str], object]] = {
+        'port': int,
+        'workers': int,
+        'uvloop': parse_bool,
+        'shutdown_timeout': float,
+    }
+
+    def __init__(self, port: int = 8080, workers: int = 1, uvloop: bool = False,
+                 shutdown_timeout: float = 30.0) -> None:
+        self.port = port
+        # worker processes sharing the port, 0 means one per CPU
+        self.workers = workers
+        self.uvloop = uvloop
+        # seconds given to in-flight requests on shutdown
+        self.shutdown_timeout = shutdown_timeout
+
+    @classmethod
+    def from_env(cls, environ: Mapping[str, str] = os.environ) -> 'ListenerSettings':
+        # the names are case insensitive, like the other settings' ones
+        env = {name.lower(): value for name, value in environ.items()}
+        values = {}
+        for name, parse in cls.PARSERS.items():
+            if name not in env:
+                continue
+            try:
+                values[name] = parse(env[name])
+            except ValueError:
+                raise ConfigurationError(f'Configuration error. {name.upper()} is invalid: {env[name]!r}')
+        return cls(**values)  # type: ignore
+
+
+listener = ListenerSettings.from_env()
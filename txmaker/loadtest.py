@@ -0,0 +1,352 @@
+"""
+End-to-end load test of the service against a fake blockchain.info.
+Nothing goes to the network:
+
+    python -m txmaker.loadtest --rate 200 --duration 30 --concurrency 100 --upstream-latency 0.05
+
+The app is configured by the same env variables, e.g. UPSTREAM_RATE_LIMIT=0 lifts the blockchain.info pacing
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import random
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple, Type
+from urllib.parse import urlparse
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import unused_port
+from bit.transaction import address_to_scriptpubkey
+from yarl import URL
+
+from .benchmarks import make_address
+from .config import settings
+from .fees import default_mempool_space_url
+from .server import make_app
+from .testing import mocks
+
+UPSTREAM_HOST = urlparse(settings.blockchain_info_base_url).hostname
+FEES_URL = urlparse(settings.fee_source_url or default_mempool_space_url())
+FEES_BODY = json.dumps({'fastestFee': 20, 'halfHourFee': 10, 'hourFee': 5, 'economyFee': 2, 'minimumFee': 1})
+
+
+class FakeBlockchainInfo:
+    """
+    blockchain.info's /unspent with a configurable latency, error rate and number of unspent outputs per address.
+    Pages are serialized once, so the fake costs little CPU next to the service under test.
+    It also serves constant mempool.space fee rates
+    """
+
+    def __init__(self, utxo_count: int = 100, utxo_value: int = 100000, latency: float = 0.0,
+                 error_rate: float = 0.0, seed: int = 0) -> None:
+        self.utxo_count = utxo_count
+        self.utxo_value = utxo_value
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self._pages: Dict[Tuple[str, int, int], bytes] = {}
+        self.server = mocks.FakeServer([str(UPSTREAM_HOST), str(FEES_URL.hostname)])
+        self.server.add_routes([
+            web.get('/unspent', self.unspent_handler),
+            web.get(FEES_URL.path, self.fees_handler),
+        ])
+
+    def unspent_outputs(self, address: str) -> List[Dict[str, Any]]:
+        script = address_to_scriptpubkey(address).hex()
+        # newest first, as blockchain.info returns them
+        return [{
+            'tx_hash_big_endian': hashlib.sha256(f'{address}:{n}'.encode()).hexdigest(),
+            'tx_output_n': n % 4,
+            'script': script,
+            'value': self.utxo_value,
+            'confirmations': 6 + n,
+        } for n in range(self.utxo_count)]
+
+    def page(self, active: str, limit: int, offset: int) -> bytes:
+        key = (active, limit, offset)
+        if key not in self._pages:
+            outputs = [u for addr in active.split('|') for u in self.unspent_outputs(addr)]
+            self._pages[key] = json.dumps({'unspent_outputs': outputs[offset:offset + limit]}).encode()
+        return self._pages[key]
+
+    async def unspent_handler(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        if self.latency:
+            # exponentially distributed around the mean, like queueing delays are
+            await asyncio.sleep(self.random.expovariate(1 / self.latency))
+        if self.random.random() < self.error_rate:
+            return web.Response(status=503)
+        body = self.page(request.query['active'], int(request.query.get('limit', 250)),
+                         int(request.query.get('offset', 0)))
+        return web.Response(body=body, content_type='application/json')
+
+    async def fees_handler(self, request: web.Request) -> web.Response:
+        return web.Response(text=FEES_BODY, content_type='application/json')
+
+    async def start(self) -> Dict[str, int]:
+        return await self.server.start()
+
+    async def stop(self) -> None:
+        await self.server.stop()
+
+
+def fake_connector(upstream: Dict[str, int]) -> Type[aiohttp.TCPConnector]:
+    resolver = mocks.FakeResolver(upstream)
+
+    class FakeTCPConnector(aiohttp.TCPConnector):
+        def __init__(self, *args: Any, **kwargs: Any) -> None:
+            kwargs['resolver'] = resolver
+            kwargs['ssl'] = False
+            super().__init__(*args, **kwargs)
+
+    return FakeTCPConnector
+
+
+async def start_app(port: int, upstream: Dict[str, int]) -> web.AppRunner:
+    """
+    Starts the real app with its client session connected to the fake upstream
+    """
+    runner = web.AppRunner(await make_app())
+    # the client session is made once the app is loaded
+    connector_cls = aiohttp.TCPConnector
+    aiohttp.TCPConnector = fake_connector(upstream)  # type: ignore
+    try:
+        await runner.setup()
+        await runner.app['readiness'].wait()
+    finally:
+        aiohttp.TCPConnector = connector_cls  # type: ignore
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    return runner
+
+
+def serve_app(port: int, upstream: Dict[str, int], ready: Any) -> None:
+    """
+    Runs the app in a child process, so the load generator doesn't compete with it for the CPU
+    """
+    # failed requests are counted in the report, their tracebacks would flood the output
+    logging.getLogger('aiohttp.server').setLevel(logging.CRITICAL)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(start_app(port, upstream))
+    ready.set()
+    loop.run_forever()
+
+
+class LoadReport:
+    def __init__(self, duration: float, latencies: List[float], statuses: Counter, errors: Counter) -> None:
+        self.duration = duration
+        self.latencies = sorted(latencies)
+        self.statuses = statuses
+        self.errors = errors
+
+    @property
+    def requests(self) -> int:
+        return sum(self.statuses.values())
+
+    @property
+    def throughput(self) -> float:
+        return self.requests / self.duration if self.duration else 0.0
+
+    def percentile(self, p: float) -> float:
+        """
+        Nearest-rank percentile of the latencies, in seconds
+        """
+        if not self.latencies:
+            return 0.0
+        rank = max(int(len(self.latencies) * p / 100 + 0.5), 1)
+        return self.latencies[min(rank, len(self.latencies)) - 1]
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'requests': self.requests,
+            'duration': self.duration,
+            'throughput': self.throughput,
+            'latency': {f'p{p}': self.percentile(p) for p in (50, 95, 99)},
+            'statuses': dict(self.statuses),
+            'errors': dict(self.errors),
+        }
+
+    def format(self) -> str:
+        lines = [
+            f'requests:    {self.requests} in {self.duration:.1f}s',
+            f'throughput:  {self.throughput:.1f} req/s',
+            'latency:     ' + ', '.join(f'p{p}={self.percentile(p) * 1000:.1f}ms' for p in (50, 95, 99)),
+            'statuses:    ' + ', '.join(f'{status}: {n}' for status, n in sorted(self.statuses.items())),
+        ]
+        if self.errors:
+            lines.append('errors:      ' + ', '.join(f'{code}: {n}' for code, n in self.errors.most_common()))
+        return '\n'.join(lines)
+
+
+class LoadGenerator:
+    """
+    Sends transaction requests for random source addresses.
+    With a rate, requests are sent on schedule (open loop) and latencies are counted from the scheduled time,
+    so a stalled service isn't hidden by the generator slowing down. Without a rate, `concurrency`
+    clients send requests back to back
+    """
+
+    def __init__(self, url: str, addresses: List[str], amount: str = '0.001', fee_kb: int = 1000,
+                 rate: float = 0.0, concurrency: int = 10, seed: int = 0) -> None:
+        self.url = url
+        self.addresses = addresses
+        self.amount = amount
+        self.fee_kb = fee_kb
+        self.rate = rate
+        self.concurrency = concurrency
+        self.random = random.Random(seed)
+        self.latencies: List[float] = []
+        self.statuses: Counter = Counter()
+        self.errors: Counter = Counter()
+
+    def make_request(self) -> Dict[str, Any]:
+        source, destination = self.random.sample(self.addresses, 2)
+        return {'source_address': source, 'outputs': {destination: self.amount}, 'fee_kb': self.fee_kb}
+
+    async def send(self, session: aiohttp.ClientSession, started: float) -> None:
+        reservation_id = None
+        try:
+            async with session.post(self.url, json=self.make_request()) as resp:
+                body = await resp.read()
+                self.statuses[resp.status] += 1
+                if resp.status == 201:
+                    reservation_id = json.loads(body).get('reservation_id')
+                if resp.status >= 400:
+                    try:
+                        self.errors[json.loads(body)['error']['code']] += 1
+                    except (ValueError, KeyError, TypeError):
+                        self.errors[f'http_{resp.status}'] += 1
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.statuses['client_error'] += 1
+            self.errors[type(e).__name__] += 1
+        self.latencies.append(time.perf_counter() - started)
+        if reservation_id is not None:
+            await self.release(session, reservation_id)
+
+    async def release(self, session: aiohttp.ClientSession, reservation_id: str) -> None:
+        """
+        The transactions are never broadcast and the fake keeps returning their inputs,
+        so they're released for the next requests
+        """
+        url = str(URL(self.url).with_path(f'/reservations/{reservation_id}/release'))
+        try:
+            async with session.post(url) as resp:
+                await resp.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+
+    async def run(self, duration: float, max_requests: Optional[int] = None) -> LoadReport:
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            started = time.perf_counter()
+            deadline = started + duration
+            if self.rate:
+                await self.run_open_loop(session, started, deadline, max_requests)
+            else:
+                await self.run_closed_loop(session, deadline, max_requests)
+            elapsed = time.perf_counter() - started
+        return LoadReport(elapsed, self.latencies, self.statuses, self.errors)
+
+    async def run_open_loop(self, session: aiohttp.ClientSession, started: float, deadline: float,
+                            max_requests: Optional[int]) -> None:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = []
+
+        async def send(scheduled: float) -> None:
+            async with semaphore:
+                await self.send(session, scheduled)
+
+        n = 0
+        while max_requests is None or n < max_requests:
+            scheduled = started + n / self.rate
+            if scheduled >= deadline:
+                break
+            await asyncio.sleep(max(scheduled - time.perf_counter(), 0))
+            tasks.append(asyncio.ensure_future(send(scheduled)))
+            n += 1
+        await asyncio.gather(*tasks)
+
+    async def run_closed_loop(self, session: aiohttp.ClientSession, deadline: float,
+                              max_requests: Optional[int]) -> None:
+        remaining = [max_requests]
+
+        async def client() -> None:
+            while time.perf_counter() < deadline:
+                if remaining[0] is not None:
+                    if remaining[0] <= 0:
+                        break
+                    remaining[0] -= 1
+                await self.send(session, time.perf_counter())
+
+        await asyncio.gather(*(client() for _ in range(self.concurrency)))
+
+
+async def run_load_test(duration: float = 10.0, rate: float = 0.0, concurrency: int = 10,
+                        max_requests: Optional[int] = None, n_addresses: int = 100,
+                        upstream_latency: float = 0.0, upstream_error_rate: float = 0.0,
+                        utxo_count: int = 100, utxo_value: int = 100000, amount: str = '0.001',
+                        in_process: bool = False) -> LoadReport:
+    upstream = FakeBlockchainInfo(utxo_count, utxo_value, upstream_latency, upstream_error_rate)
+    upstream_ports = await upstream.start()
+    port = unused_port()
+    runner: Optional[web.AppRunner] = None
+    process: Optional[multiprocessing.process.BaseProcess] = None
+    try:
+        if in_process:
+            runner = await start_app(port, upstream_ports)
+        else:
+            ctx = multiprocessing.get_context('spawn')
+            ready = ctx.Event()
+            process = ctx.Process(target=serve_app, args=(port, upstream_ports, ready), daemon=True)
+            process.start()
+            await asyncio.get_event_loop().run_in_executor(None, ready.wait, 30)
+
+        addresses = [make_address(n) for n in range(n_addresses)]
+        generator = LoadGenerator(f'http://127.0.0.1:{port}/payment_transactions', addresses, amount,
+                                  rate=rate, concurrency=concurrency)
+        return await generator.run(duration, max_requests)
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+        if process is not None:
+            process.terminate()
+            process.join()
+        await upstream.stop()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds to generate load for')
+    parser.add_argument('--requests', type=int, help='stop after this number of requests')
+    parser.add_argument('--rate', type=float, default=0.0,
+                        help='requests per second, 0 sends requests back to back from --concurrency clients')
+    parser.add_argument('--concurrency', type=int, default=10, help='max number of requests in flight')
+    parser.add_argument('--addresses', type=int, default=100, help='number of distinct source addresses')
+    parser.add_argument('--upstream-latency', type=float, default=0.0, help='mean blockchain.info latency, seconds')
+    parser.add_argument('--upstream-error-rate', type=float, default=0.0, help='share of failing upstream calls')
+    parser.add_argument('--utxo-count', type=int, default=100, help='unspent outputs per address')
+    parser.add_argument('--utxo-value', type=int, default=100000, help='value of an unspent output, satoshi')
+    parser.add_argument('--amount', default='0.001', help='BTC amount sent by a transaction')
+    parser.add_argument('--in-process', action='store_true', help='run the app in the load generator process')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args(argv)
+
+    report = asyncio.get_event_loop().run_until_complete(run_load_test(
+        duration=args.duration, rate=args.rate, concurrency=args.concurrency, max_requests=args.requests,
+        n_addresses=args.addresses, upstream_latency=args.upstream_latency,
+        upstream_error_rate=args.upstream_error_rate, utxo_count=args.utxo_count, utxo_value=args.utxo_value,
+        amount=args.amount, in_process=args.in_process,
+    ))
+    print(json.dumps(report.as_dict(), indent=2) if args.json else report.format())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
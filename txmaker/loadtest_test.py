@@ -0,0 +1,24 @@
+from collections import Counter
+from typing import Any
+
+from .loadtest import LoadReport, run_load_test
+
+
+def test_load_report_percentiles() -> None:
+    report = LoadReport(2.0, [n / 1000 for n in range(100, 0, -1)], Counter({201: 90, 500: 10}), Counter())
+    assert report.requests == 100
+    assert report.throughput == 50
+    assert report.percentile(50) == 0.05
+    assert report.percentile(99) == 0.099
+    assert report.percentile(100) == 0.1
+
+
+async def test_run_load_test(loop: Any) -> None:
+    report = await run_load_test(duration=10, concurrency=4, max_requests=20, n_addresses=5,
+                                 upstream_error_rate=0.3, utxo_count=50, in_process=True)
+    assert report.requests == 20
+    assert report.statuses[201] > 0
+    # upstream failures which outlast the retries are reported as 503 upstream_unavailable
+    assert report.statuses[201] + report.statuses[503] == 20
+    assert report.statuses[500] == 0
+    assert report.percentile(50) <= report.percentile(99)
@@ -0,0 +1,184 @@
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional
+
+import aiohttp
+from aiohttp import web
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess
+)
+
+# a handler, possibly already wrapped by validate_request
+Handler = Callable[..., Awaitable[web.StreamResponse]]
+
+# stages handled in-process take microseconds, the default buckets start at 5ms
+FAST_BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, float('inf'))
+INPUTS_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+REQUEST_VALIDATION = Histogram(
+    'txmaker_request_validation_seconds', 'Time spent parsing and validating request bodies',
+    buckets=FAST_BUCKETS,
+)
+UPSTREAM_FETCH = Histogram(
+    'txmaker_upstream_fetch_seconds', 'Time spent fetching a page of unspent outputs',
+    ['provider', 'status'],
+)
+COIN_SELECTION = Histogram(
+    'txmaker_coin_selection_seconds', 'Time spent selecting inputs, excluding upstream fetches',
+    ['inputs'], buckets=FAST_BUCKETS,
+)
+SERIALIZATION = Histogram(
+    'txmaker_serialization_seconds', 'Time spent serializing transactions and responses',
+    ['stage'], buckets=FAST_BUCKETS,
+)
+TX_SERIALIZATION = SERIALIZATION.labels('tx_hex')
+JSON_SERIALIZATION = SERIALIZATION.labels('json')
+
+PAYOUT_BATCH_SIZE = Histogram('txmaker_payout_batch_size', 'Payouts paid by one transaction', buckets=INPUTS_BUCKETS)
+
+ERRORS = Counter('txmaker_errors_total', 'Error responses by error code', ['code'])
+REQUESTS_IN_PROGRESS = Gauge('txmaker_requests_in_progress', 'Requests being handled', multiprocess_mode='livesum')
+ADMISSION_QUEUE = Gauge('txmaker_admission_queue_depth', 'Requests waiting to be handled', multiprocess_mode='livesum')
+ADMISSION_REJECTIONS = Counter('txmaker_admission_rejections_total', 'Requests rejected by admission control',
+                               ['reason'])
+UPSTREAM_RETRIES = Counter('txmaker_upstream_retries_total', 'Retried upstream calls')
+UPSTREAM_HEDGES = Counter('txmaker_upstream_hedges_total', 'Hedged duplicate upstream calls')
+UPSTREAM_THROTTLED = Counter('txmaker_upstream_throttled_total', 'Upstream calls delayed to keep under the rate limit')
+CIRCUIT_BREAKER_OPEN = Gauge('txmaker_circuit_breaker_open', 'Whether upstream calls fail fast',
+                             multiprocess_mode='max')
+RESERVATION_CONFLICTS = Counter('txmaker_reservation_conflicts_total',
+                                'Transactions rebuilt because a concurrent one reserved their inputs first')
+UPSTREAM_CONNECTIONS = Gauge('txmaker_upstream_connections', 'Pooled upstream HTTP connections', ['state'],
+                             multiprocess_mode='livesum')
+# seconds between samples of the upstream connection pool state
+CONNECTIONS_SAMPLE_INTERVAL = 1.0
+
+
+def inputs_label(n_inputs: Optional[int]) -> str:
+    """
+    Buckets a number of selected inputs to keep the label cardinality low.
+    None means the selection failed
+    """
+    if n_inputs is None:
+        return 'none'
+    for bound in INPUTS_BUCKETS:
+        if n_inputs <= bound:
+            return str(bound)
+    return '+Inf'
+
+
+class StageTimings:
+    """
+    Durations of a request's stages in seconds, reported in its Server-Timing header
+    """
+
+    __slots__ = ('durations',)
+
+    def __init__(self) -> None:
+        self.durations: Dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        # e.g. a transaction rebuilt after a reservation conflict selects inputs twice
+        self.durations[stage] = self.durations.get(stage, 0.0) + seconds
+
+    def header(self) -> str:
+        return ', '.join(f'{stage};dur={seconds * 1000:.3f}' for stage, seconds in self.durations.items())
+
+
+# the timings of the request being handled, tasks started by the handler share them
+stage_timings: ContextVar[Optional[StageTimings]] = ContextVar('stage_timings', default=None)
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    timings = stage_timings.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+@contextmanager
+def timed_stage(stage: str, histogram: Any) -> Iterator[None]:
+    """
+    Observes the time spent within the block in the histogram and records it as a stage of the request
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        histogram.observe(elapsed)
+        record_stage(stage, elapsed)
+
+
+def server_timing(handler: Handler) -> Handler:
+    """
+    Adds the Server-Timing header with the durations of the stages (validation, upstream, selection,
+    serialization, json) and the total one, so a slow request tells what it was slow at
+    """
+    @wraps(handler)
+    async def wrapped_handler(request: web.Request) -> web.StreamResponse:
+        timings = StageTimings()
+        token = stage_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            response = await handler(request)
+        finally:
+            stage_timings.reset(token)
+        timings.add('total', time.perf_counter() - started)
+        response.headers['Server-Timing'] = timings.header()
+        return response
+    return wrapped_handler
+
+
+async def watch_connector(connector: aiohttp.BaseConnector, interval: float = CONNECTIONS_SAMPLE_INTERVAL) -> None:
+    """
+    Reports the connection pool state of the app-lifetime client session every `interval` seconds.
+    The gauges are set rather than computed on scrape (set_function), which isn't supported
+    in the multiprocess mode. aiohttp has no public API for the pool state, so its private attributes are read,
+    and the sample is skipped if another aiohttp version doesn't have them
+    """
+    while True:
+        # they're read every time, the connector replaces its dict of idle connections on cleanups
+        acquired = getattr(connector, '_acquired', None)
+        idle = getattr(connector, '_conns', None)
+        if acquired is not None and idle is not None:
+            UPSTREAM_CONNECTIONS.labels('active').set(len(acquired))
+            UPSTREAM_CONNECTIONS.labels('idle').set(sum(len(conns) for conns in idle.values()))
+        await asyncio.sleep(interval)
+
+
+@web.middleware
+async def in_progress_middleware(request: web.Request,
+                                 handler: Callable[[web.Request], Awaitable[web.StreamResponse]]) -> web.StreamResponse:
+    with REQUESTS_IN_PROGRESS.track_inprogress():
+        return await handler(request)
+
+
+def multiprocess_mode() -> bool:
+    """
+    Worker processes write their metrics to files in PROMETHEUS_MULTIPROC_DIR, so any of them can report all
+    """
+    return 'PROMETHEUS_MULTIPROC_DIR' in os.environ
+
+
+def mark_worker_dead(pid: int) -> None:
+    if multiprocess_mode():
+        multiprocess.mark_process_dead(pid)
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    registry = REGISTRY
+    if multiprocess_mode():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return web.Response(body=generate_latest(registry), headers={'Content-Type': CONTENT_TYPE_LATEST})
@@ -0,0 +1,47 @@
+import asyncio
+import os
+import subprocess
+import sys
+from types import SimpleNamespace
+from typing import Any
+
+import pytest
+from prometheus_client import REGISTRY
+
+from .metrics import UPSTREAM_CONNECTIONS, watch_connector
+
+# a worker samples a fake connection pool, another process collects the metrics of all the workers
+WORKER = '''
+import asyncio
+from types import SimpleNamespace
+from txmaker.metrics import watch_connector
+
+connector = SimpleNamespace(_acquired={1, 2}, _conns={"host": [1, 2, 3]})
+try:
+    asyncio.run(asyncio.wait_for(watch_connector(connector), 0.1))
+except asyncio.TimeoutError:
+    pass
+'''
+COLLECTOR = '''
+from prometheus_client import CollectorRegistry, generate_latest, multiprocess
+registry = CollectorRegistry()
+multiprocess.MultiProcessCollector(registry)
+print(generate_latest(registry).decode())
+'''
+
+
+def test_upstream_connections_in_multiprocess_mode(tmp_path: Any) -> None:
+    env = {**os.environ, 'PROMETHEUS_MULTIPROC_DIR': str(tmp_path)}
+    subprocess.run([sys.executable, '-c', WORKER], env=env, check=True)
+    result = subprocess.run([sys.executable, '-c', COLLECTOR], env=env, check=True,
+                            stdout=subprocess.PIPE, universal_newlines=True)
+    # livesum gauges of dead workers aren't reported, but the worker isn't marked dead here
+    assert 'txmaker_upstream_connections{state="active"} 2.0' in result.stdout
+    assert 'txmaker_upstream_connections{state="idle"} 3.0' in result.stdout
+
+
+async def test_connector_without_pool_attributes_is_not_sampled(loop: Any) -> None:
+    UPSTREAM_CONNECTIONS.labels('active').set(7)
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(watch_connector(SimpleNamespace(), interval=0.01), 0.05)  # type: ignore
+    assert REGISTRY.get_sample_value('txmaker_upstream_connections', {'state': 'active'}) == 7
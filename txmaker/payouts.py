@@ -0,0 +1,120 @@
+import asyncio
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Set, Tuple
+
+from .config import settings
+from .metrics import PAYOUT_BATCH_SIZE
+
+# an output address and an amount
+Payout = Tuple[str, Decimal]
+Result = Tuple[Dict[str, Any], int]
+# builds one transaction paying all the outputs, returns a response body and a status code
+BuildBatch = Callable[[Hashable, List[Payout]], Awaitable[Result]]
+
+
+class PendingPayout:
+    __slots__ = ('outputs', 'future')
+
+    def __init__(self, outputs: List[Payout], future: asyncio.Future) -> None:
+        self.outputs = outputs
+        self.future = future
+
+
+class PayoutBatcher:
+    """
+    Queues payouts by key (source addresses, fee rate etc.) and pays the queued ones with a single transaction
+    once they have `max_outputs` outputs or the first of them has waited for `max_delay` seconds.
+    Every payout gets the shared transaction and the indexes of its outputs in it.
+    If the merged transaction can't be made (e.g. there isn't enough funds for all the payouts),
+    every payout is made separately
+    """
+
+    def __init__(self, build: BuildBatch, max_outputs: int, max_delay: float) -> None:
+        self.build = build
+        self.max_outputs = max_outputs
+        self.max_delay = max_delay
+        self._queues: Dict[Hashable, List[PendingPayout]] = {}
+        self._n_outputs: Dict[Hashable, int] = {}
+        self._timers: Dict[Hashable, asyncio.TimerHandle] = {}
+        self._batches: Set[asyncio.Future] = set()
+
+    async def submit(self, key: Hashable, outputs: List[Payout]) -> Result:
+        loop = asyncio.get_event_loop()
+        payout = PendingPayout(outputs, loop.create_future())
+        queue = self._queues.setdefault(key, [])
+        queue.append(payout)
+        self._n_outputs[key] = self._n_outputs.get(key, 0) + len(outputs)
+        if self._n_outputs[key] >= self.max_outputs:
+            self.flush(key)
+        elif len(queue) == 1:
+            self._timers[key] = loop.call_later(self.max_delay, self.flush, key)
+
+        try:
+            # a cancelled caller doesn't cancel the batch
+            return await asyncio.shield(payout.future)
+        except asyncio.CancelledError:
+            self.withdraw(key, payout)
+            raise
+
+    def withdraw(self, key: Hashable, payout: PendingPayout) -> None:
+        """
+        Drops a payout which hasn't been sent to the batch yet
+        """
+        queue = self._queues.get(key)
+        if queue is None or payout not in queue:
+            return
+        queue.remove(payout)
+        self._n_outputs[key] -= len(payout.outputs)
+        if not queue:
+            self._timers.pop(key).cancel()
+            del self._queues[key]
+            del self._n_outputs[key]
+
+    def flush(self, key: Hashable) -> None:
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        payouts = self._queues.pop(key, [])
+        self._n_outputs.pop(key, None)
+        if not payouts:
+            return
+        batch = asyncio.ensure_future(self.pay(key, payouts))
+        self._batches.add(batch)
+        batch.add_done_callback(self._batches.discard)
+
+    async def pay(self, key: Hashable, payouts: List[PendingPayout]) -> None:
+        try:
+            body, status = await self.build(key, [output for payout in payouts for output in payout.outputs])
+            if status != 201 and len(payouts) > 1:
+                await asyncio.gather(*(self.pay(key, [payout]) for payout in payouts))
+                return
+        except Exception as e:
+            for payout in payouts:
+                if not payout.future.done():
+                    payout.future.set_exception(e)
+            return
+
+        if status == 201:
+            PAYOUT_BATCH_SIZE.observe(len(payouts))
+        first_index = 0
+        for payout in payouts:
+            indexes = list(range(first_index, first_index + len(payout.outputs)))
+            first_index += len(payout.outputs)
+            if payout.future.done():
+                continue
+            if status == 201:
+                payout.future.set_result(({**body, 'output_indexes': indexes, 'batch_size': len(payouts)}, status))
+            else:
+                payout.future.set_result((body, status))
+
+    async def close(self) -> None:
+        """
+        Pays all the queued payouts right away
+        """
+        for key in list(self._queues):
+            self.flush(key)
+        await asyncio.gather(*self._batches, return_exceptions=True)
+
+    @classmethod
+    def from_settings(cls, build: BuildBatch) -> 'PayoutBatcher':
+        return cls(build, settings.payout_batch_max_outputs, settings.payout_batch_window)
@@ -0,0 +1,68 @@
+import asyncio
+from decimal import Decimal
+from typing import Any, Hashable, List
+
+from .payouts import Payout, PayoutBatcher, Result
+
+
+class FakeBuilder:
+    def __init__(self, max_outputs: int = 100) -> None:
+        self.max_outputs = max_outputs
+        self.batches: List[List[Payout]] = []
+
+    async def __call__(self, key: Hashable, outputs: List[Payout]) -> Result:
+        self.batches.append(outputs)
+        if len(outputs) > self.max_outputs:
+            return {'error': {'code': 'insufficient_funds'}}, 400
+        return {'raw': f'{key}:{len(self.batches)}'}, 201
+
+
+def payout(n: int) -> List[Payout]:
+    return [(f'address{n}', Decimal(n))]
+
+
+async def test_payouts_are_paid_together(loop: Any) -> None:
+    build = FakeBuilder()
+    batcher = PayoutBatcher(build, max_outputs=3, max_delay=10)
+    results = await asyncio.gather(*(batcher.submit('wallet', payout(n)) for n in range(3)))
+
+    assert build.batches == [payout(0) + payout(1) + payout(2)]
+    assert [body['output_indexes'] for body, _ in results] == [[0], [1], [2]]
+    assert {body['raw'] for body, _ in results} == {'wallet:1'}
+    assert results[0] == ({'raw': 'wallet:1', 'output_indexes': [0], 'batch_size': 3}, 201)
+
+
+async def test_payouts_are_paid_after_delay(loop: Any) -> None:
+    build = FakeBuilder()
+    batcher = PayoutBatcher(build, max_outputs=100, max_delay=0.01)
+    first, second, other = await asyncio.gather(
+        batcher.submit('wallet', payout(0)), batcher.submit('wallet', payout(1)), batcher.submit('other', payout(2)))
+
+    assert len(build.batches) == 2
+    assert first[0]['raw'] == second[0]['raw'] != other[0]['raw']
+    assert other[0]['output_indexes'] == [0]
+
+
+async def test_failed_batch_is_paid_separately(loop: Any) -> None:
+    build = FakeBuilder(max_outputs=1)
+    batcher = PayoutBatcher(build, max_outputs=2, max_delay=10)
+    results = await asyncio.gather(*(batcher.submit('wallet', payout(n)) for n in range(2)))
+
+    assert len(build.batches) == 3
+    assert [status for _, status in results] == [201, 201]
+    assert results[0][0]['raw'] != results[1][0]['raw']
+
+
+async def test_cancelled_payout_is_withdrawn(loop: Any) -> None:
+    build = FakeBuilder()
+    batcher = PayoutBatcher(build, max_outputs=100, max_delay=10)
+    cancelled = asyncio.ensure_future(batcher.submit('wallet', payout(0)))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    await asyncio.sleep(0)
+
+    submitted = asyncio.ensure_future(batcher.submit('wallet', payout(1)))
+    await asyncio.sleep(0)
+    await batcher.close()
+    assert build.batches == [payout(1)]
+    assert (await submitted)[1] == 201
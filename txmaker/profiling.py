@@ -0,0 +1,100 @@
+import asyncio
+import cProfile
+import logging
+import os
+import random
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+
+from aiohttp import web
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[web.Request], Awaitable[web.StreamResponse]]
+
+
+class SlowRequestProfiler:
+    """
+    Profiles a `sample_rate` share of requests and keeps the profiles of the ones which took
+    at least `min_duration` seconds in `directory`, as `<time>-<pid>-<method>-<path>.prof` files
+    (readable with pstats or snakeviz) and `.tracemalloc` snapshots if `trace_memory` is set.
+    Only the newest `retention` profiles are kept.
+    One request is profiled at a time per worker, and the profile covers everything the worker did meanwhile,
+    concurrent requests included
+    """
+
+    def __init__(self, directory: str, sample_rate: float, min_duration: float, retention: int,
+                 trace_memory: bool = False, sample: Callable[[], float] = random.random) -> None:
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.min_duration = min_duration
+        self.retention = retention
+        self.trace_memory = trace_memory
+        self.sample = sample
+        self.profiling = False
+        os.makedirs(directory, exist_ok=True)
+
+    @web.middleware
+    async def middleware(self, request: web.Request, handler: Handler) -> web.StreamResponse:
+        if self.profiling or self.sample() >= self.sample_rate:
+            return await handler(request)
+
+        self.profiling = True
+        # tracing which has been started elsewhere (e.g. by PYTHONTRACEMALLOC) is left running
+        start_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if start_tracing:
+            tracemalloc.start()
+        profile = cProfile.Profile()
+        started = time.perf_counter()
+        profile.enable()
+        try:
+            return await handler(request)
+        finally:
+            profile.disable()
+            elapsed = time.perf_counter() - started
+            snapshot = tracemalloc.take_snapshot() if self.trace_memory and elapsed >= self.min_duration else None
+            if start_tracing:
+                tracemalloc.stop()
+            self.profiling = False
+            if elapsed >= self.min_duration:
+                name = self.file_name(request)
+                # dumping blocks on disk writes
+                await asyncio.get_event_loop().run_in_executor(None, self.save, name, profile, snapshot)
+
+    def file_name(self, request: web.Request) -> str:
+        path = request.path.strip('/').replace('/', '_') or 'root'
+        return f'{datetime.utcnow():%Y%m%dT%H%M%S%f}-{os.getpid()}-{request.method}-{path}'
+
+    def save(self, name: str, profile: cProfile.Profile, snapshot: Optional[tracemalloc.Snapshot]) -> None:
+        try:
+            profile.dump_stats(os.path.join(self.directory, f'{name}.prof'))
+            if snapshot is not None:
+                snapshot.dump(os.path.join(self.directory, f'{name}.tracemalloc'))
+            self.rotate()
+        except OSError:
+            logger.warning('Failed to save the profile of a slow request', exc_info=True)
+
+    def rotate(self) -> None:
+        """
+        Removes all but the newest `retention` profiles. The names start with the time, so they sort by age
+        """
+        names = sorted({os.path.splitext(file)[0] for file in os.listdir(self.directory)
+                        if file.endswith(('.prof', '.tracemalloc'))})
+        for name in names[:max(len(names) - self.retention, 0)]:
+            for extension in ('.prof', '.tracemalloc'):
+                try:
+                    os.remove(os.path.join(self.directory, name + extension))
+                except FileNotFoundError:
+                    # another worker sharing the directory has removed it
+                    pass
+
+    @classmethod
+    def from_settings(cls) -> Optional['SlowRequestProfiler']:
+        if not settings.profile_dir or settings.profile_sample_rate <= 0:
+            return None
+        return cls(settings.profile_dir, settings.profile_sample_rate, settings.profile_min_duration,
+                   settings.profile_retention, settings.profile_trace_memory)
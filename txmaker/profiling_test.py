@@ -0,0 +1,46 @@
+import os
+import pstats
+from typing import Any, Iterator
+
+from aiohttp import web
+
+from .profiling import SlowRequestProfiler
+
+
+async def handler(request: web.Request) -> web.Response:
+    return web.Response(text=str(sum(range(1000))))
+
+
+async def test_slow_request_profiler(aiohttp_client: Any, tmp_path: Any) -> None:
+    samples: Iterator[float] = iter([0.5, 0.0, 0.0, 0.0])
+    profiler = SlowRequestProfiler(str(tmp_path), sample_rate=0.1, min_duration=0.0, retention=2,
+                                   trace_memory=True, sample=lambda: next(samples))
+
+    app = web.Application(middlewares=[profiler.middleware])
+    app.router.add_get('/payment_transactions', handler)
+    client = await aiohttp_client(app)
+
+    # not sampled
+    await client.get('/payment_transactions')
+    assert os.listdir(str(tmp_path)) == []
+
+    for _ in range(3):
+        response = await client.get('/payment_transactions')
+        assert response.status == 200
+
+    # the oldest profile has been rotated out
+    files = sorted(os.listdir(str(tmp_path)))
+    assert len(files) == 4
+    assert [os.path.splitext(file)[1] for file in files] == ['.prof', '.tracemalloc'] * 2
+    assert files[0].endswith('-GET-payment_transactions.prof')
+    stats = pstats.Stats(os.path.join(str(tmp_path), files[0]))
+    assert any(function == 'handler' for _, _, function in stats.stats)  # type: ignore
+
+
+async def test_fast_requests_are_not_kept(aiohttp_client: Any, tmp_path: Any) -> None:
+    profiler = SlowRequestProfiler(str(tmp_path), sample_rate=1.0, min_duration=60.0, retention=2)
+    app = web.Application(middlewares=[profiler.middleware])
+    app.router.add_get('/', handler)
+    client = await aiohttp_client(app)
+    await client.get('/')
+    assert os.listdir(str(tmp_path)) == []
@@ -0,0 +1,237 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import ssl
+import time
+from decimal import Decimal
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from .bitcoin import SATOSHI_MULTIPLIER, UtxoSet, get_unspent, parse_address
+from .config import ConfigurationError, settings
+from .metrics import UPSTREAM_FETCH
+
+EMPTY_UTXO_SET = UtxoSet.from_rows([])
+
+
+class UtxoProvider:
+    """
+    A source of unspent outputs.
+    `address` may contain multiple addresses separated by "|",
+    pages are numbered by offset as blockchain.info does it
+    """
+
+    # whether duplicate concurrent calls are fine
+    hedging = True
+    # whether calls are paced under UPSTREAM_RATE_LIMIT (self-hosted nodes aren't)
+    rate_limited = False
+
+    async def get_unspent(self, address: str, offset: int = 0) -> UtxoSet:
+        raise NotImplementedError
+
+    async def warm_up(self) -> None:
+        """
+        Connects in advance, so the first requests don't wait for it
+        """
+
+    async def close(self) -> None:
+        pass
+
+
+class BlockchainInfoProvider(UtxoProvider):
+    rate_limited = True
+
+    def __init__(self, session: aiohttp.ClientSession) -> None:
+        self.session = session
+
+    async def get_unspent(self, address: str, offset: int = 0) -> UtxoSet:
+        return await get_unspent(self.session, address, offset)
+
+    async def warm_up(self) -> None:
+        # any response leaves a resolved and TLS-handshaken connection in the pool
+        async with self.session.head(settings.blockchain_info_base_url):
+            pass
+
+
+class BitcoinCoreProvider(UtxoProvider):
+    """
+    Gets unspent outputs from a Bitcoin Core node via JSON-RPC.
+    `scantxoutset` scans the whole UTXO set (no wallet needed),
+    `listunspent` works for addresses watched by the node's wallet.
+    The node returns all the outputs at once, so there's only the first page
+    """
+
+    # the node refuses to run two scans at once
+    hedging = False
+
+    def __init__(self, session: aiohttp.ClientSession, url: str, user: str = '', password: str = '',
+                 method: str = 'scantxoutset') -> None:
+        if method not in {'scantxoutset', 'listunspent'}:
+            raise ConfigurationError(f'Unsupported Bitcoin Core RPC method: {method}')
+        self.session = session
+        self.url = url
+        self.auth = aiohttp.BasicAuth(user, password) if user else None
+        self.method = method
+        self._ids = itertools.count()
+        # the node rejects a scan while another one is running
+        self._scanning = asyncio.Lock()
+
+    async def call(self, method: str, *params: Any) -> Any:
+        payload = {'jsonrpc': '1.0', 'id': next(self._ids), 'method': method, 'params': params}
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            async with self.session.post(self.url, json=payload, auth=self.auth) as resp:
+                status = str(resp.status)
+                if resp.status not in {200, 500}:
+                    raise ConnectionError(f'Bitcoin Core RPC responded with {resp.status}')
+                try:
+                    resp_data = await resp.json(loads=partial(json.loads, parse_float=Decimal), content_type=None)
+                except ValueError:
+                    raise ConnectionError('Bitcoin Core RPC responded with invalid JSON')
+        finally:
+            UPSTREAM_FETCH.labels('bitcoind', status).observe(time.perf_counter() - started)
+        if resp_data.get('error'):
+            raise ConnectionError(f'Bitcoin Core RPC error: {resp_data["error"]}')
+        return resp_data['result']
+
+    async def get_unspent(self, address: str, offset: int = 0) -> UtxoSet:
+        if offset:
+            return EMPTY_UTXO_SET
+        addresses = address.split('|')
+
+        if self.method == 'scantxoutset':
+            async with self._scanning:
+                result = await self.call('scantxoutset', 'start', [f'addr({addr})' for addr in addresses])
+            tip = result['height']
+            rows = [(u['txid'], u['vout'], to_satoshi(u['amount']), tip - u['height'] + 1, u['scriptPubKey'])
+                    for u in result['unspents']]
+        else:
+            result = await self.call('listunspent', 0, 9999999, addresses)
+            rows = [(u['txid'], u['vout'], to_satoshi(u['amount']), u['confirmations'], u['scriptPubKey'])
+                    for u in result]
+
+        return UtxoSet.from_rows(rows).oldest_first()
+
+
+class ElectrumProvider(UtxoProvider):
+    """
+    Gets unspent outputs from an Electrum server (ElectrumX, electrs, Fulcrum)
+    over a persistent newline-delimited JSON-RPC connection.
+    Requests are pipelined, so concurrent lookups share the connection
+    """
+
+    MAX_RESPONSE_SIZE = 64 * 1024 * 1024
+
+    def __init__(self, host: str, port: int, use_ssl: bool = True, ssl_context: Optional[ssl.SSLContext] = None,
+                 timeout: Optional[float] = None) -> None:
+        self.host = host
+        self.port = port
+        self.ssl_context = (ssl_context or ssl.create_default_context()) if use_ssl else None
+        self.timeout = timeout if timeout is not None else settings.upstream_timeout
+        self._ids = itertools.count()
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Future] = None
+        self._connecting = asyncio.Lock()
+
+    async def _connect(self) -> asyncio.StreamWriter:
+        async with self._connecting:
+            if self._writer is None:
+                reader, self._writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl_context,
+                                                                     limit=self.MAX_RESPONSE_SIZE)
+                self._reader_task = asyncio.ensure_future(self._read_responses(reader))
+        return self._writer
+
+    async def _read_responses(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                future = self._pending.pop(response.get('id'), None)
+                if future is None or future.done():
+                    continue
+                if response.get('error'):
+                    future.set_exception(ConnectionError(f'Electrum error: {response["error"]}'))
+                else:
+                    future.set_result(response['result'])
+        finally:
+            self._disconnect()
+
+    def _disconnect(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError('Electrum connection closed'))
+
+    async def call(self, method: str, *params: Any) -> Any:
+        writer = await self._connect()
+        request_id = next(self._ids)
+        future = asyncio.get_event_loop().create_future()
+        self._pending[request_id] = future
+        writer.write(json.dumps({'jsonrpc': '2.0', 'id': request_id, 'method': method, 'params': params}).encode()
+                     + b'\n')
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def warm_up(self) -> None:
+        await self._connect()
+
+    async def get_unspent(self, address: str, offset: int = 0) -> UtxoSet:
+        if offset:
+            return EMPTY_UTXO_SET
+        scripts = [parse_address(addr).script_pubkey for addr in address.split('|')]
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            tip, *unspents = await asyncio.gather(
+                self.call('blockchain.headers.subscribe'),
+                *(self.call('blockchain.scripthash.listunspent', to_scripthash(script)) for script in scripts),
+            )
+            status = 'ok'
+        finally:
+            UPSTREAM_FETCH.labels('electrum', status).observe(time.perf_counter() - started)
+        rows: List[Tuple[str, int, int, int, str]] = []
+        for script, script_unspents in zip(scripts, unspents):
+            for u in script_unspents:
+                confirmations = tip['height'] - u['height'] + 1 if u['height'] > 0 else 0
+                rows.append((u['tx_hash'], u['tx_pos'], u['value'], confirmations, script.hex()))
+        return UtxoSet.from_rows(rows).oldest_first()
+
+    async def close(self) -> None:
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            await asyncio.gather(self._reader_task, return_exceptions=True)
+        self._disconnect()
+
+
+def to_satoshi(btc_amount: Decimal) -> int:
+    return int(Decimal(btc_amount) * SATOSHI_MULTIPLIER)
+
+
+def to_scripthash(script: bytes) -> str:
+    """
+    Electrum protocol's address representation: reversed sha256 of the scriptPubKey
+    """
+    return hashlib.sha256(script).digest()[::-1].hex()
+
+
+def make_provider(session: aiohttp.ClientSession) -> UtxoProvider:
+    if settings.utxo_provider == 'blockchain_info':
+        return BlockchainInfoProvider(session)
+    if settings.utxo_provider == 'bitcoind':
+        return BitcoinCoreProvider(session, settings.bitcoind_rpc_url, settings.bitcoind_rpc_user,
+                                   settings.bitcoind_rpc_password, settings.bitcoind_rpc_method)
+    if settings.utxo_provider == 'electrum':
+        return ElectrumProvider(settings.electrum_host, settings.electrum_port, settings.electrum_ssl)
+    raise ConfigurationError(f'Unknown UTXO provider: {settings.utxo_provider}')
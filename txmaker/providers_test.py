@@ -0,0 +1,126 @@
+import asyncio
+import ssl
+from typing import Any
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from .config import ConfigurationError, settings
+from .providers import BitcoinCoreProvider, ElectrumProvider, make_provider, to_scripthash
+from .testing import mocks
+
+ADDRESS = 'mfetsqmVYU1m3w1MNXaDg4cvGYwXJB47Kx'
+SCRIPT = '76a9140180799618375ebd21bd67014deca9a167b8f91e88ac'
+
+
+async def test_bitcoind_scantxoutset(loop: Any, fake_server_connector_factory: Any) -> None:
+    requests = []
+
+    async def rpc_handler(request: web.Request) -> web.Response:
+        payload = await request.json()
+        requests.append(payload)
+        return web.json_response({'id': payload['id'], 'error': None, 'result': {
+            'success': True,
+            'height': 1000,
+            'unspents': [
+                {'txid': '11' * 32, 'vout': 0, 'scriptPubKey': SCRIPT, 'amount': 0.1, 'height': 999},
+                {'txid': '22' * 32, 'vout': 1, 'scriptPubKey': SCRIPT, 'amount': 0.00000546, 'height': 500},
+            ],
+        }})
+
+    connector = await fake_server_connector_factory(hosts=['bitcoind.test'], routes=[web.post('/', rpc_handler)])
+    async with aiohttp.ClientSession(connector=connector()) as session:
+        provider = BitcoinCoreProvider(session, 'https://bitcoind.test:8332', 'user', 'password')
+        utxos = await provider.get_unspent(ADDRESS)
+        assert len(await provider.get_unspent(ADDRESS, offset=1000)) == 0
+
+    assert requests[0]['method'] == 'scantxoutset'
+    assert requests[0]['params'] == ['start', [f'addr({ADDRESS})']]
+    assert [(u.txid, u.amount, u.confirmations) for u in utxos] == [('22' * 32, 546, 501), ('11' * 32, 10000000, 2)]
+    assert utxos[0].script == SCRIPT
+
+
+async def test_bitcoind_rpc_error(loop: Any, fake_server_connector_factory: Any) -> None:
+    async def rpc_handler(request: web.Request) -> web.Response:
+        return web.json_response({'id': 0, 'result': None, 'error': {'code': -8, 'message': 'Scan in progress'}},
+                                 status=500)
+
+    connector = await fake_server_connector_factory(hosts=['bitcoind.test'], routes=[web.post('/', rpc_handler)])
+    async with aiohttp.ClientSession(connector=connector()) as session:
+        provider = BitcoinCoreProvider(session, 'https://bitcoind.test:8332', method='listunspent')
+        with pytest.raises(ConnectionError, match='Scan in progress'):
+            await provider.get_unspent(ADDRESS)
+
+
+async def test_bitcoind_invalid_json(loop: Any, fake_server_connector_factory: Any) -> None:
+    async def rpc_handler(request: web.Request) -> web.Response:
+        return web.Response(text='<html>Bad Gateway</html>', status=500)
+
+    connector = await fake_server_connector_factory(hosts=['bitcoind.test'], routes=[web.post('/', rpc_handler)])
+    async with aiohttp.ClientSession(connector=connector()) as session:
+        provider = BitcoinCoreProvider(session, 'https://bitcoind.test:8332')
+        with pytest.raises(ConnectionError, match='invalid JSON'):
+            await provider.get_unspent(ADDRESS)
+
+
+async def test_bitcoind_scans_one_at_a_time(loop: Any, fake_server_connector_factory: Any) -> None:
+    scanning = 0
+    max_scanning = 0
+
+    async def rpc_handler(request: web.Request) -> web.Response:
+        nonlocal scanning, max_scanning
+        payload = await request.json()
+        scanning += 1
+        max_scanning = max(max_scanning, scanning)
+        await asyncio.sleep(0.01)
+        scanning -= 1
+        return web.json_response({'id': payload['id'], 'error': None,
+                                  'result': {'success': True, 'height': 1000, 'unspents': []}})
+
+    connector = await fake_server_connector_factory(hosts=['bitcoind.test'], routes=[web.post('/', rpc_handler)])
+    async with aiohttp.ClientSession(connector=connector()) as session:
+        provider = BitcoinCoreProvider(session, 'https://bitcoind.test:8332')
+        await asyncio.gather(*(provider.get_unspent(ADDRESS) for _ in range(3)))
+
+    assert max_scanning == 1
+
+
+async def test_electrum_listunspent() -> None:
+    scripthash = to_scripthash(bytes.fromhex(SCRIPT))
+    server = mocks.FakeElectrumServer({
+        'blockchain.headers.subscribe': lambda: {'height': 1000, 'hex': ''},
+        'blockchain.scripthash.listunspent': lambda sh: [
+            {'tx_hash': '11' * 32, 'tx_pos': 0, 'height': 0, 'value': 1000},
+            {'tx_hash': '22' * 32, 'tx_pos': 3, 'height': 991, 'value': 2000},
+        ] if sh == scripthash else [],
+    })
+    port = await server.start()
+    ssl_context = ssl.create_default_context()
+    ssl_context.check_hostname = False
+    ssl_context.verify_mode = ssl.CERT_NONE
+    provider = ElectrumProvider('127.0.0.1', port, ssl_context=ssl_context)
+    try:
+        utxos = await provider.get_unspent(f'{ADDRESS}|mhnnkpnCfBkxN5KpfMArye2F376nATVJDW')
+        # the second lookup reuses the connection
+        await provider.get_unspent(ADDRESS)
+    finally:
+        await provider.close()
+        await server.stop()
+
+    assert [(u.txid, u.txindex, u.amount, u.confirmations, u.script) for u in utxos] == [
+        ('22' * 32, 3, 2000, 10, SCRIPT),
+        ('11' * 32, 0, 1000, 0, SCRIPT),
+    ]
+    assert len(server.requests) == 5
+
+
+def test_make_provider_rejects_unknown_provider(monkeypatch: Any) -> None:
+    monkeypatch.setattr(settings, 'utxo_provider', 'unknown')
+    with pytest.raises(ConfigurationError):
+        make_provider(None)  # type: ignore
+
+
+def test_electrum_timeout_from_settings(monkeypatch: Any) -> None:
+    monkeypatch.setattr(settings, 'upstream_timeout', 3.0)
+    assert ElectrumProvider('127.0.0.1', 50002).timeout == 3.0
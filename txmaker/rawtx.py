@@ -0,0 +1,35 @@
+import struct
+from typing import List, Tuple
+
+import bit.transaction
+from bit.constants import LOCK_TIME, VERSION_2
+from bit.transaction import TxIn, TxOut
+
+# The process pool workers serialize transactions with this module alone,
+# so it mustn't import the rest of the package (the settings, the metrics, the web server)
+
+# txid (little endian), output number and amount of a packed input, as they're serialized
+RAW_INPUT_STRUCT = struct.Struct('<32s4s8s')
+# a script pubkey and an amount in satoshi
+ScriptOutput = Tuple[bytes, int]
+
+
+class TxObj(bit.transaction.TxObj):
+    pass
+
+
+def construct_script_outputs(outputs: List[ScriptOutput]) -> List[TxOut]:
+    return [TxOut(amount.to_bytes(8, byteorder='little'), script) for script, amount in outputs]
+
+
+def make_transaction(packed_inputs: bytes, outputs: List[ScriptOutput]) -> TxObj:
+    raw_inputs = [TxIn(b'', txid, txindex, amount=amount)
+                  for txid, txindex, amount in RAW_INPUT_STRUCT.iter_unpack(packed_inputs)]
+    return TxObj(VERSION_2, raw_inputs, construct_script_outputs(outputs), LOCK_TIME)
+
+
+def serialize_transaction(packed_inputs: bytes, outputs: List[ScriptOutput]) -> bytes:
+    """
+    Makes a raw unsigned transaction. Runs in a process pool for large transactions
+    """
+    return bytes(make_transaction(packed_inputs, outputs))
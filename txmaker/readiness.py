@@ -0,0 +1,63 @@
+import asyncio
+import logging
+from typing import Awaitable, Dict, Set
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Readiness:
+    """
+    Runs warm-up steps in the background, so they don't keep the listener from opening.
+    The app is ready once every step has finished: a failed step is logged and reported,
+    but it doesn't keep the app out of service (e.g. fee rates are only needed by some requests)
+    unless the step is required
+    """
+
+    def __init__(self) -> None:
+        self.steps: Dict[str, str] = {}
+        self.required: Set[str] = set()
+        self._tasks: Set[asyncio.Future] = set()
+        self._finished = asyncio.Event()
+        self._finished.set()
+
+    @property
+    def ready(self) -> bool:
+        return PENDING not in self.steps.values() and all(self.steps[name] == DONE for name in self.required)
+
+    def run(self, name: str, step: Awaitable, required: bool = False) -> None:
+        self.steps[name] = PENDING
+        if required:
+            self.required.add(name)
+        self._finished.clear()
+        task = asyncio.ensure_future(self._run(name, step))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, name: str, step: Awaitable) -> None:
+        try:
+            await step
+            self.steps[name] = DONE
+        except Exception:
+            logger.log(logging.ERROR if name in self.required else logging.WARNING,
+                       'Warm-up step %s failed', name, exc_info=True)
+            self.steps[name] = FAILED
+        if PENDING not in self.steps.values():
+            self._finished.set()
+
+    async def wait(self) -> None:
+        await self._finished.wait()
+
+    async def close(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def handler(self, request: web.Request) -> web.Response:
+        # it's answered before the app is loaded, so it doesn't use utils.json_response
+        return web.json_response({'ready': self.ready, 'steps': self.steps}, status=200 if self.ready else 503)
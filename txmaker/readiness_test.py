@@ -0,0 +1,41 @@
+import asyncio
+from typing import Any
+
+from .readiness import Readiness
+
+
+async def test_readiness(loop: Any) -> None:
+    readiness = Readiness()
+    assert readiness.ready
+    connected = loop.create_future()
+
+    async def fail() -> None:
+        raise ConnectionError()
+
+    readiness.run('upstream_pool', connected)
+    readiness.run('fee_rates', fail())
+    await asyncio.sleep(0)
+    assert not readiness.ready
+    assert readiness.steps == {'upstream_pool': 'pending', 'fee_rates': 'failed'}
+    response = await readiness.handler(None)  # type: ignore
+    assert response.status == 503
+
+    connected.set_result(None)
+    await asyncio.wait_for(readiness.wait(), 1)
+    assert readiness.steps == {'upstream_pool': 'done', 'fee_rates': 'failed'}
+    response = await readiness.handler(None)  # type: ignore
+    assert response.status == 200
+    await readiness.close()
+
+
+async def test_failed_required_step(loop: Any) -> None:
+    readiness = Readiness()
+
+    async def fail() -> None:
+        raise ImportError()
+
+    readiness.run('app', fail(), required=True)
+    await asyncio.wait_for(readiness.wait(), 1)
+    assert readiness.steps == {'app': 'failed'}
+    assert not readiness.ready
+    await readiness.close()
@@ -0,0 +1,129 @@
+import hashlib
+import heapq
+import logging
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .bitcoin import Unspent
+from .config import settings
+from .metrics import RESERVATION_CONFLICTS
+from .workers import worker_count
+
+logger = logging.getLogger(__name__)
+
+# a raw (big-endian) txid and an output number
+Outpoint = Tuple[bytes, int]
+
+
+class ReservationConflict(Exception):
+    pass
+
+
+class Reservation:
+    __slots__ = ('id', 'outpoints', 'expires_at', 'confirmed')
+
+    def __init__(self, id: str, outpoints: List[Outpoint], expires_at: float) -> None:
+        self.id = id
+        self.outpoints = outpoints
+        self.expires_at = expires_at
+        self.confirmed = False
+
+
+def reservation_id(raw_tx: bytes) -> str:
+    """
+    The unsigned transaction's hash, so the same transaction always gets the same id
+    """
+    return hashlib.sha256(hashlib.sha256(raw_tx).digest()).digest()[::-1].hex()
+
+
+def unspent_outpoint(unspent: Unspent) -> Outpoint:
+    return bytes.fromhex(unspent.txid), unspent.txindex
+
+
+class ReservationLedger:
+    """
+    Remembers the inputs of built transactions, so concurrent requests don't spend the same outputs.
+    A reservation expires in `ttl` seconds unless it's released or confirmed earlier.
+    The inputs of a confirmed (i.e. broadcast) transaction stay reserved for `confirmed_ttl` seconds,
+    until the UTXO provider stops returning them.
+    The ledger lives in the worker process, it isn't shared with the other workers
+    """
+
+    def __init__(self, ttl: float, confirmed_ttl: float, clock: Callable[[], float] = time.time) -> None:
+        self.ttl = ttl
+        self.confirmed_ttl = confirmed_ttl
+        self.clock = clock
+        self._reservations: Dict[str, Reservation] = {}
+        self._outpoints: Dict[Outpoint, Reservation] = {}
+        # (expires_at, id) of every reservation, outdated ones are skipped when popped
+        self._expiry: List[Tuple[float, str]] = []
+
+    def __len__(self) -> int:
+        self.purge()
+        return len(self._reservations)
+
+    def __contains__(self, outpoint: object) -> bool:
+        reservation = self._outpoints.get(outpoint)  # type: ignore
+        return reservation is not None and reservation.expires_at > self.clock()
+
+    def purge(self) -> None:
+        now = self.clock()
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, id = heapq.heappop(self._expiry)
+            reservation = self._reservations.get(id)
+            if reservation is not None and reservation.expires_at == expires_at:
+                self._remove(reservation)
+
+    def _remove(self, reservation: Reservation) -> None:
+        del self._reservations[reservation.id]
+        for outpoint in reservation.outpoints:
+            if self._outpoints.get(outpoint) is reservation:
+                del self._outpoints[outpoint]
+
+    def _expire_at(self, reservation: Reservation, expires_at: float) -> None:
+        reservation.expires_at = expires_at
+        heapq.heappush(self._expiry, (expires_at, reservation.id))
+
+    def reserve(self, id: str, outpoints: Iterable[Outpoint]) -> Reservation:
+        """
+        Raises ReservationConflict if any of the outputs has been reserved meanwhile
+        """
+        self.purge()
+        outpoints = list(outpoints)
+        if any(outpoint in self for outpoint in outpoints):
+            RESERVATION_CONFLICTS.inc()
+            raise ReservationConflict('The inputs have been reserved by another transaction')
+        reservation = Reservation(id, outpoints, 0.0)
+        self._reservations[id] = reservation
+        for outpoint in outpoints:
+            self._outpoints[outpoint] = reservation
+        self._expire_at(reservation, self.clock() + self.ttl)
+        return reservation
+
+    def get(self, id: str) -> Optional[Reservation]:
+        self.purge()
+        return self._reservations.get(id)
+
+    def release(self, id: str) -> Optional[Reservation]:
+        reservation = self.get(id)
+        if reservation is not None:
+            self._remove(reservation)
+        return reservation
+
+    def confirm(self, id: str) -> Optional[Reservation]:
+        reservation = self.get(id)
+        if reservation is not None:
+            reservation.confirmed = True
+            self._expire_at(reservation, self.clock() + self.confirmed_ttl)
+        return reservation
+
+    @classmethod
+    def from_settings(cls) -> Optional['ReservationLedger']:
+        if settings.reservation_ttl <= 0:
+            return None
+        if worker_count() > 1:
+            # a release or a confirmation would get to a random worker, while the others could spend the same inputs
+            logger.warning('Reservations are kept in memory of a worker process, they are disabled '
+                           'with several WORKERS')
+            return None
+        return cls(settings.reservation_ttl, settings.reservation_confirmed_ttl)
@@ -0,0 +1,59 @@
+from typing import Any
+
+import pytest
+
+from .bitcoin import UtxoSet
+from .listener import listener
+from .reservations import ReservationConflict, ReservationLedger
+
+TXID = bytes.fromhex('e7343a4167bb1c2419364a5f7d8868f8731eafa243df2dcf97111099eaabb40b')
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_reservation_expiry() -> None:
+    clock = FakeClock()
+    ledger = ReservationLedger(ttl=60, confirmed_ttl=3600, clock=clock)
+    ledger.reserve('a', [(TXID, 0), (TXID, 1)])
+    assert (TXID, 1) in ledger
+    with pytest.raises(ReservationConflict):
+        ledger.reserve('b', [(TXID, 1), (TXID, 2)])
+
+    ledger.reserve('b', [(TXID, 2)])
+    ledger.confirm('b')
+    clock.now = 60
+    assert (TXID, 0) not in ledger
+    assert len(ledger) == 1
+    # confirmed inputs are kept until the provider stops returning them
+    assert (TXID, 2) in ledger
+    clock.now = 3660
+    assert ledger.get('b') is None
+
+
+def test_reservation_release() -> None:
+    ledger = ReservationLedger(ttl=60, confirmed_ttl=3600)
+    ledger.reserve('a', [(TXID, 0)])
+    assert ledger.release('a') is not None
+    assert (TXID, 0) not in ledger
+    assert ledger.release('a') is None
+    ledger.reserve('b', [(TXID, 0)])
+
+
+def test_utxo_set_exclude() -> None:
+    script = '76a9140180799618375ebd21bd67014deca9a167b8f91e88ac'
+    utxos = UtxoSet.from_rows([(TXID.hex(), n, 1000 * n, 6, script) for n in range(4)])
+    assert [u.txindex for u in utxos.exclude({(TXID, 1), (TXID, 3)})] == [0, 2]
+    assert utxos.exclude(set()) is utxos
+
+
+def test_reservations_disabled_with_several_workers(monkeypatch: Any, caplog: Any) -> None:
+    assert ReservationLedger.from_settings() is not None
+    monkeypatch.setattr(listener, 'workers', 2)
+    assert ReservationLedger.from_settings() is None
+    assert 'disabled with several WORKERS' in caplog.text
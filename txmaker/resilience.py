@@ -0,0 +1,252 @@
+import asyncio
+import random
+import time
+from collections import Counter, deque
+from typing import Callable, Deque, Optional, Set
+
+from .bitcoin import UpstreamRejected, UtxoSet
+from .cache import UPSTREAM_ERRORS, PageLoader
+from .config import settings
+from .metrics import CIRCUIT_BREAKER_OPEN, UPSTREAM_HEDGES, UPSTREAM_RETRIES, UPSTREAM_THROTTLED
+from .workers import worker_count
+
+
+class CircuitOpen(ConnectionError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Fails fast once the upstream has failed `failure_threshold` times in a row.
+    After `reset_timeout` seconds a single trial call is let through (half-open state):
+    its success closes the circuit, its failure opens it again
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if self.clock() - self.opened_at < self.reset_timeout:
+            return 'open'
+        return 'half_open'
+
+    def before_call(self) -> bool:
+        """
+        Raises CircuitOpen if the call mustn't be made. Returns whether the call is the trial one
+        """
+        state = self.state
+        if state == 'open' or (state == 'half_open' and self._trial_running):
+            raise CircuitOpen('The upstream is unavailable')
+        if state == 'half_open':
+            self._trial_running = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        CIRCUIT_BREAKER_OPEN.set(0)
+
+    def release(self) -> None:
+        """
+        Lets another trial call through if the current one ended without a result
+        """
+        self._trial_running = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._trial_running or self.failures >= self.failure_threshold:
+            self.opened_at = self.clock()
+            CIRCUIT_BREAKER_OPEN.set(1)
+        self._trial_running = False
+
+
+class TokenBucket:
+    """
+    Paces calls to `rate` per second on average, allowing bursts of `burst` calls
+    """
+
+    def __init__(self, rate: float, burst: int, clock: Callable[[], float] = time.monotonic) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = float(burst)
+        self.updated_at = clock()
+
+    def reserve(self) -> float:
+        """
+        Takes a token, returns how many seconds to wait before using it
+        """
+        now = self.clock()
+        self.tokens = min(self.tokens + (now - self.updated_at) * self.rate, self.burst)
+        self.updated_at = now
+        # the balance may go negative, so the callers waiting for tokens are served in order
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    async def acquire(self) -> None:
+        delay = self.reserve()
+        if delay > 0:
+            UPSTREAM_THROTTLED.inc()
+            await asyncio.sleep(delay)
+
+
+class LatencyTracker:
+    """
+    Keeps a window of recent call latencies to estimate their quantiles
+    """
+
+    def __init__(self, window: int = 200, min_samples: int = 20) -> None:
+        self.min_samples = min_samples
+        self._latencies: Deque[float] = deque(maxlen=window)
+
+    def add(self, latency: float) -> None:
+        self._latencies.append(latency)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if len(self._latencies) < self.min_samples:
+            return None
+        latencies = sorted(self._latencies)
+        return latencies[min(int(len(latencies) * q), len(latencies) - 1)]
+
+
+class UpstreamGuard:
+    """
+    Makes upstream calls with a timeout, jittered exponential backoff retries,
+    a hedged duplicate request when a call is slower than the usual `hedge_quantile` of latencies
+    and a circuit breaker. Page loads are reads, so repeating them is safe.
+    4xx responses (UpstreamRejected) aren't retried and don't count as failures, the upstream is fine
+
+    hedge_quantile - 0 disables hedging (e.g. for upstreams which can't run duplicate calls concurrently)
+    rate_limiter - paces every call, retried and hedged ones included
+    """
+
+    def __init__(self, *, timeout: float, retries: int = 0, backoff: float = 0.1, hedge_quantile: float = 0,
+                 hedge_min_delay: float = 0.05, breaker: Optional[CircuitBreaker] = None,
+                 rate_limiter: Optional[TokenBucket] = None) -> None:
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.breaker = breaker
+        self.rate_limiter = rate_limiter
+        self.latencies = LatencyTracker()
+        self.stats: Counter = Counter()
+        self.random = random.Random()
+
+    def hedge_delay(self) -> Optional[float]:
+        if not self.hedge_quantile:
+            return None
+        delay = self.latencies.quantile(self.hedge_quantile)
+        if delay is None:
+            return None
+        return max(delay, self.hedge_min_delay)
+
+    async def attempt(self, loader: PageLoader, address: str, offset: int) -> UtxoSet:
+        if self.rate_limiter is not None:
+            # waiting for our turn isn't the upstream's latency, so it's not within the timeout
+            await self.rate_limiter.acquire()
+        trial = self.breaker is not None and self.breaker.before_call()
+        started = time.monotonic()
+        try:
+            unspents = await asyncio.wait_for(loader(address, offset), self.timeout)
+        except UPSTREAM_ERRORS:
+            if self.breaker is not None:
+                self.breaker.record_failure()
+            raise
+        except UpstreamRejected:
+            if self.breaker is not None:
+                self.breaker.record_success()
+            raise
+        except BaseException:
+            # e.g. the losing hedged call is cancelled, it tells nothing about the upstream
+            if self.breaker is not None and trial:
+                self.breaker.release()
+            raise
+        if self.breaker is not None:
+            self.breaker.record_success()
+        self.latencies.add(time.monotonic() - started)
+        return unspents
+
+    async def hedged_attempt(self, loader: PageLoader, address: str, offset: int) -> UtxoSet:
+        """
+        Sends a duplicate request if the first one is slow, the first successful response wins
+        """
+        delay = self.hedge_delay()
+        first = asyncio.ensure_future(self.attempt(loader, address, offset))
+        if delay is None:
+            return await first
+
+        tasks: Set[asyncio.Future] = {first}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                self.stats['hedges'] += 1
+                UPSTREAM_HEDGES.inc()
+                tasks.add(asyncio.ensure_future(self.attempt(loader, address, offset)))
+            while True:
+                done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                if not pending:
+                    # both failed, the first error is as good as the other one
+                    return first.result()
+                tasks = pending
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def load(self, loader: PageLoader, address: str, offset: int) -> UtxoSet:
+        for n_retry in range(self.retries + 1):
+            try:
+                return await self.hedged_attempt(loader, address, offset)
+            except CircuitOpen:
+                self.stats['rejected'] += 1
+                raise
+            except UPSTREAM_ERRORS:
+                if n_retry == self.retries:
+                    raise
+            self.stats['retries'] += 1
+            UPSTREAM_RETRIES.inc()
+            # "full jitter" keeps the retries of many concurrent requests from arriving together
+            await asyncio.sleep(self.random.uniform(0, self.backoff * 2 ** n_retry))
+        raise AssertionError('unreachable')  # pragma: no cover
+
+    def wrap(self, loader: PageLoader) -> PageLoader:
+        async def guarded_loader(address: str, offset: int) -> UtxoSet:
+            return await self.load(loader, address, offset)
+        return guarded_loader
+
+    @classmethod
+    def from_settings(cls, hedging: bool = True, rate_limited: bool = False) -> 'UpstreamGuard':
+        breaker = None
+        if settings.circuit_breaker_failures > 0:
+            breaker = CircuitBreaker(settings.circuit_breaker_failures, settings.circuit_breaker_reset_timeout)
+        rate_limiter = None
+        if rate_limited and settings.upstream_rate_limit > 0:
+            n_workers = worker_count()
+            rate_limiter = TokenBucket(settings.upstream_rate_limit / n_workers,
+                                       max(settings.upstream_rate_burst // n_workers, 1))
+        return cls(
+            timeout=settings.upstream_timeout,
+            retries=settings.upstream_retries,
+            backoff=settings.upstream_retry_backoff,
+            hedge_quantile=settings.upstream_hedge_quantile if hedging else 0,
+            hedge_min_delay=settings.upstream_hedge_min_delay,
+            breaker=breaker,
+            rate_limiter=rate_limiter,
+        )
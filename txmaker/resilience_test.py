@@ -0,0 +1,130 @@
+import asyncio
+from typing import List
+
+import pytest
+
+from .bitcoin import UpstreamRejected, UtxoSet
+from .resilience import CircuitBreaker, CircuitOpen, TokenBucket, UpstreamGuard
+
+EMPTY = UtxoSet.from_rows([])
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FlakyLoader:
+    """
+    Fails with the given errors first, sleeps for the given delays
+    """
+
+    def __init__(self, errors: int = 0, delays: List[float] = []) -> None:
+        self.errors = errors
+        self.delays = list(delays)
+        self.calls = 0
+
+    async def __call__(self, address: str, offset: int = 0) -> UtxoSet:
+        self.calls += 1
+        if self.delays:
+            await asyncio.sleep(self.delays.pop(0))
+        if self.errors:
+            self.errors -= 1
+            raise ConnectionError()
+        return UtxoSet.from_rows([('00' * 32, self.calls, 1000, 6, '00')])
+
+
+def test_circuit_breaker() -> None:
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == 'closed'
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+
+    clock.now = 10
+    assert breaker.before_call() is True
+    # a single trial call at a time
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+
+    clock.now = 20
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+
+
+def test_token_bucket() -> None:
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, burst=2, clock=clock)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0.5
+    assert bucket.reserve() == 1.0
+
+    clock.now = 10
+    assert bucket.reserve() == 0
+
+
+async def test_retries() -> None:
+    guard = UpstreamGuard(timeout=1, retries=2, backoff=0.001)
+    loader = FlakyLoader(errors=2)
+    unspents = await guard.load(loader, 'addr', 0)
+    assert unspents[0].txindex == 3
+    assert guard.stats['retries'] == 2
+
+    with pytest.raises(ConnectionError):
+        await guard.load(FlakyLoader(errors=3), 'addr', 0)
+
+
+async def test_rejected_request_is_not_retried() -> None:
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    guard = UpstreamGuard(timeout=1, retries=2, backoff=0.001, breaker=breaker)
+    calls = 0
+
+    async def loader(address: str, offset: int) -> UtxoSet:
+        nonlocal calls
+        calls += 1
+        raise UpstreamRejected(400, 'Invalid address')
+
+    with pytest.raises(UpstreamRejected):
+        await guard.load(loader, 'addr', 0)
+    assert calls == 1
+    assert guard.stats['retries'] == 0
+    assert breaker.state == 'closed'
+
+
+async def test_timeout_is_retried() -> None:
+    guard = UpstreamGuard(timeout=0.01, retries=1, backoff=0.001)
+    loader = FlakyLoader(delays=[1])
+    assert len(await guard.load(loader, 'addr', 0)) == 1
+    assert loader.calls == 2
+
+
+async def test_hedged_request() -> None:
+    guard = UpstreamGuard(timeout=1, hedge_quantile=0.95, hedge_min_delay=0.01)
+    for _ in range(guard.latencies.min_samples):
+        guard.latencies.add(0.01)
+    # the first call is stuck, the hedged one answers
+    loader = FlakyLoader(delays=[1, 0])
+    unspents = await asyncio.wait_for(guard.load(loader, 'addr', 0), 0.5)
+    assert unspents[0].txindex == 2
+    assert guard.stats['hedges'] == 1
+
+
+async def test_circuit_breaker_fails_fast() -> None:
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    guard = UpstreamGuard(timeout=1, retries=5, backoff=0.001, breaker=breaker)
+    loader = FlakyLoader(errors=100)
+    with pytest.raises(CircuitOpen):
+        await guard.load(loader, 'addr', 0)
+    assert loader.calls == 2
+    assert guard.stats['rejected'] == 1
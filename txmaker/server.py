@@ -1,76 +1,111 @@
-from decimal import Decimal
-from typing import Dict, cast
+import asyncio
+import importlib
+from functools import partial
+from typing import Awaitable, Callable, Optional
 
 from aiohttp import web
-from pydantic import BaseModel, ConstrainedDecimal, conint, constr
 
-from .bitcoin import MIN_OUTPUT_SIZE, MIN_RELAY_FEE, InsufficientFunds, create_unsigned_transaction, is_valid_address
-from .config import settings
-from .utils import error_response, json_response, validate_request
+from .listener import listener
+from .readiness import Readiness
+from .workers import Supervisor, install_uvloop, worker_count
 
-BitcoinAddress: constr = constr(min_length=1, max_length=100)
+Handler = Callable[[web.Request], Awaitable[web.StreamResponse]]
 
+# the handlers are in txmaker.app, which is imported in the background once the listener is open,
+# as it takes most of the startup time (pydantic, bit, prometheus_client and the rest of the app)
+ROUTES = [
+    ('POST', '/payment_transactions', 'create_transaction'),
+    ('POST', '/payment_transactions/batch', 'create_transactions_batch'),
+    ('POST', '/payment_transactions/quote', 'quote_transaction'),
+    ('POST', '/payouts', 'create_payout'),
+    ('POST', '/reservations/{reservation_id}/release', 'release_reservation'),
+    ('POST', '/reservations/{reservation_id}/confirm', 'confirm_reservation'),
+    ('GET', '/fee_rates', 'get_fee_rates'),
+    ('GET', '/metrics', 'metrics_handler'),
+]
 
-class BitcoinAmount(ConstrainedDecimal):
-    ge = MIN_OUTPUT_SIZE
-    decimal_places = 8
 
+def not_ready() -> web.Response:
+    return web.json_response({'error': {'code': 'not_ready', 'message': 'The server is starting, try again later'}},
+                             status=503)
 
-class CreateTransactionRequest(BaseModel):
-    source_address: BitcoinAddress
-    outputs: Dict[BitcoinAddress, BitcoinAmount]
-    fee_kb: conint(ge=MIN_RELAY_FEE)  # type: ignore
 
+def deferred(name: str) -> Handler:
+    """
+    Calls the handler of txmaker.app once it's loaded
+    """
+    async def handler(request: web.Request) -> web.StreamResponse:
+        module = request.app['state']['handlers']
+        if module is None:
+            return not_ready()
+        return await getattr(module, name)(request)
+    return handler
 
-@validate_request(CreateTransactionRequest)
-async def create_transaction(_: web.Request, req_obj: CreateTransactionRequest) -> web.Response:
-    if not req_obj.outputs:
-        return error_response('empty_outputs', 'You have to specify at least one output')
 
-    if not is_valid_address(req_obj.source_address):
-        return error_response('invalid_source_address',
-                              f'Please specify a valid source address (network: {settings.btc_network})')
+@web.middleware
+async def app_middlewares(request: web.Request, handler: Handler) -> web.StreamResponse:
+    """
+    Runs the middlewares set up along with the handlers
+    """
+    for middleware in reversed(request.app['state']['middlewares']):
+        handler = partial(middleware, handler=handler)
+    return await handler(request)
 
-    if req_obj.source_address[0] in {'2', '3'}:
-        return error_response('unsupported_source_address', 'P2SH source addresses are not supported')
 
-    invalid_outputs = []
-    for output in req_obj.outputs.keys():
-        if not is_valid_address(output):
-            invalid_outputs.append(output)
+async def load_app(app: web.Application) -> None:
+    # the import holds the GIL most of the time, but a thread lets the listener answer meanwhile
+    module = await asyncio.get_event_loop().run_in_executor(None, importlib.import_module, 'txmaker.app')
+    await module.setup(app['state'])  # type: ignore
+    app['state']['handlers'] = module
 
-    if invalid_outputs:
-        return error_response('invalid_output_addresses',
-                              f'Please specify a valid output addresses (network: {settings.btc_network})',
-                              details={'invalid_addresses': invalid_outputs})
 
-    try:
-        tx_obj, inputs = await create_unsigned_transaction(
-            source_address=req_obj.source_address,
-            outputs_dict=cast(Dict[str, Decimal], req_obj.outputs),
-            fee_kb=req_obj.fee_kb,
-        )
-    except InsufficientFunds as e:
-        return error_response('insufficient_funds', str(e))
+async def start_loading(app: web.Application) -> None:
+    app['readiness'].run('app', load_app(app), required=True)
 
-    return json_response({
-        'raw': tx_obj.to_hex(),
-        'inputs': [{
-            'txid': u.txid,
-            'vout': u.txindex,
-            'script_pub_key': u.script,
-            'amount': u.amount
-        } for u in inputs],
-    }, status=201)
+
+async def close_app(app: web.Application) -> None:
+    await app['readiness'].close()
+    state = app['state']
+    while state['cleanup']:
+        await state['cleanup'].pop()(state)
 
 
 async def make_app() -> web.Application:
-    app = web.Application()
-    app.add_routes([
-        web.post('/payment_transactions', create_transaction),
-    ])
+    app = web.Application(middlewares=[app_middlewares])
+    # slow startup work runs in the background, the listener opens without waiting for it
+    app['readiness'] = Readiness()
+    # aiohttp doesn't allow changing the app after startup, so txmaker.app sets up this dict instead
+    app['state'] = {
+        'readiness': app['readiness'],
+        'handlers': None,
+        'middlewares': [],
+        'cleanup': [],
+    }
+    app.on_startup.append(start_loading)
+    app.on_cleanup.append(close_app)
+    app.add_routes([web.route(method, path, deferred(name)) for method, path, name in ROUTES])
+    app.add_routes([web.get('/ready', app['readiness'].handler)])
     return app
 
 
+def mark_worker_dead(pid: int) -> None:
+    from .metrics import mark_worker_dead
+    mark_worker_dead(pid)
+
+
+def serve(worker: Optional[int] = None) -> None:
+    """
+    Serves the app in the current process. Workers share the port with SO_REUSEPORT
+    """
+    if listener.uvloop:
+        install_uvloop()
+    web.run_app(make_app(), host='0.0.0.0', port=listener.port, reuse_port=worker is not None,
+                shutdown_timeout=listener.shutdown_timeout, print=print if not worker else None)
+
+
 def run_app() -> None:
-    web.run_app(make_app(), host='0.0.0.0', port=settings.port)
+    n_workers = worker_count()
+    if n_workers == 1:
+        serve()
+        return
+    Supervisor(serve, n_workers, shutdown_timeout=listener.shutdown_timeout, on_exit=mark_worker_dead).run()
@@ -1,8 +1,13 @@
-from typing import Any
+import asyncio
+from typing import Any, Dict
 
 from aiohttp import web
 from aiohttp.test_utils import TestClient
 
+from . import app as app_module
+from . import server
+from .config import settings
+
 
 async def test_create_transaction_invalid_request(client: TestClient) -> None:
     response = await client.post('/payment_transactions', data='invalid json')
@@ -77,6 +82,42 @@ async def test_create_if_no_available_utxos(client: TestClient, mock_unspent_res
     assert response_data['error']['message'] == 'No confirmed UTXOs were found'
 
 
+async def test_create_if_upstream_unavailable(client: TestClient, mock_unspent_response: Any) -> None:
+    await mock_unspent_response(web.Response(body='Service Unavailable', status=503))
+
+    response = await client.post('/payment_transactions', json={
+        "source_address": "mfetsqmVYU1m3w1MNXaDg4cvGYwXJB47Kx",
+        "outputs": {"mhnnkpnCfBkxN5KpfMArye2F376nATVJDW": "0.0001"},
+        "fee_kb": 25000
+    })
+
+    assert response.status == 503
+    response_data = await response.json()
+    assert response_data['error']['code'] == 'upstream_unavailable'
+
+
+async def test_create_if_upstream_rejects(client: TestClient, mock_unspent_response: Any) -> None:
+    requests = []
+
+    def handler(request: web.Request) -> web.Response:
+        requests.append(request)
+        return web.Response(body='Invalid Bitcoin Address', status=400)
+
+    await mock_unspent_response(handler)
+    response = await client.post('/payment_transactions', json={
+        "source_address": "mfetsqmVYU1m3w1MNXaDg4cvGYwXJB47Kx",
+        "outputs": {"mhnnkpnCfBkxN5KpfMArye2F376nATVJDW": "0.0001"},
+        "fee_kb": 25000
+    })
+
+    assert response.status == 400
+    response_data = await response.json()
+    assert response_data['error']['code'] == 'upstream_rejected'
+    assert response_data['error']['details'] == {'upstream_status': 400}
+    # a client error isn't retried
+    assert len(requests) == 1
+
+
 async def test_create_if_no_available_confirmed_utxos(client: TestClient, mock_unspent_response: Any) -> None:
     await mock_unspent_response(web.json_response({
         "unspent_outputs": [{
@@ -211,11 +252,13 @@ async def test_create_transaction_if_both_p2sh_and_p2pkh_outputs(client: TestCli
                 'vout': 3, 'script_pub_key': '76a9140180799618375ebd21bd67014deca9a167b8f91e88ac',
                 'amount': 13000000
             }
-        ]
+        ],
+        'reservation_id': '4c0c970fa842b4b361ce344b5eb086f3c428ee359437fc23366655ab4c046f91',
     }
 
 
-async def test_create_transaction_if_no_change(client: TestClient, mock_unspent_response: Any) -> None:
+async def test_create_transaction_if_no_change(app: web.Application, client: TestClient,
+                                               mock_unspent_response: Any) -> None:
     await mock_unspent_response(web.json_response({
         "unspent_outputs": [
             {
@@ -260,8 +303,36 @@ async def test_create_transaction_if_no_change(client: TestClient, mock_unspent_
                 'script_pub_key': '76a9146efcf883b4b6f9997be9a0600f6c095fe2bd2d9288ac',
                 'amount': 12982733
             }
-        ]
+        ],
+        'reservation_id': '307eea0db9c5259327228010bb47fb8faec3041cf6ded0be07e5d18778700617',
     }
+    # the listing stays cached, the reservation keeps the next request from spending the same inputs
+    assert 'mqdofsXHpePPGBFXuwwypAqCcXi48Xhb2f' in app['state']['utxo_cache']
+    assert app['state']['utxo_cache'].stats['invalidations'] == 0
+
+
+async def test_cache_invalidated_without_reservations(app: web.Application, client: TestClient,
+                                                      mock_unspent_response: Any) -> None:
+    app['state']['reservations'] = None
+    await mock_unspent_response(web.json_response({
+        "unspent_outputs": [{
+            'tx_hash': 'd0ecaa87d4629a59480d6b156e646a05010d244455fcb7d87af9ecc052fa0264',
+            'tx_hash_big_endian': '6402fa52c0ecf97ad8b7fc5544240d01056a646e156b0d48599a62d487aaecd0',
+            'tx_index': 197282253, 'tx_output_n': 0, 'script': '76a9146efcf883b4b6f9997be9a0600f6c095fe2bd2d9288ac',
+            'value': 12982733, 'value_hex': '00c619cd', 'confirmations': 163637,
+        }]
+    }))
+    response = await client.post('/payment_transactions', json={
+        "source_address": "mqdofsXHpePPGBFXuwwypAqCcXi48Xhb2f",
+        "outputs": {"mhnnkpnCfBkxN5KpfMArye2F376nATVJDW": "0.12976851"},
+        "fee_kb": 2000
+    })
+
+    assert response.status == 201
+    assert 'reservation_id' not in await response.json()
+    # spent inputs must not be served from the cache to the next request
+    assert 'mqdofsXHpePPGBFXuwwypAqCcXi48Xhb2f' not in app['state']['utxo_cache']
+    assert app['state']['utxo_cache'].stats['invalidations'] == 1
 
 
 async def test_create_transaction_with_many_inputs(client: TestClient, mock_unspent_response: Any) -> None:
@@ -339,7 +410,8 @@ async def test_create_transaction_with_many_inputs(client: TestClient, mock_unsp
                 'script_pub_key': '76a9146efcf883b4b6f9997be9a0600f6c095fe2bd2d9288ac',
                 'amount': 12982733,
             }
-        ]
+        ],
+        'reservation_id': '58edcf2c7035643f8af1e3a3af09cd859f4431b239e40660622bced838299f08',
     }
 
     assert response.status == 201
@@ -384,5 +456,504 @@ async def test_create_transaction_with_p2pkh_output(client: TestClient, mock_uns
                 'vout': 3, 'script_pub_key': '76a9140180799618375ebd21bd67014deca9a167b8f91e88ac',
                 'amount': 13000000
             }
-        ]
+        ],
+        'reservation_id': '7869a6bdc820cf37964503957fa6d1a78ed7980a653a26027c1b7ac937d1f19d',
     }
+
+
+async def test_client_session_is_bound_to_app_lifetime(app: web.Application, aiohttp_client: Any) -> None:
+    client = await aiohttp_client(app)
+    await app['readiness'].wait()
+    session = app['state']['client_session']
+    assert not session.closed
+
+    await client.post('/payment_transactions', data='invalid json')
+    assert app['state']['client_session'] is session
+
+    await client.close()
+    assert session.closed
+
+
+async def test_create_transaction_spends_oldest_across_pages(client: TestClient, mock_unspent_response: Any,
+                                                             monkeypatch: Any) -> None:
+    monkeypatch.setattr('txmaker.config.settings.unspent_page_size', 3)
+    requested_offsets = []
+    # newest first, as blockchain.info serves them: 10 to 18 confirmations
+    unspent_outputs = [{
+        "tx_hash_big_endian": f'{n:064x}',
+        "tx_output_n": 0,
+        "script": "76a9140180799618375ebd21bd67014deca9a167b8f91e88ac",
+        "value": 100000,
+        "confirmations": n,
+    } for n in range(10, 19)]
+
+    def paginated_handler(request: web.Request) -> web.Response:
+        limit, offset = int(request.query['limit']), int(request.query['offset'])
+        requested_offsets.append(offset)
+        if offset == 3:
+            # a new output has arrived meanwhile and shifted the rest by one
+            return web.json_response({"unspent_outputs": unspent_outputs[2:5]})
+        return web.json_response({"unspent_outputs": unspent_outputs[offset:offset + limit]})
+
+    await mock_unspent_response(paginated_handler)
+    response = await client.post('/payment_transactions', json={
+        "source_address": "mfetsqmVYU1m3w1MNXaDg4cvGYwXJB47Kx",
+        "outputs": {"mhnnkpnCfBkxN5KpfMArye2F376nATVJDW": "0.0025"},
+        "fee_kb": 1000
+    })
+
+    assert response.status == 201
+    response_data = await response.json()
+    assert [i['txid'] for i in response_data['inputs']] == [f'{n:064x}' for n in (18, 17, 16)]
+    assert requested_offsets == [0, 3, 6, 9]
+
+
+async def test_create_transaction_with_unknown_coin_selection(client: TestClient) -> None:
+    response = await client.post('/payment_transactions', json={
+        "source_address": "mfetsqmVYU1m3w1MNXaDg4cvGYwXJB47Kx",
+        "outputs": {"mhnnkpnCfBkxN5KpfMArye2F376nATVJDW": "0.0001"},
+        "fee_kb": 25000,
+        "coin_selection": "random",
+    })
+    assert response.status == 400
+    response_data = await response.json()
+    assert response_data['error']['code'] == 'invalid_request_schema'
+
+
+async def test_create_transactions_batch(client: TestClient, mock_unspent_response: Any) -> None:
+    requested_addresses = []
+
+    def handler(request: web.Request) -> web.Response:
+        requested_addresses.append(request.query['active'])
+        return web.json_response({
+            "unspent_outputs": [{
+                "tx_hash_big_endian": "e7343a4167bb1c2419364a5f7d8868f8731eafa243df2dcf97111099eaabb40b",
+                "tx_output_n": n,
+                "script": "76a9140180799618375ebd21bd67014deca9a167b8f91e88ac",
+                "value": 13000000,
+                "confirmations": 6
+            } for n in (3, 4)]
+        })
+
+    await mock_unspent_response(handler)
+    payout = {
+        "source_address": "mfetsqmVYU1m3w1MNXaDg4cvGYwXJB47Kx",
+        "outputs": {"mhnnkpnCfBkxN5KpfMArye2F376nATVJDW": "0.0001"},
+        "fee_kb": 25000,
+    }
+    response = await client.post('/payment_transactions/batch', json={
+        "transactions": [payout, payout, {**payout, "outputs": {}}, {**payout, "outputs": {"bad": "0.1"}}],
+    })
+
+    assert response.status == 200
+    results = (await response.json())['results']
+    assert [r['status'] for r in results] == [201, 201, 400, 400]
+    # the same payouts spend different outputs
+    assert {r['body']['inputs'][0]['vout'] for r in results[:2]} == {3, 4}
+    assert results[0]['body']['inputs'][0]['amount'] == 13000000
+    assert results[2]['body']['error']['code'] == 'empty_outputs'
+    assert results[3]['body']['error']['code'] == 'invalid_output_addresses'
+    assert requested_addresses == ["mfetsqmVYU1m3w1MNXaDg4cvGYwXJB47Kx"]
+
+
+async def test_create_transactions_batch_internal_error(client: TestClient, mock_unspent_response: Any,
+                                                        monkeypatch: Any) -> None:
+    await mock_unspent_response(lambda request: web.json_response({
+        "unspent_outputs": [{
+            "tx_hash_big_endian": "e7343a4167bb1c2419364a5f7d8868f8731eafa243df2dcf97111099eaabb40b",
+            "tx_output_n": 3,
+            "script": "76a9140180799618375ebd21bd67014deca9a167b8f91e88ac",
+            "value": 13000000,
+            "confirmations": 6
+        }]
+    }))
+    make_strategy = app_module.make_strategy
+
+    def failing_strategy(coin_selection: Any) -> Any:
+        if coin_selection == 'largest_first':
+            raise RuntimeError('A bug')
+        return make_strategy(coin_selection)
+
+    monkeypatch.setattr(app_module, 'make_strategy', failing_strategy)
+    payout = {
+        "source_address": "mfetsqmVYU1m3w1MNXaDg4cvGYwXJB47Kx",
+        "outputs": {"mhnnkpnCfBkxN5KpfMArye2F376nATVJDW": "0.0001"},
+        "fee_kb": 25000,
+    }
+    response = await client.post('/payment_transactions/batch', json={
+        "transactions": [payout, {**payout, "coin_selection": "largest_first"}],
+    })
+
+    assert response.status == 200
+    results = (await response.json())['results']
+    assert [r['status'] for r in results] == [201, 500]
+    assert results[1]['body']['error']['code'] == 'internal_error'
+
+
+async def test_create_transactions_batch_invalid_request(client: TestClient) -> None:
+    response = await client.post('/payment_transactions/batch', json={"transactions": [{"fee_kb": 1}]})
+    assert response.status == 400
+    assert (await response.json())['error']['code'] == 'invalid_request_schema'
+
+    response = await client.post('/payment_transactions/batch', json={"transactions": []})
+    assert response.status == 400
+    assert (await response.json())['error']['code'] == 'empty_batch'
+
+
+async def test_create_transaction_from_multiple_source_addresses(client: TestClient, mock_unspent_response: Any,
+                                                                 monkeypatch: Any) -> None:
+    monkeypatch.setattr('txmaker.config.settings.unspent_addresses_per_request', 1)
+    requested = []
+    unspents = {
+        "mfetsqmVYU1m3w1MNXaDg4cvGYwXJB47Kx": [
+            {"tx_hash_big_endian": "11" * 32, "tx_output_n": 0, "value": 100000, "confirmations": 10,
+             "script": "76a9140180799618375ebd21bd67014deca9a167b8f91e88ac"},
+        ],
+        "mqdofsXHpePPGBFXuwwypAqCcXi48Xhb2f": [
+            {"tx_hash_big_endian": "22" * 32, "tx_output_n": 1, "value": 100000, "confirmations": 20,
+             "script": "76a9146efcf883b4b6f9997be9a0600f6c095fe2bd2d9288ac"},
+        ],
+    }
+
+    def handler(request: web.Request) -> web.Response:
+        requested.append(request.query['active'])
+        return web.json_response({"unspent_outputs": unspents[request.query['active']]})
+
+    await mock_unspent_response(handler)
+    response = await client.post('/payment_transactions', json={
+        "source_addresses": ["mfetsqmVYU1m3w1MNXaDg4cvGYwXJB47Kx", "mqdofsXHpePPGBFXuwwypAqCcXi48Xhb2f"],
+        "change_address": "mvDvYba71W8at5sU9G8ELqQph8s7fKgbiA",
+        "outputs": {"mhnnkpnCfBkxN5KpfMArye2F376nATVJDW": "0.0015"},
+        "fee_kb": 1000
+    })
+
+    assert response.status == 201
+    response_data = await response.json()
+    # the oldest output goes first regardless of its address
+    assert [i['txid'] for i in response_data['inputs']] == ['22' * 32, '11' * 32]
+    assert requested == ["mfetsqmVYU1m3w1MNXaDg4cvGYwXJB47Kx", "mqdofsXHpePPGBFXuwwypAqCcXi48Xhb2f"]
+    # the change goes to the change address
+    assert 'a914a1515aee272e49cd1e2f9c3490743c4b232d265088ac' in response_data['raw']
+
+
+async def test_create_transaction_without_source_address(client: TestClient) -> None:
+    response = await client.post('/payment_transactions', json={
+        "outputs": {"mhnnkpnCfBkxN5KpfMArye2F376nATVJDW": "0.0001"},
+        "fee_kb": 25000
+    })
+    assert response.status == 400
+    response_data = await response.json()
+    assert response_data['error']['code'] == 'empty_source_addresses'
+
+
+async def test_metrics(client: TestClient, mock_unspent_response: Any) -> None:
+    await mock_unspent_response(web.json_response({
+        "unspent_outputs": [{
+            "tx_hash_big_endian": "e7343a4167bb1c2419364a5f7d8868f8731eafa243df2dcf97111099eaabb40b",
+            "tx_output_n": 3,
+            "script": "76a9140180799618375ebd21bd67014deca9a167b8f91e88ac",
+            "value": 13000000,
+            "confirmations": 6
+        }]
+    }))
+    response = await client.post('/payment_transactions', json={
+        "source_address": "mfetsqmVYU1m3w1MNXaDg4cvGYwXJB47Kx",
+        "outputs": {"mhnnkpnCfBkxN5KpfMArye2F376nATVJDW": "0.0001"},
+        "fee_kb": 25000
+    })
+    assert response.status == 201
+    response = await client.post('/payment_transactions', json={
+        "source_address": "mfetsqmVYU1m3w1MNXaDg4cvGYwXJB47Kx",
+        "outputs": {},
+        "fee_kb": 25000
+    })
+    assert response.status == 400
+
+    response = await client.get('/metrics')
+    assert response.status == 200
+    metrics = await response.text()
+    assert 'txmaker_request_validation_seconds_count' in metrics
+    assert 'txmaker_upstream_fetch_seconds_count{provider="blockchain_info",status="200"}' in metrics
+    assert 'txmaker_coin_selection_seconds_count{inputs="1"}' in metrics
+    assert 'txmaker_serialization_seconds_count{stage="tx_hex"}' in metrics
+    assert 'txmaker_serialization_seconds_count{stage="json"}' in metrics
+    assert 'txmaker_errors_total{code="empty_outputs"}' in metrics
+    assert 'txmaker_requests_in_progress 1.0' in metrics
+    assert 'txmaker_upstream_connections{state="idle"}' in metrics
+
+
+async def test_create_large_transaction_in_process_pool(app: web.Application, client: TestClient,
+                                                        mock_unspent_response: Any, monkeypatch: Any) -> None:
+    monkeypatch.setattr(settings, 'tx_offload_min_size', 2)
+    await mock_unspent_response(web.json_response({
+        "unspent_outputs": [{
+            "tx_hash_big_endian": "e7343a4167bb1c2419364a5f7d8868f8731eafa243df2dcf97111099eaabb40b",
+            "tx_output_n": 3,
+            "script": "76a9140180799618375ebd21bd67014deca9a167b8f91e88ac",
+            "value": 13000000,
+            "confirmations": 6
+        }]
+    }))
+
+    response = await client.post('/payment_transactions', json={
+        "source_address": "mfetsqmVYU1m3w1MNXaDg4cvGYwXJB47Kx",
+        "outputs": {
+            "mhnnkpnCfBkxN5KpfMArye2F376nATVJDW": "0.0001",
+            "mvDvYba71W8at5sU9G8ELqQph8s7fKgbiA": "0.002",
+            "msrXsFAeRMLnY9mGPyeVwZZqxqVQUXh4uh": "0.02"
+        },
+        "fee_kb": 25000
+    })
+
+    assert response.status == 201
+    response_data = await response.json()
+    # the same transaction as the one made on the event loop
+    assert response_data['raw'] == (
+        '02000000010bb4abea99101197cf2ddf43a2af1e73f868887d5f4a3619241cbb67413a34e70300000000fffff'
+        'fff0410270000000000001976a91418eef1d5d14e8032ca7caacefce7164179320b9388ac400d0300000000001'
+        '976a914a1515aee272e49cd1e2f9c3490743c4b232d265088ac80841e00000000001976a91487556ff8cc729dd'
+        '743ee7bf33302098135b95c5e88acba87a400000000001976a9140180799618375ebd21bd67014deca9a167b8f9'
+        '1e88ac00000000'
+    )
+    assert app['state']['tx_executor']._processes
+
+
+async def test_get_fee_rates(client: TestClient) -> None:
+    response = await client.get('/fee_rates')
+    assert response.status == 200
+    response_data = await response.json()
+    assert response_data['fee_rates'] == {'fast': 30000, 'normal': 15000, 'economy': 2000}
+    assert response_data['source'] == 'mempool_space'
+
+
+async def test_create_transaction_with_fee_target(client: TestClient, mock_unspent_response: Any) -> None:
+    await mock_unspent_response(lambda request: web.json_response({
+        "unspent_outputs": [{
+            "tx_hash_big_endian": "e7343a4167bb1c2419364a5f7d8868f8731eafa243df2dcf97111099eaabb40b",
+            "tx_output_n": 3,
+            "script": "76a9140180799618375ebd21bd67014deca9a167b8f91e88ac",
+            "value": 13000000,
+            "confirmations": 6
+        }]
+    }))
+    request: Dict[str, Any] = {
+        "source_address": "mfetsqmVYU1m3w1MNXaDg4cvGYwXJB47Kx",
+        "outputs": {"mhnnkpnCfBkxN5KpfMArye2F376nATVJDW": "0.0001"},
+    }
+
+    async def create(**fields: Any) -> str:
+        response = await client.post('/payment_transactions', json={**request, **fields})
+        assert response.status == 201
+        response_data = await response.json()
+        # frees the only input for the next transaction
+        await client.post(f'/reservations/{response_data["reservation_id"]}/release')
+        return response_data['raw']
+
+    raw = await create(fee_target='fast')
+    assert await create(fee_kb=30000) == raw
+    assert await create() != raw
+
+
+async def test_reservations(client: TestClient, mock_unspent_response: Any) -> None:
+    await mock_unspent_response(lambda request: web.json_response({
+        "unspent_outputs": [{
+            "tx_hash_big_endian": "e7343a4167bb1c2419364a5f7d8868f8731eafa243df2dcf97111099eaabb40b",
+            "tx_output_n": n,
+            "script": "76a9140180799618375ebd21bd67014deca9a167b8f91e88ac",
+            "value": 13000000,
+            "confirmations": 6
+        } for n in (3, 4)]
+    }))
+    request = {
+        "source_address": "mfetsqmVYU1m3w1MNXaDg4cvGYwXJB47Kx",
+        "outputs": {"mhnnkpnCfBkxN5KpfMArye2F376nATVJDW": "0.0001"},
+        "fee_kb": 25000,
+    }
+
+    responses = await asyncio.gather(*(client.post('/payment_transactions', json=request) for _ in range(2)))
+    first, second = [await response.json() for response in responses]
+    assert {first['inputs'][0]['vout'], second['inputs'][0]['vout']} == {3, 4}
+
+    response = await client.post('/payment_transactions', json=request)
+    assert response.status == 400
+    assert (await response.json())['error']['message'] == 'All confirmed UTXOs are reserved by other transactions'
+
+    response = await client.post(f'/reservations/{first["reservation_id"]}/confirm')
+    assert (await response.json())['status'] == 'confirmed'
+    response = await client.post(f'/reservations/{second["reservation_id"]}/release')
+    assert (await response.json())['status'] == 'released'
+
+    response = await client.post('/payment_transactions', json=request)
+    assert (await response.json())['inputs'] == second['inputs']
+
+    response = await client.post('/reservations/unknown/release')
+    assert response.status == 404
+    assert (await response.json())['error']['code'] == 'reservation_not_found'
+
+
+async def test_create_payouts(client: TestClient, mock_unspent_response: Any, monkeypatch: Any) -> None:
+    requested_addresses = []
+
+    def handler(request: web.Request) -> web.Response:
+        requested_addresses.append(request.query['active'])
+        return web.json_response({
+            "unspent_outputs": [{
+                "tx_hash_big_endian": "e7343a4167bb1c2419364a5f7d8868f8731eafa243df2dcf97111099eaabb40b",
+                "tx_output_n": 3,
+                "script": "76a9140180799618375ebd21bd67014deca9a167b8f91e88ac",
+                "value": 13000000,
+                "confirmations": 6
+            }]
+        })
+
+    await mock_unspent_response(handler)
+    monkeypatch.setattr(client.app['state']['payout_batcher'], 'max_outputs', 2)
+    payouts = [{
+        "source_address": "mfetsqmVYU1m3w1MNXaDg4cvGYwXJB47Kx",
+        "outputs": {address: "0.0001"},
+        "fee_kb": 25000,
+    } for address in ("mhnnkpnCfBkxN5KpfMArye2F376nATVJDW", "mvDvYba71W8at5sU9G8ELqQph8s7fKgbiA")]
+
+    responses = await asyncio.gather(*(client.post('/payouts', json=payout) for payout in payouts))
+    assert [response.status for response in responses] == [201, 201]
+    first, second = [await response.json() for response in responses]
+    # one transaction pays both and spends the only input
+    assert first['raw'] == second['raw']
+    assert first['output_indexes'] == [0]
+    assert second['output_indexes'] == [1]
+    assert first['batch_size'] == 2
+    assert requested_addresses == ["mfetsqmVYU1m3w1MNXaDg4cvGYwXJB47Kx"]
+
+
+async def test_create_transaction_with_idempotency_key(client: TestClient, mock_unspent_response: Any) -> None:
+    requested_addresses = []
+
+    def handler(request: web.Request) -> web.Response:
+        requested_addresses.append(request.query['active'])
+        return web.json_response({
+            "unspent_outputs": [{
+                "tx_hash_big_endian": "e7343a4167bb1c2419364a5f7d8868f8731eafa243df2dcf97111099eaabb40b",
+                "tx_output_n": n,
+                "script": "76a9140180799618375ebd21bd67014deca9a167b8f91e88ac",
+                "value": 13000000,
+                "confirmations": 6
+            } for n in (3, 4)]
+        })
+
+    await mock_unspent_response(handler)
+    request = {
+        "source_address": "mfetsqmVYU1m3w1MNXaDg4cvGYwXJB47Kx",
+        "outputs": {"mhnnkpnCfBkxN5KpfMArye2F376nATVJDW": "0.0001"},
+        "fee_kb": 25000,
+    }
+    headers = {'Idempotency-Key': 'payout-1'}
+
+    response = await client.post('/payment_transactions', json=request, headers=headers)
+    assert response.status == 201
+    first = await response.json()
+
+    # a retry gets the same transaction rather than one spending the other input
+    response = await client.post('/payment_transactions', json=request, headers=headers)
+    assert response.status == 201
+    assert response.headers['Idempotent-Replayed'] == 'true'
+    assert await response.json() == first
+    assert len(requested_addresses) == 1
+
+    response = await client.post('/payment_transactions', json={**request, "fee_kb": 30000}, headers=headers)
+    assert response.status == 422
+    assert (await response.json())['error']['code'] == 'idempotency_key_reused'
+
+
+async def test_quote_transaction(client: TestClient, mock_unspent_response: Any) -> None:
+    requested_addresses = []
+
+    def handler(request: web.Request) -> web.Response:
+        requested_addresses.append(request.query['active'])
+        return web.json_response({
+            "unspent_outputs": [{
+                "tx_hash_big_endian": "e7343a4167bb1c2419364a5f7d8868f8731eafa243df2dcf97111099eaabb40b",
+                "tx_output_n": 3,
+                "script": "76a9140180799618375ebd21bd67014deca9a167b8f91e88ac",
+                "value": 13000000,
+                "confirmations": 6
+            }]
+        })
+
+    await mock_unspent_response(handler)
+    request = {
+        "source_address": "mfetsqmVYU1m3w1MNXaDg4cvGYwXJB47Kx",
+        "outputs": {"mhnnkpnCfBkxN5KpfMArye2F376nATVJDW": "0.0001"},
+        "fee_kb": 25000,
+    }
+
+    response = await client.post('/payment_transactions/quote', json=request)
+    assert response.status == 200
+    quote = await response.json()
+    assert quote['inputs'][0]['amount'] == 13000000
+    assert quote['fee_kb'] == 25000
+    assert quote['fee'] + quote['change'] + 10000 == 13000000
+
+    # quotes are cached and don't reserve the inputs
+    response = await client.post('/payment_transactions/quote', json=request)
+    assert await response.json() == quote
+    assert len(requested_addresses) == 1
+    response = await client.post('/payment_transactions', json=request)
+    assert response.status == 201
+
+
+async def test_ready_after_warm_up(app: web.Application, aiohttp_client: Any, monkeypatch: Any) -> None:
+    monkeypatch.setattr(settings, 'warm_up', True)
+    client = await aiohttp_client(app)
+    await app['readiness'].wait()
+
+    response = await client.get('/ready')
+    assert response.status == 200
+    assert await response.json() == {
+        'ready': True,
+        'steps': {'app': 'done', 'upstream_pool': 'done', 'fee_rates': 'done', 'tx_executor': 'done'},
+    }
+    assert len(app['state']['tx_executor']._processes) == settings.tx_process_pool_size
+
+
+async def test_not_ready_while_loading(loop: Any, aiohttp_client: Any, monkeypatch: Any) -> None:
+    loaded = loop.create_future()
+
+    async def load_app(app: web.Application) -> None:
+        await loaded
+
+    monkeypatch.setattr(server, 'load_app', load_app)
+    app = await server.make_app()
+    client = await aiohttp_client(app)
+
+    response = await client.get('/ready')
+    assert response.status == 503
+    assert (await response.json())['steps'] == {'app': 'pending'}
+    response = await client.post('/payment_transactions', json={})
+    assert response.status == 503
+    assert (await response.json())['error']['code'] == 'not_ready'
+    loaded.set_result(None)
+
+
+async def test_create_transaction_server_timing(client: TestClient, mock_unspent_response: Any) -> None:
+    await mock_unspent_response(web.json_response({
+        "unspent_outputs": [{
+            "tx_hash_big_endian": "e7343a4167bb1c2419364a5f7d8868f8731eafa243df2dcf97111099eaabb40b",
+            "tx_output_n": 3,
+            "script": "76a9140180799618375ebd21bd67014deca9a167b8f91e88ac",
+            "value": 13000000,
+            "confirmations": 6
+        }]
+    }))
+    response = await client.post('/payment_transactions', json={
+        "source_address": "mfetsqmVYU1m3w1MNXaDg4cvGYwXJB47Kx",
+        "outputs": {"mhnnkpnCfBkxN5KpfMArye2F376nATVJDW": "0.0001"},
+        "fee_kb": 25000
+    })
+    assert response.status == 201
+
+    durations = {}
+    for metric in response.headers['Server-Timing'].split(', '):
+        stage, duration = metric.split(';dur=')
+        durations[stage] = float(duration)
+    assert list(durations) == ['validation', 'upstream', 'selection', 'serialization', 'json', 'total']
+    assert sum(durations.values()) - durations['total'] <= durations['total']
@@ -1,8 +1,10 @@
+import asyncio
+import json
 import os.path
 import socket
 import ssl
 from asyncio import AbstractEventLoop, get_event_loop
-from typing import Any, Dict, Iterable, List, Optional
+from typing import Any, Callable, Dict, Iterable, List, Optional
 
 from aiohttp import web
 from aiohttp.resolver import DefaultResolver
@@ -57,3 +59,46 @@ class FakeServer:
 
     async def stop(self) -> None:
         await self.runner.cleanup()
+
+
+class FakeElectrumServer:
+    """
+    A newline-delimited JSON-RPC server speaking the Electrum protocol over TLS.
+    handlers -- method -> callable(*params) returning a result
+    """
+
+    def __init__(self, handlers: Dict[str, Callable[..., Any]], loop: Optional[AbstractEventLoop] = None) -> None:
+        self.handlers = handlers
+        self.loop = loop or get_event_loop()
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.requests: List[Dict[str, Any]] = []
+        cert_dir = os.path.abspath(os.path.dirname(__file__))
+        self.ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        self.ssl_context.load_cert_chain(os.path.join(cert_dir, 'mock_server.crt'),
+                                         os.path.join(cert_dir, 'mock_server.key'))
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            request = json.loads(line)
+            self.requests.append(request)
+            handler = self.handlers.get(request['method'])
+            if handler is None:
+                response = {'id': request['id'], 'error': {'code': -32601, 'message': 'unknown method'}}
+            else:
+                response = {'id': request['id'], 'result': handler(*request['params'])}
+            writer.write(json.dumps(response).encode() + b'\n')
+        writer.close()
+
+    async def start(self) -> int:
+        port = unused_port()
+        self.server = await asyncio.start_server(self.handle_connection, '127.0.0.1', port,
+                                                 ssl=self.ssl_context)
+        return port
+
+    async def stop(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
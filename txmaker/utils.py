@@ -5,6 +5,15 @@ from typing import Any, Awaitable, Callable, Dict, Optional, Type
 
 from aiohttp import web
 from pydantic import BaseModel, ValidationError
+from pydantic.error_wrappers import ErrorWrapper
+
+from .config import settings
+from .metrics import ERRORS, JSON_SERIALIZATION, REQUEST_VALIDATION, timed_stage
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore
 
 
 class DecimalJsonEncoder(json.JSONEncoder):
@@ -14,33 +23,83 @@ class DecimalJsonEncoder(json.JSONEncoder):
         return super().default(obj)
 
 
-json_dumps = partial(json.dumps, cls=DecimalJsonEncoder, indent=2)
-json_response = partial(web.json_response, dumps=json_dumps)
+def decimal_to_str(obj: Any) -> str:
+    if isinstance(obj, Decimal):
+        return str(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
 
 
-def error_response(code: str, message: Optional[str] = None, *, details: Optional[Dict[str, Any]] = None,
-                   status_code: int = 400) -> web.Response:
+def make_json_dumps(pretty: bool = False) -> Callable[[Any], bytes]:
+    """
+    Compact output goes through orjson when it's installed, otherwise through the json module's C encoder
+    (which is only used without indentation). Decimals are serialized as exact strings either way
+    """
+    if pretty:
+        dumps = partial(json.dumps, cls=DecimalJsonEncoder, indent=2)
+    elif orjson is not None:
+        return partial(orjson.dumps, default=decimal_to_str, option=orjson.OPT_NON_STR_KEYS)
+    else:
+        dumps = partial(json.dumps, cls=DecimalJsonEncoder, separators=(',', ':'))
+    return lambda obj: dumps(obj).encode()
+
+
+json_dumps = make_json_dumps(settings.json_pretty)
+# both accept bytes, orjson doesn't need to decode them first
+json_loads: Callable[[bytes], Any] = orjson.loads if orjson is not None else json.loads
+
+
+def json_response(data: Any, *, status: int = 200) -> web.Response:
+    with timed_stage('json', JSON_SERIALIZATION):
+        body = json_dumps(data)
+    return web.Response(body=body, status=status, content_type='application/json')
+
+
+def error_body(code: str, message: Optional[str] = None, *,
+               details: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    ERRORS.labels(code).inc()
     error = {
         'code': code,
         'message': message,
     }
     if details is not None:
         error['details'] = details  # type: ignore
-    return json_response({'error': error}, status=status_code)
+    return {'error': error}
+
+
+def error_response(code: str, message: Optional[str] = None, *, details: Optional[Dict[str, Any]] = None,
+                   status_code: int = 400) -> web.Response:
+    return json_response(error_body(code, message, details=details), status=status_code)
+
+
+def parse_request(req_model: Type[BaseModel], body: bytes) -> BaseModel:
+    """
+    The same as req_model.parse_raw(), but the body isn't decoded to a string first
+    """
+    try:
+        obj = json_loads(body)
+    except (ValueError, TypeError) as e:
+        raise ValidationError([ErrorWrapper(e, loc='__obj__')], req_model)
+    return req_model.parse_obj(obj)
 
 
 AIOHTTP_HANDLER = Callable[[web.Request, BaseModel], Awaitable[web.Response]]
 
 
 def validate_request(req_model: Type[BaseModel]) -> Callable[[AIOHTTP_HANDLER], AIOHTTP_HANDLER]:
+    json_schema = req_model.schema()
+
     def decorator(handler: AIOHTTP_HANDLER) -> AIOHTTP_HANDLER:
         async def wrapped_handler(request: web.Request) -> web.Response:
-            body = await request.read() if request.can_read_body else '{}'
+            # unlike request.read(), the stream joins the received chunks without copying them to a bytearray
+            body = await request.content.read() if request.can_read_body else b'{}'
+            # kept for the handlers which need the raw body, e.g. to hash it
+            request['body'] = body
             try:
-                req_obj = req_model.parse_raw(body, content_type='application/json')
+                with timed_stage('validation', REQUEST_VALIDATION):
+                    req_obj = parse_request(req_model, body)
             except ValidationError as e:
                 return error_response('invalid_request_schema', 'Your request does not match the spec',
-                                      details={'debug_info': e.errors(), 'json_schema': req_model.schema()})
+                                      details={'debug_info': e.errors(), 'json_schema': json_schema})
             return await handler(request, req_obj)
         return wraps(handler)(wrapped_handler)
     return decorator
@@ -0,0 +1,23 @@
+import json
+from decimal import Decimal
+from typing import Any
+
+import pytest
+
+from . import utils
+from .utils import make_json_dumps
+
+DATA = {'amount': Decimal('0.12345678'), 'inputs': [{'vout': 1, 'txid': 'ab'}], 'message': None}
+
+
+@pytest.mark.parametrize('pretty', [False, True])
+def test_json_dumps_keeps_decimals_exact(pretty: bool) -> None:
+    dumped = make_json_dumps(pretty)(DATA)
+    assert isinstance(dumped, bytes)
+    assert json.loads(dumped) == {'amount': '0.12345678', 'inputs': [{'vout': 1, 'txid': 'ab'}], 'message': None}
+    assert (b'\n' in dumped) is pretty
+
+
+def test_json_dumps_without_orjson(monkeypatch: Any) -> None:
+    monkeypatch.setattr(utils, 'orjson', None)
+    assert make_json_dumps()(DATA) == b'{"amount":"0.12345678","inputs":[{"vout":1,"txid":"ab"}],"message":null}'
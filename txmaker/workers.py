@@ -0,0 +1,106 @@
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from multiprocessing.connection import wait
+from typing import Any, Callable, Dict, List, Optional
+
+from .listener import ConfigurationError, listener
+
+logger = logging.getLogger(__name__)
+
+
+def install_uvloop() -> None:
+    try:
+        import uvloop
+    except ImportError:
+        raise ConfigurationError('UVLOOP is enabled, but uvloop is not installed')
+    uvloop.install()
+
+
+def worker_count() -> int:
+    return listener.workers or os.cpu_count() or 1
+
+
+class Supervisor:
+    """
+    Runs worker processes, restarts the ones which die and stops them all gracefully on SIGTERM/SIGINT.
+    target -- a function run by every worker, it gets the worker's number
+    """
+
+    def __init__(self, target: Callable[[int], Any], n_workers: int, restart_delay: float = 1.0,
+                 shutdown_timeout: float = 30.0, on_exit: Optional[Callable[[int], Any]] = None) -> None:
+        self.target = target
+        self.n_workers = n_workers
+        self.restart_delay = restart_delay
+        self.shutdown_timeout = shutdown_timeout
+        # called with the pid of every exited worker
+        self.on_exit = on_exit
+        self.context = multiprocessing.get_context('spawn')
+        self.workers: Dict[int, Any] = {}
+        self.restarts: Dict[int, float] = {}
+        self.restart_count = 0
+        self.stopping = False
+
+    def start_worker(self, n: int) -> None:
+        process = self.context.Process(target=self.target, args=(n,), name=f'txmaker-worker-{n}')
+        process.start()
+        self.workers[n] = process
+
+    def stop(self, *args: Any) -> None:
+        self.stopping = True
+
+    def reap(self) -> None:
+        for n, process in list(self.workers.items()):
+            if process.is_alive():
+                continue
+            process.join()
+            del self.workers[n]
+            if self.on_exit is not None:
+                self.on_exit(process.pid)
+            if not self.stopping:
+                logger.warning('Worker %d (pid %d) exited with %s, restarting in %.1fs',
+                               n, process.pid, process.exitcode, self.restart_delay)
+                # a delay keeps a crashing worker from taking all the CPU
+                self.restarts[n] = time.monotonic() + self.restart_delay
+
+    def run(self) -> None:
+        handlers = {sig: signal.signal(sig, self.stop) for sig in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            self.supervise()
+        finally:
+            for sig, handler in handlers.items():
+                signal.signal(sig, handler)
+
+    def supervise(self) -> None:
+        for n in range(self.n_workers):
+            self.start_worker(n)
+
+        while not self.stopping:
+            wait([p.sentinel for p in self.workers.values()], timeout=0.2)
+            self.reap()
+            now = time.monotonic()
+            for n, restart_at in list(self.restarts.items()):
+                if restart_at <= now and not self.stopping:
+                    del self.restarts[n]
+                    self.restart_count += 1
+                    self.start_worker(n)
+
+        self.shutdown()
+
+    def shutdown(self) -> None:
+        """
+        Asks the workers to finish their requests, the ones not done in shutdown_timeout are killed
+        """
+        for process in self.workers.values():
+            process.terminate()
+        deadline = time.monotonic() + self.shutdown_timeout
+        for process in self.workers.values():
+            process.join(max(deadline - time.monotonic(), 0))
+        stuck: List[Any] = [p for p in self.workers.values() if p.is_alive()]
+        for process in stuck:
+            logger.warning('Worker pid %d did not stop in %.1fs, killing it', process.pid, self.shutdown_timeout)
+            process.kill()
+            process.join()
+        self.reap()
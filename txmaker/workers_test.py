@@ -0,0 +1,70 @@
+import os
+import signal
+import sys
+import threading
+import time
+from functools import partial
+from typing import Any, Callable, List
+
+from .workers import Supervisor
+
+
+def crash(worker: int) -> None:
+    sys.exit(1)
+
+
+def sleep(ready_path: str, worker: int) -> None:
+    open(ready_path, 'w').close()
+    time.sleep(60)
+
+
+def ignore_sigterm(ready_path: str, worker: int) -> None:
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    open(ready_path, 'w').close()
+    time.sleep(60)
+
+
+def run_until(supervisor: Supervisor, condition: Callable[[], bool], timeout: float = 30) -> float:
+    """
+    Runs the supervisor until the condition is met, returns the time it took to stop
+    """
+    stopped_at: List[float] = []
+
+    def watch() -> None:
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        stopped_at.append(time.monotonic())
+        supervisor.stop()
+
+    watcher = threading.Thread(target=watch)
+    watcher.start()
+    supervisor.run()
+    watcher.join()
+    return time.monotonic() - stopped_at[0]
+
+
+def test_supervisor_restarts_crashed_workers() -> None:
+    exited: List[int] = []
+    supervisor = Supervisor(crash, 2, restart_delay=0.05, on_exit=exited.append)
+    run_until(supervisor, lambda: supervisor.restart_count >= 2)
+    assert supervisor.restart_count >= 2
+    assert len(exited) >= supervisor.restart_count
+    assert not supervisor.workers
+
+
+def test_supervisor_stops_workers(tmp_path: Any) -> None:
+    ready_path = str(tmp_path / 'ready')
+    supervisor = Supervisor(partial(sleep, ready_path), 1, shutdown_timeout=10)
+    elapsed = run_until(supervisor, partial(os.path.exists, ready_path))
+    assert elapsed < 10
+    assert supervisor.restart_count == 0
+    assert not supervisor.workers
+
+
+def test_supervisor_kills_stuck_workers(tmp_path: Any) -> None:
+    ready_path = str(tmp_path / 'ready')
+    supervisor = Supervisor(partial(ignore_sigterm, ready_path), 1, shutdown_timeout=0.5)
+    elapsed = run_until(supervisor, partial(os.path.exists, ready_path))
+    assert 0.5 <= elapsed < 10
+    assert not supervisor.workers